@@ -7,8 +7,34 @@
 import argparse
 import math
 import os
+import shutil
 import sys
-import urllib.request
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
+import downloader
+
+# environment variable of DEM tile cache (defaults: ~/.tintpy/dem)
+DEM_CACHE_ENV = 'TINTPY_DEM_CACHE'
+
+# tile source of each DEM type and members kept from its archives
+SOURCES = {
+    'SRTM3011': 'srtm1',
+    'SRTM9011': 'srtm3',
+    'SRTM9055': 'srtm3_5x5',
+    'ALOS': 'alos30'
+}
+TILE_MEMBERS = {
+    'srtm1': '*.hgt',
+    'srtm3': '*.hgt',
+    'srtm3_5x5': '*.tif',
+    'alos30': '*_DSM.tif'
+}
+
+# buffer size for copying files out of archive
+COPY_BUFFER = 16 * 1024 * 1024
 
 
 no_srtm_dem = """01_01-01_03-01_04-01_05-01_06-01_08-01_09-01_10-01_11-01_13-
@@ -184,7 +210,7 @@ def srtm_dem9055(s, n, w, e):
 def srtm_dem11(s, n, w, e, flag):
     # 30m or 90m srtm dem of 1*1 degree
     number = 1
-    if flag.upper() == 'SRTM90':
+    if flag.upper().startswith('SRTM90'):
         number = 3
     HEADER = "https://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL{}.003/2000.02.11/".format(
         number)
@@ -219,7 +245,7 @@ def srtm_dem11(s, n, w, e, flag):
                     name = "N{}E{}.SRTMGL{}.hgt.zip".format(
                         add_zero(i, 'SN'), add_zero(j, 'WE'), number)
                 else:
-                    name = "N{}W{}.SRTMGL{}}.hgt.zip".format(
+                    name = "N{}W{}.SRTMGL{}.hgt.zip".format(
                         add_zero(i, 'SN'), add_zero(j, 'WE'), number)
             else:
                 if j >= 0:
@@ -261,39 +287,157 @@ def get_urls(flag, bound):
     return download_urls
 
 
-def download_progress(blocknum, blocksize, totalsize):
-    """
-    :param blocknum: downloaded block number
-    :param blocksize: block size
-    :param totalsize: file size
-    """
-    percent = 100.0 * blocknum * blocksize / totalsize
-    if percent > 100:
-        percent = 100
-        print("\rDownloaded: " + "#" * int(percent / 2) + " %.2f%%" % percent,
-              end=" ",
-              flush=True)
+def get_tile_id(url):
+    """tile id of DEM url, e.g. srtm_57_06, N30E100, N030E100_N035E105"""
+    name = downloader.url_name(url)
+    for ext in ['.tar.gz', '.zip']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name.split('.')[0]
+
+
+def get_cache_dir(cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.environ.get(DEM_CACHE_ENV,
+                                   os.path.join(os.path.expanduser('~'), '.tintpy', 'dem'))
+    return os.path.abspath(cache_dir)
+
+
+def list_tile(tile_dir):
+    """files of tile in cache"""
+    return sorted(os.path.join(tile_dir, i) for i in os.listdir(tile_dir))
+
+
+def extract_tile(archive, tile_dir, pattern):
+    """extract only members matching pattern of archive into tile_dir, return files"""
+    tmp_dir = tile_dir + '.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                if name and fnmatch(name, pattern):
+                    with zf.open(info) as src, open(os.path.join(tmp_dir, name), 'wb') as f:
+                        shutil.copyfileobj(src, f, COPY_BUFFER)
     else:
-        print("\rDownloading: " + "#" * int(percent / 2) + " %.2f%%" % percent,
-              end=" ",
-              flush=True)
+        with tarfile.open(archive) as tf:
+            for info in tf:
+                name = os.path.basename(info.name)
+                if info.isfile() and fnmatch(name, pattern):
+                    with tf.extractfile(info) as src, open(os.path.join(tmp_dir, name), 'wb') as f:
+                        shutil.copyfileobj(src, f, COPY_BUFFER)
+    if not os.listdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+        return []
+    # tile is in cache only if all of its files are extracted
+    os.replace(tmp_dir, tile_dir)
+    return list_tile(tile_dir)
 
 
-def download_dem(url, save_path):
-    abs_path = os.path.join(save_path, url.split('/')[-1])
+def fetch_tile(url, source_dir, pattern, session, cache):
+    """files of tile from cache, downloaded and extracted if not cached"""
+    tile_dir = os.path.join(source_dir, get_tile_id(url))
+    if os.path.isdir(tile_dir):
+        return list_tile(tile_dir)
+    archive = os.path.join(source_dir, downloader.url_name(url))
+    if not downloader.download(url, archive, session, cache=cache):
+        return []
     try:
-        urllib.request.urlretrieve(url, abs_path, download_progress)
-    except Exception as e:
-        print(f'{e}')
+        files = extract_tile(archive, tile_dir, pattern)
+    except (zipfile.BadZipFile, tarfile.TarError, OSError) as e:
+        print('cannot extract {}: {}'.format(archive, e))
+        return []
+    if not files:
+        print('no {} in {}'.format(pattern, archive))
+    os.remove(archive)
+    return files
+
+
+def import_tile(url, source_dir, pattern, import_dir):
+    """files of tile extracted into cache from archive downloaded manually"""
+    archive = os.path.join(import_dir, downloader.url_name(url))
+    if not os.path.isfile(archive):
+        return []
+    tile_dir = os.path.join(source_dir, get_tile_id(url))
+    try:
+        files = extract_tile(archive, tile_dir, pattern)
+    except (zipfile.BadZipFile, tarfile.TarError, OSError) as e:
+        print('cannot extract {}: {}'.format(archive, e))
+        return []
+    if files:
+        print('{} imported.'.format(downloader.url_name(url)))
+    else:
+        print('no {} in {}'.format(pattern, archive))
+    return files
+
+
+def get_tile_dir(url, flag, cache_dir=None):
+    """directory of tile in cache"""
+    return os.path.join(get_cache_dir(cache_dir), SOURCES[flag.upper()],
+                        get_tile_id(url))
+
+
+def fetch_tiles(urls, flag, cache_dir=None, num_threads=4, download=True,
+                import_dir=None):
+    """{url: files} of tiles in cache, missing tiles are fetched concurrently
+
+    archives of missing tiles found in import_dir are extracted first.
+    """
+    source = SOURCES[flag.upper()]
+    source_dir = os.path.join(get_cache_dir(cache_dir), source)
+    if not os.path.isdir(source_dir):
+        os.makedirs(source_dir)
+    if import_dir:
+        for url in urls:
+            if not os.path.isdir(os.path.join(source_dir, get_tile_id(url))):
+                import_tile(url, source_dir, TILE_MEMBERS[source], import_dir)
+    if not download:
+        tiles = {}
+        for url in urls:
+            tile_dir = os.path.join(source_dir, get_tile_id(url))
+            tiles[url] = list_tile(tile_dir) if os.path.isdir(tile_dir) else []
+        return tiles
+    session = downloader.make_session(num_threads)
+    cache = downloader.DownloadCache(source_dir)
+
+    def fetch(url):
+        return fetch_tile(url, source_dir, TILE_MEMBERS[source], session, cache)
+
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        files = list(executor.map(fetch, urls))
+    return dict(zip(urls, files))
+
+
+def link_tiles(files, out_dir):
+    """hard link (copy if not possible) files of tiles into out_dir"""
+    for f in files:
+        dst = os.path.join(out_dir, os.path.basename(f))
+        if os.path.exists(dst):
+            continue
+        try:
+            os.link(f, dst)
+        except OSError:
+            shutil.copy(f, dst)
+
+
+def download_dem(url, save_path):
+    abs_path = os.path.join(save_path, downloader.url_name(url))
+    return downloader.download(url, abs_path, cache=downloader.DownloadCache(save_path))
 
 
 EXAMPLE = '''Example:
   # only get urls of srtm30 or srtm90 (1*1 degree)
   python download_dem.py srtm30 30 40 100 105
   # get urls srtm90 and download them (5*5 degrees)
-  python download_dem.py srtm9055 30 40 100 105 /ly/dem
+  python download_dem.py srtm9055 30 40 100 105 -o /ly/dem
   # get urls of alos DEM and download them
-  python download_dem.py alos 30 40 100 105 /ly/dem
+  python download_dem.py alos 30 40 100 105 -o /ly/dem
+  # download 8 tiles at the same time into tile cache
+  python download_dem.py srtm9055 30 40 100 120 -o /ly/dem -t 8 -c /ly/dem_cache
+  # put srtm30 zips downloaded manually (with login) into tile cache
+  python download_dem.py srtm3011 30 40 100 105 -o /ly/dem -i /ly/srtm_zips
 '''
 
 
@@ -314,6 +458,22 @@ def cmdline_parser():
                         dest='out_dir',
                         type=str,
                         help='directory path of saving DEM')
+    parser.add_argument('-t',
+                        dest='threads',
+                        type=int,
+                        default=4,
+                        help='number of DEM downloaded at the same time (default: 4)')
+    parser.add_argument('-c',
+                        dest='cache_dir',
+                        type=str,
+                        default=None,
+                        help=f'directory of DEM tile cache (default: ${DEM_CACHE_ENV} or ~/.tintpy/dem)')
+    parser.add_argument('-i',
+                        '--import',
+                        dest='import_dir',
+                        type=str,
+                        default=None,
+                        help='directory of DEM archives downloaded manually, imported into tile cache')
     return parser
 
 
@@ -324,20 +484,34 @@ def main():
     flag = args.flag
     bound = args.bound
     out_dir = args.out_dir
+    import_dir = args.import_dir
+    if import_dir and not os.path.isdir(import_dir):
+        print('{} not exists.'.format(import_dir))
+        sys.exit(1)
     if out_dir:
         out_dir = os.path.abspath(out_dir)
         if not os.path.isdir(out_dir):
             os.mkdir(out_dir)
     # get urls of DEM
     download_urls = get_urls(flag, bound)
-    # download DEM
-    if flag.upper() in ['ALOS', 'SRTM9055'] and out_dir:
-        print("start to download:")
-        for url in download_urls:
-            print(f"{url.split('/')[-1]}")
-            download_dem(url, out_dir)
-    if flag.upper() in ['SRTM3011', 'SRTM9011'] and out_dir:
-        print('cannot download SRTM DEM (1*1 degree), you have to download them manually.')
+    # get tiles from cache, download missing tiles
+    if out_dir:
+        urls = [url for url in download_urls if url != 'No SRTM DEM']
+        # SRTM DEM (1*1 degree) needs login, only tiles in cache are used
+        download = flag.upper() in ['ALOS', 'SRTM9055']
+        if download:
+            print("start to download:")
+        tiles = fetch_tiles(urls, flag, args.cache_dir, args.threads, download,
+                            import_dir)
+        missing = [url for url in urls if not tiles[url]]
+        for url in urls:
+            link_tiles(tiles[url], out_dir)
+        print('\n{}/{} DEM tiles in {}'.format(len(urls) - len(missing), len(urls), out_dir))
+        if missing and not download:
+            print('cannot download SRTM DEM (1*1 degree), you have to download them manually,')
+            print('then import them by -i or extract them into tile directory:')
+            for url in missing:
+                print('{}\n  -> {}{}'.format(url, get_tile_dir(url, flag, args.cache_dir), os.sep))
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@
 # Copyright (c) 2020, Lei Yuan                                                  #
 #################################################################################
 from osgeo import gdal
+import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from skimage import io
@@ -12,6 +13,17 @@ import argparse
 import os
 import sys
 
+# MB of DEM read at a time in streaming mode
+BLOCK_SIZE = 64
+# longer side of image plotted in streaming mode
+PLOT_SIZE = 2000
+
+# GDAL data type -> big-endian dtype and GAMMA format, ENVI data type
+DEM_TYPES = {
+    gdal.GDT_Int16: ('>i2', 'INTEGER*2', 2),
+    gdal.GDT_Float32: ('>f4', 'REAL*4', 4)
+}
+
 
 def load_data(tif, band=1):
     ds = gdal.Open(tif, gdal.GA_ReadOnly)
@@ -91,7 +103,7 @@ def write_gamma_par(FILE, Corner_LON, Corner_LAT, X_STEP, Y_STEP, WIDTH,
     f.close()
 
 
-def write_saracape_par(FILE, extent, size):
+def write_saracape_par(FILE, extent, size, data_type=2):
     hdr = open(FILE + '_dem.hdr', 'w')
     hdr.write("ENVI\n")
     hdr.write("description = {\n")
@@ -103,7 +115,7 @@ def write_saracape_par(FILE, extent, size):
     hdr.write("bands                     = 1\n")
     hdr.write("headeroffset              = 0\n")
     hdr.write("file type                 = ENVI Standard\n")
-    hdr.write("data type                 = 2\n")
+    hdr.write(f"data type                 = {data_type}\n")
     hdr.write("sensor type               = Unknown\n")
     hdr.write("interleave                = bsq\n")
     hdr.write("byte order                = 0\n")
@@ -140,7 +152,7 @@ def write_saracape_par(FILE, extent, size):
     sml.write('    <RowPrefix>0</RowPrefix>\n')
     sml.write('    <RowSuffix>0</RowSuffix>\n')
     sml.write('    <FooterLen>0</FooterLen>\n')
-    sml.write('    <CellType>SHORT</CellType>\n')
+    sml.write('    <CellType>{}</CellType>\n'.format('FLOAT' if data_type == 4 else 'SHORT'))
     sml.write('    <DataUnits>DEM</DataUnits>\n')
     sml.write('    <NullCellValue>-32768</NullCellValue>\n')
     sml.write(f'    <NrOfPixelsPerLine>{size[1]}</NrOfPixelsPerLine>\n')
@@ -204,10 +216,90 @@ def make_dem(processor, tif, out_name, extent, size):
         write_saracape_par(out_name, extent, size)
 
 
+def build_vrt(tifs, vrt):
+    """virtual mosaic of tif(hgt) files, nothing is read"""
+    ds = gdal.BuildVRT(vrt, tifs)
+    if ds is None:
+        print(f"cannot build {vrt}.")
+        sys.exit(1)
+    return ds
+
+
+def get_geo_info(ds):
+    """extent and size of dataset from its geotransform"""
+    trans = ds.GetGeoTransform()
+    xsize = ds.RasterXSize
+    ysize = ds.RasterYSize
+    extent = [
+        trans[0], trans[0] + xsize * trans[1], trans[3] + ysize * trans[5],
+        trans[3]
+    ]
+    size = [xsize, ysize, trans[1], trans[5]]
+    return extent, size
+
+
+def get_block_lines(ds, itemsize, block_size=BLOCK_SIZE):
+    """lines read at a time to keep block under block_size (MB)"""
+    return max(1, int(block_size * 2**20 // (ds.RasterXSize * itemsize)))
+
+
+def write_blocks(ds, out_file, dtype, block_lines):
+    """write first band of dataset as raw binary (dtype) block by block"""
+    band = ds.GetRasterBand(1)
+    xsize, ysize = ds.RasterXSize, ds.RasterYSize
+    with open(out_file, 'wb') as f:
+        for y in range(0, ysize, block_lines):
+            lines = min(block_lines, ysize - y)
+            data = band.ReadAsArray(0, y, xsize, lines)
+            f.write(data.astype(dtype, copy=False).tobytes())
+            print(f"\rWriting: {y + lines}/{ysize} lines", end=" ", flush=True)
+    print()
+
+
+def read_overview(ds, max_size=PLOT_SIZE):
+    """first band of dataset read at reduced resolution for plotting"""
+    xsize, ysize = ds.RasterXSize, ds.RasterYSize
+    step = max(1, int(np.ceil(max(xsize, ysize) / max_size)))
+    return ds.GetRasterBand(1).ReadAsArray(buf_xsize=max(1, xsize // step),
+                                           buf_ysize=max(1, ysize // step))
+
+
+def make_dem_stream(processor, tifs, out_name, block_size=BLOCK_SIZE):
+    """mosaic tifs by VRT and write DEM block by block, return overview and extent"""
+    vrt = out_name + '.vrt'
+    ds = build_vrt(tifs, vrt)
+    extent, size = get_geo_info(ds)
+    data_type = ds.GetRasterBand(1).DataType
+    if data_type not in DEM_TYPES:
+        # other types are written as float
+        data_type = gdal.GDT_Float32
+    dtype, data_format, envi_type = DEM_TYPES[data_type]
+    block_lines = get_block_lines(ds, np.dtype(dtype).itemsize, block_size)
+
+    if processor.upper() == 'GAMMA':
+        write_blocks(ds, out_name + '.dem', dtype, block_lines)
+        # corner of GAMMA DEM is center of upper left pixel
+        write_gamma_par(out_name + '.dem.par', extent[0] + size[2] / 2,
+                        extent[3] + size[3] / 2, size[2], size[3], size[0],
+                        size[1], data_format)
+
+    if processor.upper() == 'SARSCAPE' or processor.upper() == 'ENVI':
+        # ENVI DEM is little-endian (byte order = 0)
+        write_blocks(ds, out_name + '_dem', dtype.replace('>', '<'), block_lines)
+        write_saracape_par(out_name, extent, size, envi_type)
+
+    data = read_overview(ds)
+    ds = None
+    return data, extent
+
+
 EXAMPLE = '''Example:
   python3 make_dem.py -p sarscape -t 1.tif -o dem
   python3 make_dem.py -p gamma -t 1.tif 2.tif -o dem
   python3 make_dem.py -p gamma -t D:\\1.tif D:\\2.tif -o D:\\dem
+  # mosaic and write DEM block by block (64 MB at a time)
+  python3 make_dem.py -p gamma -t /ly/dem_tiles/*.hgt -o /ly/dem --stream
+  python3 make_dem.py -p envi -t /ly/dem_tiles/*.tif -o /ly/dem --stream --block 256
 '''
 
 
@@ -233,6 +325,13 @@ def cmdline_parser():
                         type=str,
                         required=True,
                         help='output name of the generated DEM')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='mosaic by VRT and write DEM block by block without loading it')
+    parser.add_argument('--block',
+                        type=int,
+                        default=BLOCK_SIZE,
+                        help=f'MB of DEM read at a time in streaming mode (default: {BLOCK_SIZE})')
     return parser
 
 
@@ -262,8 +361,15 @@ def main():
         if not os.path.exists(dir_name):
             print(f"'{dir_name}' doesn't exist, please check it.")
     dem_name = os.path.basename(args.out)
+    if args.stream:
+        print(f"Make {processor} dem block by block.")
+        data, extent = make_dem_stream(processor, tifs, args.out, args.block)
+        print('Plot overview.')
+        plot_data(data, extent, dem_name + '.png')
+        data = None
+        print('Done.')
     # process tif (mosaic read plot)
-    if len(tifs) > 1:
+    elif len(tifs) > 1:
         # mosaic tif
         print('Mosaic tifs.')
         mosaiced_tif = dem_name + '.tif'
@@ -9,6 +9,8 @@ import os
 import re
 import sys
 
+from gamma_par import read_gamma_par
+
 
 def cmdline_parser():
     parser = argparse.ArgumentParser(
@@ -41,16 +43,6 @@ def get_raw_slc(slc_dir):
     return all_slc
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def view_amp(slc, slc_par, rlks, alks):
     width = read_gamma_par(slc_par, 'range_samples')
     if width:
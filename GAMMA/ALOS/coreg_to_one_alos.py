@@ -11,6 +11,8 @@ import shutil
 import glob
 import sys
 
+from gamma_par import read_gamma_par
+
 
 def cmd_line_parser():
     parser = argparse.ArgumentParser(description='Co-register all of the ALOS SLCs to a reference SLC.',
@@ -47,16 +49,6 @@ EXAMPLE = """Usage:
 """
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def gen_bmp(slc, slc_par, rlks, alks):
     width = read_gamma_par(slc_par, 'range_samples')
     bmp = slc + '.bmp'
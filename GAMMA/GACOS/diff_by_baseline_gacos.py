@@ -10,229 +10,97 @@ import re
 import argparse
 import sys
 
-dinsar_script = """m_slc=$slc_dir/$m_date/$m_date.slc
-s_slc=$slc_dir/$s_date/$s_date.slc
-m_par=$m_slc.par
-s_par=$s_slc.par
-MS_off=$m_date-$s_date.off
+from pipeline import run_pipeline
+from dinsar_steps import awk_par, pair_files, dinsar_pipeline
+from stack_geometry import get_geo_dir, prep_geometry
+
+
+def add_gacos_steps(pl, f, m_date, s_date, gacos_dir):
+    """subtract gacos aps phase, filter, unwrap and compare with uncorrected ifg"""
+    ifg, off, width, line = f['ifg'], f['off'], f['width'], f['line']
+    pwr1 = f['pwr1']
+    m_phs, s_phs = m_date + '_rot.phs', s_date + '_rot.phs'
+    m_ztd = os.path.join(gacos_dir, m_date + '.ztd')
+    s_ztd = os.path.join(gacos_dir, s_date + '.ztd')
+    width_map = awk_par('width', 'dem_seg.par')
+    inc_angle = awk_par('incidence_angle', f['pwr1_par'])
+    gacos = ifg + '.diff.int.gacos'
+    gacos_sm = gacos + '.sm'
+    gacos_cc = ifg + '.diff.gacos.sm.cc'
+    gacos_mask = ifg + '.gacos.sm.cc_mask.bmp'
+    gacos_unw = gacos_sm + '.unw'
+    gacos_sub_unw = gacos_sm + '.sub.unw'
+    # interpolate and rotate gacos ztd to dem_seg
+    pl.add('rot_interp_gacos',
+           f"matlab -nodesktop -nosplash -r \"rot_interp_gacos('{m_ztd}','{s_ztd}','dem_seg.par','{m_phs}','{s_phs}');quit;\"",
+           [m_ztd, m_ztd + '.rsc', s_ztd, s_ztd + '.rsc', 'dem_seg.par'],
+           [m_phs, s_phs])
+    for date, phs in [('m', m_phs), ('s', s_phs)]:
+        pl.add(f'geocode_{date}_phs',
+               f"geocode lookup_fine {phs} {width_map} {phs}.rdr {width} {line} 1 0",
+               ['lookup_fine', phs, 'dem_seg.par', off], [phs + '.rdr'])
+        pl.add(f'raspwr_{date}_phs',
+               f"raspwr {phs}.rdr {width} 1 0 1 1 1. .35 1 {phs}.rdr.bmp",
+               [phs + '.rdr', off], [phs + '.rdr.bmp'])
+    # subtract gacos aps phase
+    pl.add('sub_gacos',
+           f"matlab -nodesktop -nosplash -r \"sub_gacos('{f['diff']}','{m_phs}.rdr','{s_phs}.rdr',{inc_angle},{line});quit;\"",
+           [f['diff'], m_phs + '.rdr', s_phs + '.rdr', f['pwr1_par'], off],
+           [gacos])
+    pl.add('rasmph_pwr_gacos',
+           f"rasmph_pwr {gacos} {pwr1} {width} 1 1 0 1 1 1. 0.35 1 {gacos}.pwr.bmp",
+           [gacos, pwr1, off], [gacos + '.pwr.bmp'])
+    # filter
+    pl.add('adf_gacos_1',
+           f"adf {gacos} {gacos}.sm1 {ifg}.diff.gacos.sm.cc1 {width} 0.3 128",
+           [gacos, off], [gacos + '.sm1', ifg + '.diff.gacos.sm.cc1'])
+    pl.add('adf_gacos_2',
+           f"adf {gacos}.sm1 {gacos}.sm2 {ifg}.diff.gacos.sm.cc2 {width} 0.3 64",
+           [gacos + '.sm1', off], [gacos + '.sm2', ifg + '.diff.gacos.sm.cc2'])
+    pl.add('adf_gacos_3',
+           f"adf {gacos}.sm2 {gacos_sm} {gacos_cc} {width} 0.3",
+           [gacos + '.sm2', off], [gacos_sm, gacos_cc])
+    pl.add('rasmph_gacos_sm',
+           f"rasmph {gacos_sm} {width} 1 0 1 1 1. 0.35 1 {gacos_sm}.bmp",
+           [gacos_sm, off], [gacos_sm + '.bmp'])
+    pl.add('rasmph_pwr_gacos_sm',
+           f"rasmph_pwr {gacos_sm} {pwr1} {width} 1 1 0 1 1 1. 0.35 1 {gacos_sm}.pwr.bmp",
+           [gacos_sm, pwr1, off], [gacos_sm + '.pwr.bmp'])
+    # unwrap
+    pl.add('rascc_mask_gacos',
+           f"rascc_mask {gacos_cc} {pwr1} {width} 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 {gacos_mask}",
+           [gacos_cc, pwr1, off], [gacos_mask])
+    pl.add('mcf_gacos',
+           f"mcf {gacos_sm} {gacos_cc} {gacos_mask} {gacos_unw} {width} 1 0 0 - - 1 1 - - - 0",
+           [gacos_sm, gacos_cc, gacos_mask, off], [gacos_unw])
+    pl.add('rasrmg_gacos_unw_pwr',
+           f"rasrmg {gacos_unw} {pwr1} {width} 1 1 0 1 1 .6 1. .35 .0 1 {gacos_unw}.pwr.bmp {gacos_cc} 1 .2",
+           [gacos_unw, pwr1, gacos_cc, off], [gacos_unw + '.pwr.bmp'])
+    pl.add('rasrmg_gacos_unw',
+           f"rasrmg {gacos_unw} - {width} 1 1 0 1 1 .5 1. .35 .0 1 {gacos_unw}.bmp {gacos_cc} 1 .2",
+           [gacos_unw, gacos_cc, off], [gacos_unw + '.bmp'])
+    # subtracting linear phase trends
+    pl.add('quad_fit_gacos',
+           f"quad_fit {gacos_unw} {f['diff_par']} 32 32 {gacos_mask} {ifg}.plot 3",
+           [gacos_unw, f['diff_par'], gacos_mask],
+           [f['diff_par'], ifg + '.plot'])
+    pl.add('quad_sub_gacos',
+           f"quad_sub {gacos_unw} {f['diff_par']} {gacos_sub_unw} 0 0",
+           [gacos_unw, f['diff_par']], [gacos_sub_unw])
+    pl.add('rasrmg_gacos_sub_unw_pwr',
+           f"rasrmg {gacos_sub_unw} {pwr1} {width} 1 1 0 1 1 .6 1. .35 .0 1 {gacos_sub_unw}.pwr.bmp {gacos_cc} 1 .2",
+           [gacos_sub_unw, pwr1, gacos_cc, off], [gacos_sub_unw + '.pwr.bmp'])
+    pl.add('rasrmg_gacos_sub_unw',
+           f"rasrmg {gacos_sub_unw} - {width} 1 1 0 1 1 .5 1. .35 .0 1 {gacos_sub_unw}.bmp {gacos_cc} 1 .2",
+           [gacos_sub_unw, gacos_cc, off], [gacos_sub_unw + '.bmp'])
+    # statistics of atmospheric correction
+    range_spacing = awk_par('interferogram_range_pixel_spacing', off)
+    azimuth_spacing = awk_par('interferogram_azimuth_pixel_spacing', off)
+    pl.add('ato_statistical',
+           f"matlab -nodesktop -nosplash -r \"ato_statistical('{gacos_sub_unw}','{f['sub_unw']}',{inc_angle},{line},{width},{range_spacing},{azimuth_spacing});quit;\"",
+           [gacos_sub_unw, f['sub_unw'], f['pwr1_par'], off])
+    pl.temp_files += [m_phs, s_phs]
 
-##################################################################################################################
-### Supports interactive creation of offset/processing parameter file for generation of interferograms
-### create_offset reads the SLC parameter files and queries the user for parameters(write into the .off file) required to calculate the offsets 
-### using either the cross correlation of intensity or fringe visibility algorithms
-### a. scence title: interferogram parameters
-### b. range,azimuth offsets of SLC-2 relative to SLC-1(SLC samples):0 0
-### c. enter number of offset measurements in range, azimuth: 32 32
-### e. search window sizes(range, azimuth, nominal: 64 64)
-### f. low correlation SNR threshold for intensity cross correlation 7.0
-### g. offset in range to first interfergram sample 0
-### h. width of SLCsection to processes (width of SLC-1)
-##################################################################################################################
-echo -ne "$m_date-$s_date\\n 0 0\\n 32 32\\n 64 64\\n 7.0\\n 0\\n\\n" > create_offset
-create_offset $m_par $s_par $MS_off 1 1 1 < create_offset
-rm -f create_offset
-
-##################################################################################################################
-### first guess of the offsets can be obtained based on orbital information
-### The position of the initial registration offset estimation can be indicated. As default the SLC-1 image center is used.
-##################################################################################################################
-init_offset_orbit $m_par $s_par $MS_off
-
-##################################################################################################################
-### improve the first guess, determines the initial offsets based on the cross-correlation function of the image intensities
-### In order to avoid ambiguity problems and achieve an accutare estimates init_offset first be run with multi-looking
-### followed by a second run at single look resolution
-##################################################################################################################
-init_offset $m_slc $s_slc $m_par $s_par $MS_off 9 10
-init_offset $m_slc $s_slc $m_par $s_par $MS_off 1 1
-
-##################################################################################################################
-### the first time offset_pwr and offset_fit, Estimation of offsets 
-### first time with larger windowsize
-### offset_pwr estimates the range and azimuth registration offset fields using correlation optimization of the detected SLC data
-### determine the bilinear registration offset polynomial using a least squares error method
-### offset_fit computes range and azimuth registration offset polynomials from offsets estimated by one of the programs offset_pwr
-##################################################################################################################
-offset_pwr $m_slc $s_slc $m_par $s_par $MS_off $m_date-$s_date.offs $m_date-$s_date.off.snr 256 256 $m_date-$s_date.offsets 1 100 100 7.0 2
-offset_fit $m_date-$s_date.offs $m_date-$s_date.off.snr $MS_off $m_date-$s_date.coffs $m_date-$s_date.coffsets 9 4 0
-cp $m_date-$s_date.offsets offsets_datewr_1
-cp $m_date-$s_date.coffsets coffsets_datewr_1
-
-##################################################################################################################
-### resample  slc
-##################################################################################################################
-SLC_interp $s_slc $m_par $s_par $MS_off $s_date.rslc $s_date.rslc.par
-
-##################################################################################################################
-### Generation of interferogram with multi-look factors rlks * alks
-##################################################################################################################
-SLC_intf $m_slc $s_date.rslc $m_par $s_date.rslc.par $MS_off $m_date-$s_date.int $rlks $alks - - 1 1
-
-##################################################################################################################
-### Generation of multi-look SARintensity image of reference SLC
-##################################################################################################################
-multi_look $m_slc $m_par  $m_date-$s_date.pwr1 $m_date.pwr1.par $rlks $alks
-multi_look $s_date.rslc $s_date.rslc.par $m_date-$s_date.pwr2 $s_date.pwr2.par $rlks $alks
-width=$(awk '$1 == "interferogram_width:" {print $2}' $MS_off)
-line=$(awk '$1 == "interferogram_azimuth_lines:" {print $2}' $MS_off)
-rasmph_pwr $m_date-$s_date.int $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.intandpwr.bmp
-raspwr $m_date-$s_date.pwr1 $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.pwr1.bmp
-raspwr $m_date-$s_date.pwr2 $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.pwr2.bmp
-base_init $m_par $s_par $MS_off $m_date-$s_date.int $m_date-$s_date.base 0 1024 1024
-base_perp $m_date-$s_date.base $m_par $MS_off > $m_date-$s_date.base.perp
-
-##################################################################################################################
-### Curved Earth phase trend removal("flattening")
-### ph_slop_base Subtract/add interferogram flat-Earth phase trend as estimated from initial baseline
-##################################################################################################################
-ph_slope_base $m_date-$s_date.int $m_par $MS_off $m_date-$s_date.base $m_date-$s_date.flt 1 0
-rasmph_pwr $m_date-$s_date.flt $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.fltandpwr.bmp
-cc_wave $m_date-$s_date.int $m_par $s_date.rslc.par $m_date-$s_date.corr $width - - 3
-
-##################################################################################################################
-### filter flattened interferogram
-##################################################################################################################
-adf $m_date-$s_date.flt $m_date-$s_date.flt.sm1 $m_date-$s_date.sm.cc1 $width 0.3 128
-adf $m_date-$s_date.flt.sm1 $m_date-$s_date.flt.sm2 $m_date-$s_date.sm.cc2 $width 0.3 64
-adf $m_date-$s_date.flt.sm2 $m_date-$s_date.flt.sm $m_date-$s_date.sm.cc $width 0.3
-rasmph_pwr $m_date-$s_date.flt.sm $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.fltsmpwr.bmp
-gc_map $m_par $MS_off $dem_par $dem dem_seg.par dem_seg lookup 1 1 sim_sar - - - - - - 8 1
-width_map=$(awk '$1 == "width:" {print $2}' dem_seg.par)
-nlines_map=$(awk '$1 == "nlines:" {print $2}' dem_seg.par)
-col_post=$(awk '$1 == "post_lat:" {print $2}' dem_seg.par)
-row_post=$(awk '$1 == "post_lon:" {print $2}' dem_seg.par)
-rasshd dem_seg $width_map $col_post $row_post 1 0 1 1 45. 135. 1 dem_seg.bmp
-
-##################################################################################################################
-### geocode the simulated SAR intensity image to radar coordinate
-### when gc_map computes the lookup table it can also compute a simulated SAR image in the map coordinate system
-### geocode:Forward transformation with a geocoding look-up table
-### For each image point defined in coordinate system A, the lookup table contains the corresponding coordinates in system B
-### The program geocode is used to resample the data in coordinate system A into the coordinates of system B
-##################################################################################################################
-geocode lookup sim_sar $width_map sim_sar_rdc $width $line 1 0
-raspwr sim_sar_rdc $width 1 0 1 1 1. .35 1 sim_sar_rdc.bmp
-
-##################################################################################################################
-### create a parameter file including the differential interferogram parameters
-### create_diff_par: reads two parameter files(.off,.slc.par,.mli.par,.dem_datear)and creates a DIFF parameter file used for 
-### image registration,geocoding, and 2- and 3-pass differential interferometry
-##################################################################################################################
-echo -ne "$m_date-$s_date\\n 0 0\\n 64 64\\n 256 256\\n 7.0\\n" > create_diff_parin
-create_diff_par $MS_off - $m_date-$s_date.diff.par 0 < create_diff_parin
-rm -f create_diff_parin
-
-##################################################################################################################
-### compute offset of simulated SAR image to slc(mli) image
-### init_offsetm: initial registration offset estimation for multilook intensity images
-### offset_pwrm: estimates the range and azimuth registration offset fields using cross correlation optimization of the input intensity images
-### offset_fitm: computes range and azimuth registration offset polynomials from offsets estimated by one of the program offset_pwrm or offset_pwr_tracking 
-##################################################################################################################
-init_offsetm $m_date-$s_date.pwr1 sim_sar_rdc $m_date-$s_date.diff.par 1 1 - - 0 0 7
-offset_pwrm $m_date-$s_date.pwr1 sim_sar_rdc $m_date-$s_date.diff.par offs snr 256 256 offsets 2 100 100 7.0 2
-offset_fitm offs snr $m_date-$s_date.diff.par coffs coffsets 8.0 6
-offset_pwrm $m_date-$s_date.pwr1 sim_sar_rdc $m_date-$s_date.diff.par offs snr 64 64 offsets 2 300 300 9.0 2
-offset_fitm offs snr $m_date-$s_date.diff.par coffs coffsets 10.0 6
-
-##################################################################################################################
-### gc_map_fine applies the fine registration function to the input lookup table to create the refined output lookup table 
-### This is done by addition of the fine registration offsets to the lookup vectors
-##################################################################################################################
-gc_map_fine lookup $width_map $m_date-$s_date.diff.par lookup_fine 0
-geocode lookup_fine dem_seg $width_map $m_date-$s_date.rdc_hgt $width $line 1 0
-rashgt $m_date-$s_date.rdc_hgt $m_date-$s_date.pwr1 $width 1 1 0 1 1 20.0 1. .35 1 $m_date-$s_date.rdc_hgt_pwr.bmp
-
-##################################################################################################################
-### Form Differential Interferogram (flag is important)
-##################################################################################################################
-# simulation of unwrapped topographic phase
-phase_sim $m_par $MS_off $m_date-$s_date.base $m_date-$s_date.rdc_hgt $m_date-$s_date.sim_unw 0 0 - -
-
-##################################################################################################################
-### Subtractiing the simulated unwrapped phase from the complex interferogram
-##################################################################################################################
-sub_phase $m_date-$s_date.int $m_date-$s_date.sim_unw $m_date-$s_date.diff.par $m_date-$s_date.diff.int 1 0
-rasmph $m_date-$s_date.diff.int $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.bmp
-rasmph_pwr $m_date-$s_date.diff.int $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.pwr.bmp
-
-##################################################################################################################
-### Filter Differential Interferogram
-##################################################################################################################
-adf $m_date-$s_date.diff.int $m_date-$s_date.diff.int.sm1 $m_date-$s_date.diff.sm.cc1 $width 0.3 128
-adf $m_date-$s_date.diff.int.sm1 $m_date-$s_date.diff.int.sm2 $m_date-$s_date.diff.sm.cc2 $width 0.3 64
-adf $m_date-$s_date.diff.int.sm2 $m_date-$s_date.diff.int.sm $m_date-$s_date.diff.sm.cc $width 0.3
-rasmph $m_date-$s_date.diff.int.sm $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.sm.bmp
-rasmph_pwr $m_date-$s_date.diff.int.sm $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.sm.pwr.bmp
-
-##################################################################################################################
-### Unwrap Differential Flattened Interferogram
-##################################################################################################################
-# rascc_mask $m_date-$s_date.sm.cc $m_date-$s_date.pwr1 $width 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 $m_date-$s_date.sm.cc_mask.bmp
-rascc_mask $m_date-$s_date.corr $m_date-$s_date.pwr1 $width 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 $m_date-$s_date.sm.cc_mask.bmp
-mcf $m_date-$s_date.diff.int.sm $m_date-$s_date.corr $m_date-$s_date.sm.cc_mask.bmp $m_date-$s_date.diff.int.sm.unw $width 1 0 0 - - 1 1 - - - 0
-rasrmg $m_date-$s_date.diff.int.sm.unw $m_date-$s_date.pwr1 $width 1 1 0 1 1 .6 1. .35 .0 1 $m_date-$s_date.diff.int.sm.unw.pwr.bmp $m_date-$s_date.sm.cc 1 .2
-rasrmg $m_date-$s_date.diff.int.sm.unw - $width 1 1 0 1 1 .5 1. .35 .0 1 $m_date-$s_date.diff.int.sm.unw.bmp $m_date-$s_date.sm.cc 1 .2
-
-##################################################################################################################
-### Subtractiing linear phase trends if needed 
-##################################################################################################################
-quad_fit $m_date-$s_date.diff.int.sm.unw $m_date-$s_date.diff.par 32 32 $m_date-$s_date.sm.cc_mask.bmp $m_date-$s_date.plot 3
-quad_sub $m_date-$s_date.diff.int.sm.unw $m_date-$s_date.diff.par $m_date-$s_date.diff.int.sm.sub.unw 0 0
-rasrmg $m_date-$s_date.diff.int.sm.sub.unw $m_date-$s_date.pwr1 $width 1 1 0 1 1 .6 1. .35 .0 1 $m_date-$s_date.diff.int.sm.sub.unw.pwr.bmp $m_date-$s_date.sm.cc 1 .2
-rasrmg $m_date-$s_date.diff.int.sm.sub.unw -  $width 1 1 0 1 1 .5 1. .35 .0 1 $m_date-$s_date.diff.int.sm.sub.unw.bmp $m_date-$s_date.sm.cc 1 .2
-
-##################################################################################################################
-### geocode the radar coordinates to imulated SAR intensity image
-##################################################################################################################
-# geocode_back $m_date-$s_date.sm.cc $width lookup_fine $m_date-$s_date.utm.cc $width_map $nlines_map 1 0
-# geocode_back $m_date-$s_date.diff.int.sm $width lookup_fine $m_date-$s_date.diff.utm.sm $width_map $nlines_map 1 1
-# geocode_back $m_date-$s_date.diff.int.sm.unw $width lookup_fine $m_date-$s_date.diff.utm.unw $width_map $nlines_map 1 0
-# geocode_back $m_date-$s_date.pwr1 $width lookup_fine $m_date-$s_date.utm.pwr $width_map $nlines_map 1 0
-# rascc $m_date-$s_date.utm.cc - $width_map 1 1 0 1 1 .1 .9 1. .35 1 $m_date-$s_date.utm.cc.bmp
-# rascc $m_date-$s_date.utm.cc $m_date-$s_date.utm.pwr $width_map 1 1 0 1 1 .1 .9 1. .35 1 $m_date-$s_date.utm.ccandpwr.bmp
-# rasmph $m_date-$s_date.diff.utm.sm $width_map 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.utm.sm.bmp
-# rasmph_pwr $m_date-$s_date.diff.utm.sm $m_date-$s_date.utm.pwr $width_map 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.utm.smandpwr.bmp
-# rasrmg $m_date-$s_date.diff.int.sm.unw -  $width 1 1 0 1 1 .18 1. .35 .0 1 $m_date-$s_date.diff.int.unw.bmp $m_date-$s_date.sm.cc 1 .2
-
-##################################################################################################################
-### subtract gacos aps phase
-##################################################################################################################
-matlab -nodesktop -nosplash -r "rot_interp_gacos('$gacos_dir/$m_date.ztd','$gacos_dir/$s_date.ztd','dem_seg.par','${m_date}_rot.phs','${s_date}_rot.phs');quit;"
-
-geocode lookup_fine ${m_date}_rot.phs $width_map ${m_date}_rot.phs.rdr $width $line 1 0
-geocode lookup_fine ${s_date}_rot.phs $width_map ${s_date}_rot.phs.rdr $width $line 1 0
-raspwr ${m_date}_rot.phs.rdr $width 1 0 1 1 1. .35 1 ${m_date}_rot.phs.rdr.bmp
-raspwr ${s_date}_rot.phs.rdr $width 1 0 1 1 1. .35 1 ${s_date}_rot.phs.rdr.bmp
-
-inc_angle=$(awk '$1 == "incidence_angle:" {print $2}' $m_date.pwr1.par)
-matlab -nodesktop -nosplash -r "sub_gacos('$m_date-$s_date.diff.int','${m_date}_rot.phs.rdr','${s_date}_rot.phs.rdr',$inc_angle,$line);quit;"
-rasmph_pwr $m_date-$s_date.diff.int.gacos $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.gacos.pwr.bmp
-
-adf $m_date-$s_date.diff.int.gacos $m_date-$s_date.diff.int.gacos.sm1 $m_date-$s_date.diff.gacos.sm.cc1 $width 0.3 128
-adf $m_date-$s_date.diff.int.gacos.sm1 $m_date-$s_date.diff.int.gacos.sm2 $m_date-$s_date.diff.gacos.sm.cc2 $width 0.3 64
-adf $m_date-$s_date.diff.int.gacos.sm2 $m_date-$s_date.diff.int.gacos.sm $m_date-$s_date.diff.gacos.sm.cc $width 0.3
-rasmph $m_date-$s_date.diff.int.gacos.sm $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.gacos.sm.bmp
-rasmph_pwr $m_date-$s_date.diff.int.gacos.sm $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.gacos.sm.pwr.bmp
-
-rascc_mask $m_date-$s_date.diff.gacos.sm.cc $m_date-$s_date.pwr1 $width 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 $m_date-$s_date.gacos.sm.cc_mask.bmp
-mcf $m_date-$s_date.diff.int.gacos.sm $m_date-$s_date.diff.gacos.sm.cc $m_date-$s_date.gacos.sm.cc_mask.bmp $m_date-$s_date.diff.int.gacos.sm.unw $width 1 0 0 - - 1 1 - - - 0
-rasrmg $m_date-$s_date.diff.int.gacos.sm.unw $m_date-$s_date.pwr1 $width 1 1 0 1 1 .6 1. .35 .0 1 $m_date-$s_date.diff.int.gacos.sm.unw.pwr.bmp $m_date-$s_date.diff.gacos.sm.cc 1 .2
-rasrmg $m_date-$s_date.diff.int.gacos.sm.unw  - $width 1 1 0 1 1 .5 1. .35 .0 1 $m_date-$s_date.diff.int.gacos.sm.unw.bmp $m_date-$s_date.diff.gacos.sm.cc 1 .2
-
-quad_fit $m_date-$s_date.diff.int.gacos.sm.unw $m_date-$s_date.diff.par 32 32 $m_date-$s_date.gacos.sm.cc_mask.bmp $m_date-$s_date.plot 3
-quad_sub $m_date-$s_date.diff.int.gacos.sm.unw $m_date-$s_date.diff.par $m_date-$s_date.diff.int.gacos.sm.sub.unw 0 0
-rasrmg $m_date-$s_date.diff.int.gacos.sm.sub.unw $m_date-$s_date.pwr1 $width 1 1 0 1 1 .6 1. .35 .0 1 $m_date-$s_date.diff.int.gacos.sm.sub.unw.pwr.bmp $m_date-$s_date.diff.gacos.sm.cc 1 .2
-rasrmg $m_date-$s_date.diff.int.gacos.sm.sub.unw -  $width 1 1 0 1 1 .5 1. .35 .0 1 $m_date-$s_date.diff.int.gacos.sm.sub.unw.bmp $m_date-$s_date.diff.gacos.sm.cc 1 .2
-
-range_spacing=$(awk '$1 == "interferogram_range_pixel_spacing:" {print $2}' $MS_off)
-azimuth_spacing=$(awk '$1 == "interferogram_azimuth_pixel_spacing:" {print $2}' $MS_off)
-matlab -nodesktop -nosplash -r "ato_statistical('$m_date-$s_date.diff.int.gacos.sm.sub.unw','$m_date-$s_date.diff.int.sm.sub.unw',$inc_angle,$line,$width,$range_spacing,$azimuth_spacing);quit;"
-
-##################################################################################################################
-### delete files to release storage
-##################################################################################################################
-rm -rf $s_date.rslc lookup sim_sar ${m_date}_rot.phs ${s_date}_rot.phs
-"""
 
 USAGE = """Example:
   # calculate baseline
@@ -379,34 +247,29 @@ def run():
                               delta_T_max)
     # baseline_calc and run stacking
     if flag == 't':
+        # compute geometry once for every reference date
+        m_dates = [i[0:8] for i in ifg_pairs]
+        failed_dates = prep_geometry(stacking_dir, slc_dir, m_dates, dem,
+                                     dem_par, rlks, alks)
         for i in ifg_pairs:
+            if i[0:8] in failed_dates:
+                print('skip {}, geometry of {} failed.'.format(i, i[0:8]))
+                continue
             # make ifg_pair dir
             path = os.path.join(stacking_dir, i)
             if not os.path.isdir(path):
                 os.mkdir(path)
-            # write D-InSAR script
             m_date = i[0:8]
             s_date = i[9:17]
-            # write D-InSAR script
-            str_m_date = f"m_date={m_date}\n"
-            str_s_date = f"s_date={s_date}\n"
-            str_slc_dir = f"slc_dir={slc_dir}\n"
-            str_gacos_dir = f"gacos_dir={gacos_dir}\n"
-            str_dem = f"dem={dem}\n"
-            str_dem_par = f"dem_par={dem_par}\n"
-            str_rlks = f"rlks={rlks}\n"
-            str_alks = f"alks={alks}\n"
-            out_script = '#!/bin/sh\n' + str_m_date + str_s_date
-            out_script += str_slc_dir + str_gacos_dir + str_dem
-            out_script += str_dem_par + str_rlks + str_alks + dinsar_script
-            out_script_path = os.path.join(path, i + '_DInSAR.sh')
-            with open(out_script_path, 'w+') as f:
-                f.write(out_script)
-            # run D-InSAR script
-            os.chdir(path)
-            call_str = 'sh ' + i + '_DInSAR.sh'
-            os.system(call_str)
-
+            geo_dir = get_geo_dir(stacking_dir, m_date)
+            pl = dinsar_pipeline(path, slc_dir, geo_dir, m_date, s_date, rlks,
+                                 alks)
+            f = pair_files(slc_dir, m_date, s_date)
+            add_gacos_steps(pl, f, m_date, s_date, gacos_dir)
+            # write D-InSAR script for reference
+            pl.write_script(os.path.join(path, i + '_DInSAR.sh'))
+            # run D-InSAR steps not up to date
+            run_pipeline(i, pl)
 
 if __name__ == "__main__":
     run()
@@ -7,14 +7,28 @@
 import argparse
 import datetime
 import glob
+import json
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
+from gamma_par import load_par
+from gamma_raster import open_raster, block_lines, iter_blocks
+
+# coherence statistics of every file, reused while file is unchanged
+COH_CACHE = 'coh_stats.json'
+# percentiles of coherence saved in cache
+PERCENTILES = [10, 50, 90]
+# bins of coherence histogram for percentiles
+HIST_BINS = 1000
+
 EXAMPLE = """Example:
   python3 diff_tab.py /ly/stacking diff.int.gacos.sm.sub.unw 0.3 /ly/res
   python3 diff_tab.py /ly/stacking diff.int.gacos.sm.sub.unw 0.3 /ly/res --ce diff.gacos.sm.cc --de diff.par
+  python3 diff_tab.py /ly/stacking diff.int.gacos.sm.sub.unw 0.3 /ly/res --jobs 8 --min_valid 0.8
 """
 
 
@@ -35,6 +49,12 @@ def cmdline_parser():
                         help='filename extension of coherence file (default: diff.sm.cc).', default='diff.sm.cc')
     parser.add_argument('--de', dest='diff_par_extension',
                         help='filename extension of diff.par file (default: diff.par).', default='diff.par')
+    parser.add_argument('--min_valid',
+                        help='minimum fraction of valid (nonzero) pixels of used coherence (default: 0).',
+                        default=0, type=float)
+    parser.add_argument('--jobs',
+                        help='number of coherence files processed at the same time (default: 1).',
+                        default=1, type=int)
     inps = parser.parse_args()
 
     return inps
@@ -68,69 +88,124 @@ def get_diff_par(ifg_dir, diff_par_extension):
 
 
 def read_diff_par(diff_par):
-    par_key = ['range_samp_1', 'az_samp_1']
-    par_value = []
-    with open(diff_par, 'r') as f:
-        for line in f.readlines():
-            for i in par_key:
-                if line.strip().startswith(i):
-                    par_value.append(int(line.strip().split()[1]))
-    return par_value
-
-
-def read_coh(file, data_type, width, length):
-    # unw, cor, dem_seg -------> float32
-    # int               -------> complex64
-    # convert into short style
-    letter, digit = re.findall(r'(\d+|\D+)', data_type)
-    if len(letter) > 1:
-        letter = letter[0]
-        digit = int(int(digit) / 8)
-    # > means big-endian, < means little-endian
-    data_type = '>{}{}'.format(letter, digit)
-    # read data
-    try:
-        data = np.fromfile(file, dtype=data_type)
-        data = data.reshape(length, width)
-    except Exception as e:
-        print(e)
-    return data
-
-
-def get_mean_coh(cohs, diff_par):
+    par = load_par(diff_par)
+    return [par['range_samp_1'], par['az_samp_1']]
+
+
+def read_coh(file, width, length):
+    # big-endian float32, mapped instead of read into memory
+    return open_raster(file, dtype='>f4', width=width, length=length)
+
+
+def calc_coh_stats(coh, width, length):
+    """mean, valid fraction, mean of valid pixels and percentiles of coherence file"""
+    data = read_coh(coh, width, length)
+    lines = block_lines(width, '>f4')
+    coh_sum = 0.0
+    num_valid = 0
+    hist = np.zeros(HIST_BINS, dtype=np.int64)
+    for start, end in iter_blocks(length, lines):
+        block = np.asarray(data[start:end], dtype=np.float32)
+        valid = block[np.isfinite(block) & (block > 0)]
+        coh_sum += np.sum(valid, dtype=np.float64)
+        num_valid += valid.size
+        hist += np.histogram(valid, bins=HIST_BINS, range=(0, 1))[0]
+    stats = {
+        'mean': coh_sum / (width * length),
+        'valid': num_valid / (width * length),
+        'valid_mean': coh_sum / num_valid if num_valid else 0.0
+    }
+    # percentiles of valid pixels from histogram (bin width 1 / HIST_BINS)
+    cum = np.cumsum(hist)
+    for p in PERCENTILES:
+        if num_valid:
+            idx = np.searchsorted(cum, num_valid * p / 100)
+            stats['p{}'.format(p)] = (min(idx, HIST_BINS - 1) + 0.5) / HIST_BINS
+        else:
+            stats['p{}'.format(p)] = 0.0
+    return stats
+
+
+def file_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_coh_cache(cache_file):
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return {}
+
+
+def save_coh_cache(cache, cache_file):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+
+
+def get_coh_stats(cohs, diff_par, cache_file, num_jobs=1):
+    """statistics of every coherence file, only new or changed files are read"""
     print('\nstatisticing coherence:')
-    mean_coh_array = np.zeros(len(cohs))
     width, length = read_diff_par(diff_par)
-    for coh in cohs:
-        mean_coh = np.mean(read_coh(coh, 'float32', width, length))
-        mean_coh_array[cohs.index(coh)] = mean_coh
-    np.save('mean_coh_array', mean_coh_array)
-    return mean_coh_array
+    cache = load_coh_cache(cache_file)
+    keys = [file_key(coh) for coh in cohs]
+    todo = []
+    for coh, key in zip(cohs, keys):
+        item = cache.get(coh)
+        if item is None or item['key'] != key or item['size'] != [width, length]:
+            todo.append(coh)
+    print('{} cached, {} to calculate'.format(len(cohs) - len(todo), len(todo)))
 
+    if num_jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            results = list(executor.map(calc_coh_stats, todo,
+                                        [width] * len(todo),
+                                        [length] * len(todo)))
+    else:
+        results = [calc_coh_stats(coh, width, length) for coh in todo]
+    if todo:
+        key_dict = dict(zip(cohs, keys))
+        for coh, stats in zip(todo, results):
+            cache[coh] = {'key': key_dict[coh], 'size': [width, length], 'stats': stats}
+        save_coh_cache(cache, cache_file)
 
-def statistic_coh(mean_coh, step=0.05):
-    def count_coh(start, end, coh_array):
-        num = 0
-        for i in coh_array:
-            if i > start and i <= end:
-                num += 1
-        rate = num / coh_array.shape[0]
-        print(str(start) + '~' + str(end) + ': ' + str(round(rate, 2)))
+    return [cache[coh]['stats'] for coh in cohs]
 
+
+def write_coh_stats(cohs, coh_stats, out_dir):
+    stats_file = os.path.join(out_dir, 'coh_stats.txt')
+    keys = ['mean', 'valid', 'valid_mean'] + ['p{}'.format(p) for p in PERCENTILES]
+    with open(stats_file, 'w+') as f:
+        f.write('# file ' + ' '.join(keys) + '\n')
+        for coh, stats in zip(cohs, coh_stats):
+            f.write(coh + ' ' + ' '.join('{:.4f}'.format(stats[k]) for k in keys) + '\n')
+
+
+def statistic_coh(mean_coh, step=0.05):
     for i in np.arange(0, 1, step):
         start = round(i, 2)
         end = round(start + step, 2)
-        count_coh(start, end, mean_coh)
+        num = np.sum((mean_coh > start) & (mean_coh <= end))
+        rate = num / mean_coh.shape[0]
+        print(str(start) + '~' + str(end) + ': ' + str(round(rate, 2)))
 
 
-def write_diff_tab(unws, mean_coh_array, coh_thres, out_dir):
+def write_diff_tab(unws, mean_coh_array, coh_thres, out_dir,
+                   valid_array=None, min_valid=0):
     diff_tab = os.path.join(out_dir, 'diff_tab')
     print('\nwriting data to {}'.format(diff_tab))
     unw_used = 0
     with open(diff_tab, 'w+') as f:
-        for unw in unws:
+        for i, unw in enumerate(unws):
             baseline = get_baseline(unw)
-            coh = mean_coh_array[unws.index(unw)]
+            coh = mean_coh_array[i]
+            if valid_array is not None and valid_array[i] < min_valid:
+                continue
             if coh >= coh_thres:
                 f.write(f"{unw} {baseline}\n")
                 unw_used += 1
@@ -148,6 +223,8 @@ def main():
     out_dir = os.path.abspath(inps.out_dir)
     coh_extension = inps.coh_extension
     diff_par_extension = inps.diff_par_extension
+    min_valid = inps.min_valid
+    num_jobs = inps.jobs
 
     # check out_dir
     if not os.path.isdir(out_dir):
@@ -167,14 +244,16 @@ def main():
 
     if len(unws) == len(cohs):
         # statistic coherence
-        if os.path.isfile('mean_coh_array.npy'):
-            mean_coh_array = np.load('mean_coh_array.npy')
-        else:
-            mean_coh_array = get_mean_coh(cohs, diff_par)
+        cache_file = os.path.join(out_dir, COH_CACHE)
+        coh_stats = get_coh_stats(cohs, diff_par, cache_file, num_jobs)
+        write_coh_stats(cohs, coh_stats, out_dir)
+        mean_coh_array = np.array([i['mean'] for i in coh_stats])
+        valid_array = np.array([i['valid'] for i in coh_stats])
         statistic_coh(mean_coh_array)
 
         # write diff_tab
-        write_diff_tab(unws, mean_coh_array, coh_thres, out_dir)
+        write_diff_tab(unws, mean_coh_array, coh_thres, out_dir, valid_array,
+                       min_valid)
     else:
         print('The length of unws cohs and diff_pars are not equal.')
         sys.exit()
@@ -9,6 +9,8 @@ import argparse
 import sys
 import zipfile
 
+from gamma_par import read_gamma_par
+
 EXAMPLE = """Example:
   ./ph2kmz.py ph_rate lookup_fine dem_seg.par 20201111-20201123.cc 20201111.pwr 20201111-20201123.diff.par res
   ./ph2kmz.py ph_rate lookup_fine dem_seg.par 20201111-20201123.cc 20201111.pwr 20201111-20201123.diff.par res 5 --t 0.3
@@ -53,16 +55,6 @@ def cmdline_parser():
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split()
-                value = tmp[1].strip()
-    return value
-
-
 def geocode(infile, lookup_file, outfile, width_rdr, width_geo, lines_geo):
     call_str = f"geocode_back {infile} {width_rdr} {lookup_file} {outfile} {width_geo} {lines_geo} 1 0"
     if not os.path.isfile(outfile):
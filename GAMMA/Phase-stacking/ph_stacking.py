@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#####################################################################
+# Phase-Stacking of unwrapped interferograms listed in diff_tab     #
+# (replacement for GAMMA stacking, output ph_rate in radians/year) #
+# Copyright (c) 2021, Lei Yuan                                     #
+#####################################################################
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from gamma_par import load_par
+from gamma_raster import (BLOCK_BYTES, block_lines, create_raster, iter_blocks,
+                          open_raster)
+
+# days of one year
+YEAR_DAYS = 365.25
+
+EXAMPLE = """Example:
+  ./ph_stacking.py /ly/res/diff_tab /ly/stacking/20201111_20201123/20201111-20201123.diff.par /ly/res
+  ./ph_stacking.py /ly/res/diff_tab /ly/stacking/20201111_20201123/20201111-20201123.diff.par /ly/res --min_count 5 --jobs 8
+"""
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Phase-Stacking of unwrapped interferograms listed in diff_tab.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+
+    parser.add_argument('diff_tab', help='diff_tab written by diff_tab.py.')
+    parser.add_argument('diff_par', help='diff.par of any interferogram (for width and length).')
+    parser.add_argument('out_dir', help='directory path for saving ph_rate.')
+    parser.add_argument('--min_count',
+                        help='minimum number of valid (nonzero) phase of a pixel (default: 1).',
+                        default=1, type=int)
+    parser.add_argument('--jobs',
+                        help='number of blocks processed at the same time (default: 1).',
+                        default=1, type=int)
+    inps = parser.parse_args()
+
+    return inps
+
+
+def read_diff_tab(diff_tab):
+    """unwrapped files and time spans (years)"""
+    unws = []
+    spans = []
+    with open(diff_tab, 'r') as f:
+        for line in f:
+            split_list = line.split()
+            if len(split_list) >= 2:
+                unws.append(split_list[0])
+                spans.append(float(split_list[1]) / YEAR_DAYS)
+    return unws, spans
+
+
+def stack_block(unws, spans, width, length, start, end, min_count):
+    """rate, standard deviation of rate and valid count of lines start~end"""
+    shape = (end - start, width)
+    sum_tt = np.zeros(shape)
+    sum_pt = np.zeros(shape)
+    sum_pp = np.zeros(shape)
+    count = np.zeros(shape, dtype=np.int32)
+    for unw, t in zip(unws, spans):
+        data = open_raster(unw, dtype='>f4', width=width, length=length)
+        phase = np.asarray(data[start:end], dtype=np.float64)
+        # zero is no data in GAMMA unwrapped phase
+        valid = np.isfinite(phase) & (phase != 0)
+        phase[~valid] = 0
+        sum_tt += valid * t * t
+        sum_pt += phase * t
+        sum_pp += phase * phase
+        count += valid
+
+    rate = np.zeros(shape)
+    std = np.zeros(shape)
+    ok = (count >= min_count) & (sum_tt > 0)
+    # least squares of phase = rate * time span
+    rate[ok] = sum_pt[ok] / sum_tt[ok]
+    # residual sum of squares gives standard deviation of rate
+    dof = count >= 2
+    ok_std = ok & dof
+    rss = sum_pp - 2 * rate * sum_pt + rate * rate * sum_tt
+    rss[rss < 0] = 0
+    std[ok_std] = np.sqrt(rss[ok_std] /
+                          (count[ok_std] - 1) / sum_tt[ok_std])
+    return start, rate.astype(np.float32), std.astype(np.float32), count
+
+
+def ph_stacking(unws, spans, width, length, out_dir, min_count=1,
+                num_jobs=1):
+    """write ph_rate, ph_rate.std and ph_rate.count (big-endian float32)"""
+    ph_rate = os.path.join(out_dir, 'ph_rate')
+    out_rate = create_raster(ph_rate, width, length)
+    out_std = create_raster(ph_rate + '.std', width, length)
+    out_count = create_raster(ph_rate + '.count', width, length)
+
+    # about five float64 arrays of one block are in memory
+    lines = block_lines(width, np.float64, BLOCK_BYTES // 4)
+    blocks = list(iter_blocks(length, lines))
+    args = [(unws, spans, width, length, start, end, min_count)
+            for start, end in blocks]
+
+    def save(result):
+        start, rate, std, count = result
+        end = start + rate.shape[0]
+        out_rate[start:end] = rate
+        out_std[start:end] = std
+        out_count[start:end] = count
+        print('lines {}~{} done.'.format(start, end))
+
+    if num_jobs > 1:
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            for result in executor.map(stack_block, *zip(*args)):
+                save(result)
+    else:
+        for arg in args:
+            save(stack_block(*arg))
+
+    for out in [out_rate, out_std, out_count]:
+        out.flush()
+    return ph_rate
+
+
+def main():
+    inps = cmdline_parser()
+    diff_tab = os.path.abspath(inps.diff_tab)
+    diff_par = os.path.abspath(inps.diff_par)
+    out_dir = os.path.abspath(inps.out_dir)
+    min_count = inps.min_count
+    num_jobs = inps.jobs
+
+    for f in [diff_tab, diff_par]:
+        if not os.path.isfile(f):
+            print('cannot find {}'.format(f))
+            sys.exit(1)
+
+    if not os.path.isdir(out_dir):
+        os.mkdir(out_dir)
+
+    unws, spans = read_diff_tab(diff_tab)
+    if not unws:
+        print('no unwrapped file in {}'.format(diff_tab))
+        sys.exit(1)
+    no_exist = [i for i in unws if not os.path.isfile(i)]
+    if no_exist:
+        for i in no_exist:
+            print('cannot find {}'.format(i))
+        sys.exit(1)
+
+    par = load_par(diff_par)
+    width = par['range_samp_1']
+    length = par['az_samp_1']
+
+    print('stacking {} unwrapped files ({}x{})'.format(len(unws), width,
+                                                      length))
+    ph_rate = ph_stacking(unws, spans, width, length, out_dir, min_count,
+                          num_jobs)
+    print('\nwrite {} (radians/year), {}.std and {}.count'.format(
+        ph_rate, ph_rate, ph_rate))
+    print('\nall done, enjoy it.\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -9,21 +9,20 @@ import os
 import re
 import sys
 
-try:
-    import cv2
-except ImportError:
-    print(
-        'cannot find model named cv2, you can install it using command pip install opencv-python'
-    )
-    sys.exit(1)
+import numpy as np
+
+from gamma_par import load_par, read_gamma_par
+from s1_catalog import connect, index_zips
 
 EXAMPLE = '''Example:
-  # one swath
-  ./extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 -t iw1.png -n 3
-  # two swath
-  ./extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 2 -t iw1.png iw2.png -n 3 4
-  # three swath
-  ./extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 2 3 -t iw1.png iw2.png iw3.png -n 3 4 3
+  # one swath, bursts covering AOI (lon_min lat_min lon_max lat_max)
+  ./auto_extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 -d /ly/s1.db -z /ly/zip_dir --aoi 100.1 30.2 100.5 30.6
+  # two swath, catalog indexed before by s1_catalog.py
+  ./auto_extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 2 -d /ly/s1.db --aoi 100.1 30.2 100.5 30.6
+  # bursts of track 142 only (catalog holds several tracks)
+  ./auto_extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 2 -d /ly/s1.db --track 142 --aoi 100.1 30.2 100.5 30.6
+  # three swath, AOI polygon (one "lon lat" per line)
+  ./auto_extract_s1_bursts.py -s /ly/slc -o /ly/slc_extract -i 1 2 3 -d /ly/s1.db --aoi_file aoi.txt
 '''
 
 
@@ -50,20 +49,26 @@ def cmdLineParse():
                         nargs='+',
                         choices=[1, 2, 3],
                         required=True)
-    parser.add_argument(
-        '-t',
-        dest='template_burst',
-        help=
-        'template bursts image for finding relative location in original slc bursts image.',
-        type=str,
-        nargs='+',
-        required=True)
-    parser.add_argument('-n',
-                        dest='burst_num',
-                        help='burst number in template image.',
-                        type=int,
-                        nargs='+',
+    parser.add_argument('-d',
+                        dest='db',
+                        help='SQLite catalog of zips written by s1_catalog.py.',
+                        type=str,
                         required=True)
+    parser.add_argument('-z',
+                        dest='zip_dir',
+                        help='directory of zips indexed into catalog first (only new zips are read).',
+                        type=str,
+                        nargs='+')
+    parser.add_argument('--track',
+                        help='relative orbit number (default: track of the first date in catalog).',
+                        type=int)
+    parser.add_argument('--aoi',
+                        help='bounding box of AOI (lon_min lat_min lon_max lat_max).',
+                        type=float,
+                        nargs=4)
+    parser.add_argument('--aoi_file',
+                        help='polygon of AOI, one "lon lat" vertex per line.',
+                        type=str)
     parser.add_argument(
         '--rlks',
         help='range looks (default: 20).',
@@ -85,17 +90,6 @@ def cmdLineParse():
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    """read gamma parmaeter using keyword"""
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def slc_copy_s1_tops(slc_path, out_slc_path, date, iw, start_burst_loc,
                      end_burst_loc, rlks, alks):
     """copy SLCs"""
@@ -238,35 +232,147 @@ def extract_three_swath(slc_path, out_slc_path, date, iws, bursts, rlks, alks):
         os.remove(mosaiclist)
 
 
-def match_burst(temp_burst, temp_burst_num, orig_burst, orig_burst_num):
-    """get location of start burst in original bursts image"""
-    # read image
-    img_temp = cv2.imread(temp_burst, 0)
-    img_orig = cv2.imread(orig_burst, 0)
-    w_orig, h_orig = img_orig.shape[::-1]
-    h_single_burst = round(h_orig / orig_burst_num)
-    h_temp = h_single_burst * temp_burst_num
-    w_temp = w_orig
-    # resize temp_burst
-    img_temp = cv2.resize(img_temp, (w_temp, h_temp))
-    # match image
-    res = cv2.matchTemplate(img_orig, img_temp, cv2.TM_CCOEFF_NORMED)
-    _, _, _, max_loc = cv2.minMaxLoc(res)
-    top_left = max_loc
-    # get start burst location
-    start_burst_loc = round(top_left[1] / h_single_burst) + 1
-    return start_burst_loc
-
-
-def get_start_end_burst(temp_burst, temp_burst_num, orig_burst, tops_par_file):
-    """get location of start burst and end burst"""
-    orig_burst_num = int(read_gamma_par(tops_par_file, 'number_of_bursts:'))
-    start_burst_loc = match_burst(temp_burst, temp_burst_num, orig_burst,
-                                  orig_burst_num)
-    end_burst_loc = start_burst_loc + temp_burst_num - 1
-    if end_burst_loc > orig_burst_num:
-        end_burst_loc = orig_burst_num
-    return start_burst_loc, end_burst_loc
+def read_polygon(aoi_file):
+    """vertices (lon, lat) of polygon in text file"""
+    points = []
+    with open(aoi_file, 'r') as f:
+        for line in f:
+            split_list = line.replace(',', ' ').split()
+            if len(split_list) >= 2:
+                points.append((float(split_list[0]), float(split_list[1])))
+    return np.array(points)
+
+
+def bbox_polygon(aoi):
+    """polygon of bounding box"""
+    lon_min, lat_min, lon_max, lat_max = aoi
+    return np.array([(lon_min, lat_min), (lon_max, lat_min),
+                     (lon_max, lat_max), (lon_min, lat_max)])
+
+
+def points_in_polygon(x, y, polygon):
+    """ray casting of points (any shape) against polygon"""
+    inside = np.zeros(np.shape(x), dtype=bool)
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    for i in range(len(polygon)):
+        cross = (y0[i] > y) != (y1[i] > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xc = x0[i] + (y - y0[i]) * (x1[i] - x0[i]) / (y1[i] - y0[i])
+        inside ^= cross & (x < xc)
+    return inside
+
+
+def boxes_intersect_polygon(boxes, polygon):
+    """whether every box (min_lon, min_lat, max_lon, max_lat) intersects polygon"""
+    x_min, y_min, x_max, y_max = [boxes[:, i:i + 1] for i in range(4)]
+    # vertex of polygon in box
+    px, py = polygon[:, 0], polygon[:, 1]
+    hit = ((px >= x_min) & (px <= x_max) & (py >= y_min) &
+           (py <= y_max)).any(axis=1)
+    # corner of box in polygon
+    cx = np.hstack([x_min, x_max, x_max, x_min])
+    cy = np.hstack([y_min, y_min, y_max, y_max])
+    hit |= points_in_polygon(cx, cy, polygon).any(axis=1)
+    # edge of polygon crossing box (Liang-Barsky clipping)
+    qx, qy = np.roll(px, -1), np.roll(py, -1)
+    dx, dy = qx - px, qy - py
+    t0 = np.zeros((len(boxes), len(polygon)))
+    t1 = np.ones((len(boxes), len(polygon)))
+    for p, q in [(-dx, px - x_min), (dx, x_max - px), (-dy, py - y_min),
+                 (dy, y_max - py)]:
+        p = np.broadcast_to(p, t0.shape)
+        q = np.broadcast_to(q, t0.shape)
+        parallel = p == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = q / p
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+        t1 = np.where(parallel & (q < 0), -1, t1)
+    hit |= (t0 <= t1).any(axis=1)
+    return hit
+
+
+def get_tracks(conn, date):
+    """tracks of scenes of date in catalog"""
+    rows = conn.execute('SELECT DISTINCT track FROM scenes WHERE date=?',
+                        (date, )).fetchall()
+    return sorted(r[0] for r in rows)
+
+
+def load_bursts(conn, dates, iw_num, track):
+    """bursts of dates and swaths of track in catalog as numpy arrays"""
+    sql = ('SELECT s.date, s.name, b.swath, b.num, b.burst_id, b.azimuth_time, '
+           'b.min_lon, b.min_lat, b.max_lon, b.max_lat FROM bursts b JOIN scenes s '
+           'ON b.scene=s.name WHERE s.track=? AND s.date IN ({}) AND b.swath IN ({}) '
+           'AND b.min_lon IS NOT NULL').format(
+               ', '.join('?' * len(dates)), ', '.join('?' * len(iw_num)))
+    args = [track] + list(dates) + ['iw' + str(i) for i in iw_num]
+    rows = conn.execute(sql, args).fetchall()
+    if not rows:
+        return None
+    cols = list(zip(*rows))
+    return {
+        'date': np.array(cols[0]),
+        'scene': np.array(cols[1]),
+        'swath': np.array(cols[2]),
+        'num': np.array(cols[3], dtype=np.int32),
+        'burst_id': np.array(cols[4]),
+        'azimuth_time': np.array(cols[5]),
+        'box': np.array(cols[6:10], dtype=np.float64).T
+    }
+
+
+def number_bursts(azimuth_time, burst_id):
+    """burst IDs of one swath of one date, ordered by time, numbered from 1
+
+    zips of a date are concatenated by s1_cat.py, bursts in the overlap of
+    adjacent zips are in both zips and counted once.
+    """
+    ids = []
+    for i in np.argsort(azimuth_time, kind='stable'):
+        if burst_id[i] not in ids:
+            ids.append(burst_id[i])
+    return ids
+
+
+def select_bursts(bursts, polygon, slc_dir, iw_num):
+    """{date: [start1, end1, start2, end2, ...]} of bursts intersecting polygon
+
+    bursts are selected by burst ID, so every date gets the same ground area.
+    """
+    hit = boxes_intersect_polygon(bursts['box'], polygon)
+    ids = set(bursts['burst_id'][hit])
+    print('{} bursts intersect AOI: {}'.format(len(ids), ' '.join(sorted(ids))))
+
+    results = {}
+    for date in np.unique(bursts['date']):
+        of_date = bursts['date'] == date
+        burst_locs = []
+        for i in iw_num:
+            swath = 'iw' + str(i)
+            mask = of_date & (bursts['swath'] == swath)
+            tops_par = os.path.join(slc_dir, date, date + '.' + swath + '.slc.tops_par')
+            if not os.path.isfile(tops_par):
+                print('cannot find {}, skip {}.'.format(tops_par, date))
+                break
+            swath_ids = number_bursts(bursts['azimuth_time'][mask],
+                                      bursts['burst_id'][mask])
+            # SLC must hold the same bursts as annotations in catalog
+            if load_par(tops_par).get('number_of_bursts') != len(swath_ids):
+                print('number of bursts in {} differs from catalog, skip {}.'.format(
+                    tops_par, date))
+                break
+            nums = [k + 1 for k, b in enumerate(swath_ids) if b in ids]
+            if not nums:
+                print('no burst of {} in {} intersects AOI, skip it.'.format(swath, date))
+                break
+            if len(nums) < len([b for b in ids if b.endswith(swath)]):
+                print('{} {} covers AOI partly.'.format(date, swath))
+            burst_locs += [min(nums), max(nums)]
+        else:
+            results[date] = burst_locs
+    return results
 
 
 def main():
@@ -277,12 +383,14 @@ def main():
     out_slc_dir = inps.out_slc_dir
     out_slc_dir = os.path.abspath(out_slc_dir)
     iw_num = inps.iw_num
-    temp_burst_num = inps.burst_num
-    temp_burst = inps.template_burst
-    temp_burst = [os.path.abspath(i) for i in temp_burst]
+    db = os.path.abspath(inps.db)
+    zip_dir = inps.zip_dir
+    aoi = inps.aoi
+    aoi_file = inps.aoi_file
     rlks = inps.rlks
     alks = inps.alks
     slc_num = inps.slc_num
+    track = inps.track
     # check slc_dir
     if not os.path.isdir(slc_dir):
         print('{} does not exist.'.format(slc_dir))
@@ -290,18 +398,21 @@ def main():
     # check out_slc_dir
     if not os.path.isdir(out_slc_dir):
         os.mkdir(out_slc_dir)
-    # check temp_burst
-    for i in temp_burst:
-        if not os.path.isfile(i):
-            print('{} does not exist.'.format(i))
+    # check aoi
+    if aoi_file:
+        if not os.path.isfile(aoi_file):
+            print('{} does not exist.'.format(aoi_file))
             sys.exit(1)
-    # check iw_num
-    if len(iw_num) != len(temp_burst_num):
-        print('length of iw_num must be equal to burst_num.')
-        sys.exit(1)
-    if len(iw_num) != len(temp_burst):
-        print('length of iw_num must be equal to template_burst.')
+        polygon = read_polygon(aoi_file)
+        if len(polygon) < 3:
+            print('polygon in {} needs at least 3 vertices.'.format(aoi_file))
+            sys.exit(1)
+    elif aoi:
+        polygon = bbox_polygon(aoi)
+    else:
+        print('--aoi or --aoi_file is required.')
         sys.exit(1)
+    # check iw_num
     if len(iw_num) == 2:
         if iw_num == [1, 2] or iw_num == [2, 3]:
             pass
@@ -323,49 +434,65 @@ def main():
         if re.findall(r'^\d{8}$', i):
             all_date.append(i)
     all_date = sorted(all_date)
+    if slc_num != -1 and slc_num < len(all_date):
+        all_date = all_date[0:slc_num]
+    if not all_date:
+        print('\ncannot find any data in {}.\n'.format(slc_dir))
+        sys.exit(1)
+    # burst geometry of all dates from catalog
+    conn = connect(db)
+    if zip_dir:
+        zip_files = []
+        for d in zip_dir:
+            d = os.path.abspath(d)
+            zip_files += sorted(
+                os.path.join(d, i) for i in os.listdir(d)
+                if i.startswith('S1') and i.endswith('.zip'))
+        index_zips(conn, zip_files)
+    # only bursts of one track, the one of the first date if not given
+    if track is None:
+        for date in all_date:
+            tracks = get_tracks(conn, date)
+            if tracks:
+                break
+        if not tracks:
+            print('cannot find scenes of dates in {}.'.format(db))
+            sys.exit(1)
+        if len(tracks) != 1:
+            print('scenes of {} are of tracks {}, set --track.'.format(
+                date, tracks))
+            sys.exit(1)
+        track = tracks[0]
+    print('track: {}'.format(track))
+    bursts = load_bursts(conn, all_date, iw_num, track)
+    conn.close()
+    if bursts is None:
+        print('cannot find bursts of dates in {}.'.format(db))
+        sys.exit(1)
+    burst_locs = select_bursts(bursts, polygon, slc_dir, iw_num)
+    no_bursts = sorted(set(all_date) - set(burst_locs))
     # copy and mosaic slcs
-    if all_date:
-        if slc_num == -1 or slc_num >= len(all_date):
-            length = len(all_date)
+    for date in all_date:
+        if date not in burst_locs:
+            continue
+        slc_path = os.path.join(slc_dir, date)
+        out_slc_path = os.path.join(out_slc_dir, date)
+        if not os.path.isdir(out_slc_path):
+            os.mkdir(out_slc_path)
+        burst_num = burst_locs[date]
+        print('{} bursts: {}'.format(date, burst_num))
+        if len(iw_num) == 1:
+            extract_one_swath(slc_path, out_slc_path, date, iw_num[0],
+                              burst_num[0], burst_num[1], rlks, alks)
+        elif len(iw_num) == 2:
+            extract_two_swath(slc_path, out_slc_path, date, iw_num,
+                              burst_num, rlks, alks)
         else:
-            length = slc_num
-        for date in all_date[0:length]:
-            slc_path = os.path.join(slc_dir, date)
-            out_slc_path = os.path.join(out_slc_dir, date)
-            if not os.path.isdir(out_slc_path):
-                os.mkdir(out_slc_path)
-            if len(iw_num) == 1:
-                tops_par_file = os.path.join(
-                    slc_path, date + '.iw' + str(iw_num[0]) + '.slc.tops_par')
-                orig_burst = os.path.join(
-                    slc_path, date + '.iw' + str(iw_num[0]) + '.slc.bmp')
-                start_burst_loc, end_burst_loc = get_start_end_burst(
-                    temp_burst[0], temp_burst_num[0], orig_burst,
-                    tops_par_file)
-                extract_one_swath(slc_path, out_slc_path, date, iw_num[0],
-                                  start_burst_loc, end_burst_loc, rlks, alks)
-            if len(iw_num) == 2 or len(iw_num) == 3:
-                burst_num = []
-                for i in iw_num:
-                    tops_par_file = os.path.join(
-                        slc_path, date + '.iw' + str(i) + '.slc.tops_par')
-                    orig_burst = os.path.join(
-                        slc_path, date + '.iw' + str(i) + '.slc.bmp')
-                    index = iw_num.index(i)
-                    start_burst_loc, end_burst_loc = get_start_end_burst(
-                        temp_burst[index], temp_burst_num[index], orig_burst,
-                        tops_par_file)
-                    burst_num.append(start_burst_loc)
-                    burst_num.append(end_burst_loc)
-                if len(iw_num) == 2:
-                    extract_two_swath(slc_path, out_slc_path, date, iw_num,
-                                      burst_num, rlks, alks)
-                else:
-                    extract_three_swath(slc_path, out_slc_path, date, iw_num,
-                                        burst_num, rlks, alks)
-        print('\nall done, enjoy it.\n')
-    else:
-        print('\ncannot find any data in {}.\n'.format(slc_dir))
+            extract_three_swath(slc_path, out_slc_path, date, iw_num,
+                                burst_num, rlks, alks)
+    if no_bursts:
+        print('\nbursts not extracted for: {}'.format(' '.join(no_bursts)))
+    print('\nall done, enjoy it.\n')
 
 
 if __name__ == "__main__":
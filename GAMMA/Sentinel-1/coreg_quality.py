@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#####################################################################
+# Report quality of Sentinel-1 TOPS co-registration                 #
+# offsets and ESD iterations of every date are parsed concurrently, #
+# saved in a table and dates far from the median are flagged        #
+# Copyright (c) 2021, Lei Yuan                                      #
+#####################################################################
+
+import argparse
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# modified z-score (0.6745 * |x - median| / MAD) above it is outlier
+MAD_THRESHOLD = 3.5
+# |daz| * 10000 above it is too large in any case (0.0005 pixel)
+DAZ_LIMIT = 5
+
+COLUMNS = [
+    'date', 'daz10000', 'drg10000', 'esd_iter', 'daz_first10000', 'zscore',
+    'flag', 'source'
+]
+
+EXAMPLE = """Example:
+  ./coreg_quality.py /ly/rslc
+  ./coreg_quality.py /ly/rslc --out /ly/rslc/coreg_quality.txt --threshold 3
+"""
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Report quality of Sentinel-1 TOPS co-registration.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+    parser.add_argument('rslc_dir', help='directory path of RSLCs')
+    parser.add_argument('--out',
+                        help='table file (defaults: rslc_dir/coreg_quality.txt)',
+                        default=None)
+    parser.add_argument('--threshold',
+                        help=f'modified z-score for flagging outliers (defaults: {MAD_THRESHOLD})',
+                        default=MAD_THRESHOLD,
+                        type=float)
+    inps = parser.parse_args()
+    return inps
+
+
+def to_float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def parse_quality(quality_file):
+    """offsets of all ESD iterations in coreg_quality file or coreg log"""
+    daz = []
+    drg = []
+    with open(quality_file, 'r') as f:
+        for line in f:
+            split_list = line.replace(':', ' ').split()
+            if len(split_list) < 2:
+                continue
+            if split_list[0] == 'azimuth_pixel_offset':
+                value = to_float(split_list[1])
+                if value is not None:
+                    daz.append(value)
+            elif split_list[0] == 'range_pixel_offset':
+                value = to_float(split_list[1])
+                if value is not None:
+                    drg.append(value)
+    date = os.path.basename(os.path.dirname(os.path.abspath(quality_file)))
+    return {
+        'date': date,
+        'daz10000': round(daz[-1] * 10000, 3) if daz else None,
+        'drg10000': round(drg[-1] * 10000, 3) if drg else None,
+        'esd_iter': len(daz),
+        'daz_first10000': round(daz[0] * 10000, 3) if daz else None,
+        'source': os.path.basename(quality_file)
+    }
+
+
+def find_quality_files(rslc_dir):
+    """coreg_quality file of every date, coreg log if there is no quality file"""
+    files = {}
+    for f in glob.glob(os.path.join(rslc_dir, '*', '*.coreg.log')):
+        files[os.path.basename(os.path.dirname(f))] = f
+    for f in glob.glob(os.path.join(rslc_dir, '*', '*.coreg_quality')):
+        files[os.path.basename(os.path.dirname(f))] = f
+    return [files[k] for k in sorted(files) if re.match(r'^\d{8}$', k)]
+
+
+def flag_outliers(rows, max_zscore=MAD_THRESHOLD):
+    """add modified z-score of daz and flag (missing/outlier) to rows"""
+    values = np.array([r['daz10000'] for r in rows if r['daz10000'] is not None])
+    if values.size:
+        median = np.median(values)
+        mad = np.median(np.abs(values - median))
+    for r in rows:
+        if r['daz10000'] is None:
+            r['zscore'] = None
+            r['flag'] = 'missing'
+            continue
+        if mad > 0:
+            r['zscore'] = round(0.6745 * (r['daz10000'] - median) / mad, 2)
+        else:
+            r['zscore'] = 0.0
+        if abs(r['zscore']) > max_zscore:
+            r['flag'] = 'outlier'
+        elif abs(r['daz10000']) > DAZ_LIMIT:
+            r['flag'] = 'large'
+        else:
+            r['flag'] = ''
+    return rows
+
+
+def coreg_report(rslc_dir, max_zscore=MAD_THRESHOLD, num_threads=8):
+    """quality of all dates in rslc_dir"""
+    quality_files = find_quality_files(rslc_dir)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        rows = list(executor.map(parse_quality, quality_files))
+    return flag_outliers(rows, max_zscore)
+
+
+def write_report(rows, out_file, thresholds=None):
+    """table of rows, thresholds of co-registration are written as comments"""
+    with open(out_file, 'w') as f:
+        for k, v in (thresholds or {}).items():
+            f.write('# {}: {}\n'.format(k, v))
+        f.write(' '.join(COLUMNS) + '\n')
+        for r in rows:
+            f.write(' '.join('-' if r[k] in [None, ''] else str(r[k])
+                             for k in COLUMNS) + '\n')
+
+
+def print_report(rows):
+    print('\n{:>8}{:>10}{:>10}{:>6}{:>8}  {}\n'.format('date', 'daz10000',
+                                                    'drg10000', 'iter',
+                                                    'zscore', 'flag'))
+    for r in rows:
+        print('{:>8}{:>10}{:>10}{:>6}{:>8}  {}'.format(
+            r['date'], '-' if r['daz10000'] is None else r['daz10000'],
+            '-' if r['drg10000'] is None else r['drg10000'], r['esd_iter'],
+            '-' if r['zscore'] is None else r['zscore'], r['flag']))
+    flagged = [r['date'] for r in rows if r['flag']]
+    if flagged:
+        print('\ncheck {} dates: {}'.format(len(flagged), ' '.join(flagged)))
+
+
+def get_coreg_quality(rslc_dir, out_file=None, max_zscore=MAD_THRESHOLD,
+                      thresholds=None):
+    """print quality of all dates and write table file, return rows"""
+    rows = coreg_report(rslc_dir, max_zscore)
+    if out_file is None:
+        out_file = os.path.join(rslc_dir, 'coreg_quality.txt')
+    write_report(rows, out_file, thresholds)
+    print_report(rows)
+    print('\nwrite {}'.format(out_file))
+    return rows
+
+
+def main():
+    inps = cmdline_parser()
+    rslc_dir = os.path.abspath(inps.rslc_dir)
+    if not os.path.isdir(rslc_dir):
+        print('{} not exists.'.format(rslc_dir))
+        sys.exit(1)
+    rows = get_coreg_quality(rslc_dir, inps.out, inps.threshold)
+    if not rows:
+        print('no coreg_quality file found in {}'.format(rslc_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,10 +10,30 @@ import argparse
 import shutil
 import glob
 import sys
+import subprocess
+
+from cmd_runner import run_cmd
+from gamma_par import read_gamma_par
+from job_pool import run_jobs, print_summary, get_budgets, read_image_size
+from coreg_quality import get_coreg_quality
+
+# cc_thresh fraction_thresh ph_stdev_thresh of S1_coreg_TOPS (ESD)
+ESD_THRESHOLDS = '0.7 0.001 0.7'
+
+# memory of S1_coreg_TOPS (SLC_interp_lt_ScanSAR, SLC_mosaic_S1_TOPS) as part of SLC size
+COREG_MEM_FACTOR = 1.5
+# swath RSLCs, mosaic and temporary RSLC of iterations as part of SLC size
+COREG_DISK_FACTOR = 3
+# size of mli, lookup table and offsets per multi-looked pixel
+MLI_DISK_BYTES = 32
 
 EXAMPLE = """Example:
   ./coreg_to_one.py /ly/slc /ly/rslc /ly/dem '2'
   ./coreg_to_one.py /ly/slc /ly/rslc /ly/dem '1 2' --rlks 8 --alks 2 --ref_slc 20201111
+  ./coreg_to_one.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8
+  ./coreg_to_one.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8 --max_mem 64 --min_free 50
+  # only new dates
+  ./coreg_to_one.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8 --append
 """
 
 
@@ -37,110 +57,142 @@ def cmd_line_parser():
     parser.add_argument('--ref_slc',
                         help='reference SLC (default: the first slc)',
                         default='0')
+    parser.add_argument('--jobs',
+                        help='number of dates co-registered at the same time (defaults: 1)',
+                        default=1,
+                        type=int)
+    parser.add_argument('--max_mem',
+                        help='memory used by running dates in GB (defaults: 80%% of available memory)',
+                        default=None,
+                        type=float)
+    parser.add_argument('--min_free',
+                        help='free space kept in rslc_dir in GB (defaults: 10)',
+                        default=10,
+                        type=float)
+    parser.add_argument('--append',
+                        help='only co-register dates without RSLC, reuse lookup table of reference',
+                        action='store_true')
     inps = parser.parse_args()
 
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
-def gen_bmp(slc, slc_par, rlks, alks):
+def gen_bmp(slc, slc_par, rlks, alks, **kwargs):
     width = read_gamma_par(slc_par, 'range_samples')
     bmp = slc + '.bmp'
     call_str = f"rasSLC {slc} {width} 1 0 {rlks} {alks} 1. .35 1 0 0 {bmp}"
-    os.system(call_str)
-
-
-def get_coreg_quality(rslc_dir):
-    quality_files = glob.glob(rslc_dir + '/*/*.coreg_quality')
-    print('\n{:>8}{:>10}\n'.format('date', 'daz10000'))
-    for file in sorted(quality_files):
-        with open(file, 'r') as f:
-            for i in f.readlines()[::-1]:
-                if i.startswith('azimuth_pixel_offset'):
-                    line = i.split()
-                    daz = line[1]
-                    date = file[-22:-14]
-                    daz10000 = float(daz) * 10000
-                    daz10000 = round(daz10000, 2)
-                    if daz10000 > 5:
-                        print('{:>8}{:>10} >  5'.format(date, daz10000))
-                    elif daz10000 < -5:
-                        print('{:>8}{:>10} < -5'.format(date, daz10000))
-                    else:
-                        print('{:>8}{:>10}'.format(date, daz10000))
-                    break
+    return run_cmd(call_str, **kwargs)
 
 
-def main():
-    inps = cmd_line_parser()
-    slc_dir = inps.slc_dir
-    rslc_dir = inps.rslc_dir
-    dem_dir = inps.dem_dir
-    iw_num = inps.iw_num
-    iw_num = iw_num.split()
-    rlks = inps.rlks
-    alks = inps.alks
-    ref_slc = inps.ref_slc
+def write_tab(tab_file, slcs):
+    """SLC_tab of swaths (slc slc_par tops_par in each line)"""
+    with open(tab_file, 'w') as f:
+        for slc in slcs:
+            f.write(f"{slc} {slc}.par {slc}.tops_par\n")
 
-    # check slc_dir
-    slc_dir = os.path.abspath(slc_dir)
-    if not os.path.isdir(slc_dir):
-        print("{} not exists.".format(slc_dir))
-        sys.exit(1)
 
-    # check rslc_dir
-    rslc_dir = os.path.abspath(rslc_dir)
-    if not os.path.isdir(rslc_dir):
-        os.mkdir(rslc_dir)
+def coreg_date(s_date, slc_dir, rslc_dir, m_date, iw_num, rlks, alks):
+    """co-register one date to reference in its own directory, return exit code"""
+    m_slc_dir = os.path.join(slc_dir, m_date)
+    m_mli_par = os.path.join(m_slc_dir, f"{m_date}.mli.par")
+    rdc_dem = os.path.join(m_slc_dir, f"{m_date}.hgt")
 
-    # check dem
-    dem_dir = os.path.abspath(dem_dir)
-    if not os.path.isdir(dem_dir):
-        print("{} not exists.".format(dem_dir))
-    else:
-        dem = glob.glob(dem_dir + '/*.dem')
-        dem_par = glob.glob(dem_dir + '/*.dem.par')
-        if not (dem and dem_par):
-            print('dem or dem.par not exist.')
-        else:
-            dem = dem[0]
-            dem_par = dem_par[0]
+    s_slc_dir = os.path.join(slc_dir, s_date)
+    s_slc = os.path.join(s_slc_dir, s_date + '.slc')
+    s_slc_par = s_slc + '.par'
+    s_rslc_dir = os.path.join(rslc_dir, s_date)
+
+    if not os.path.isdir(s_rslc_dir):
+        os.mkdir(s_rslc_dir)
+    # commands of this date only, run in s_rslc_dir
+    log_file = os.path.join(s_rslc_dir, f"{s_date}.coreg.log")
+    log = open(log_file, 'w')
+    kwargs = {'cwd': s_rslc_dir, 'tag': s_date, 'stdout': log, 'stderr': subprocess.STDOUT}
+
+    s_mli = os.path.join(s_rslc_dir, f"{s_date}.mli")
+    s_mli_par = s_mli + '.par'
+
+    call_str = f"multi_look {s_slc} {s_slc_par} {s_mli} {s_mli_par} {rlks} {alks}"
+    run_cmd(call_str, **kwargs)
+
+    lt = os.path.join(s_rslc_dir, f"{s_date}.lt")
+
+    call_str = f"rdc_trans {m_mli_par} {rdc_dem} {s_mli_par} {lt}"
+    run_cmd(call_str, **kwargs)
+
+    s_iw_slcs = [os.path.join(s_slc_dir, f"{s_date}.iw{i * 2}.slc") for i in iw_num]
+    m_iw_slcs = [os.path.join(m_slc_dir, f"{m_date}.iw{i * 2}.slc") for i in iw_num]
+    s_iw_rslcs = [os.path.join(s_rslc_dir, f"{s_date}.iw{i * 2}.slc") for i in iw_num]
+    write_tab(os.path.join(s_rslc_dir, 'SLC2_tab'), s_iw_slcs)
+    write_tab(os.path.join(s_rslc_dir, 'SLC1_tab'), m_iw_slcs)
+    write_tab(os.path.join(s_rslc_dir, 'RSLC2_tab'), s_iw_rslcs)
+
+    # call_str = f"S1_coreg_TOPS SLC1_tab {m_date} SLC2_tab {s_date} RSLC2_tab {rdc_dem} {rlks} {alks} - - 0.8 0.1 0.8 1"
+    call_str = f"S1_coreg_TOPS SLC1_tab {m_date} SLC2_tab {s_date} RSLC2_tab {rdc_dem} {rlks} {alks} - - {ESD_THRESHOLDS} 1"
+    run_cmd(call_str, **kwargs)
+
+    # delete files
+    save_files = []
+    save_files.append(s_date + '.rslc')
+    save_files.append(s_date + '.rslc.par')
+    save_files.append(m_date + '_' + s_date + '.coreg_quality')
+    save_files.append(m_date + '_' + s_date + '.diff.bmp')
+    save_files.append(s_date + '.coreg.log')
+
+    for f in os.listdir(s_rslc_dir):
+        if f not in save_files:
+            path = os.path.join(s_rslc_dir, f)
+            os.remove(path)
+
+    s_rslc = os.path.join(s_rslc_dir, s_date + '.rslc')
+    if not (os.path.isfile(s_rslc) and os.path.isfile(s_rslc + '.par')):
+        log.close()
+        return 1
+    s_rslc_new = os.path.join(s_rslc_dir, s_date + '.slc')
+    os.rename(s_rslc, s_rslc_new)
+    os.rename(s_rslc + '.par', s_rslc_new + '.par')
 
-    # check iw_num
-    for i in iw_num:
-        if i not in ['1', '2', '3']:
-            print('Error IW.')
-            sys.exit(1)
+    # generate bmp for rslc
+    code = gen_bmp(s_rslc_new, s_rslc_new + '.par', rlks, alks, **kwargs)
+    log.close()
+    return code
 
-    # get all date
-    tmp_files = os.listdir(slc_dir)
-    all_date = sorted([i for i in tmp_files if re.findall(r'^\d{8}$', i)])
-    if len(all_date) < 2:
-        print('not enough SLCs.')
-        sys.exit(1)
 
-    # check ref_slc
-    if ref_slc == '0':
-        ref_slc = all_date[0]
-    else:
-        if re.findall(r'^\d{8}$', ref_slc):
-            if not ref_slc in all_date:
-                print('no slc for {}.'.format(ref_slc))
-                sys.exit(1)
-        else:
-            print('error date for ref_slc.')
-            sys.exit(1)
+def date_cost(slc_dir, s_date, rlks, alks):
+    """estimated peak memory and disk (bytes) of co-registering one date"""
+    s_slc_par = os.path.join(slc_dir, s_date, s_date + '.slc.par')
+    try:
+        slc_bytes, pixels = read_image_size(s_slc_par)
+    except (OSError, KeyError, TypeError, ValueError):
+        return 0, 0
+    mem = COREG_MEM_FACTOR * slc_bytes
+    disk = COREG_DISK_FACTOR * slc_bytes + MLI_DISK_BYTES * pixels / (rlks * alks)
+    return mem, disk
 
-    m_date = ref_slc
+
+def reference_ok(slc_dir, m_date):
+    """whether multi-looked image, lookup table and height of reference exist"""
+    m_slc_dir = os.path.join(slc_dir, m_date)
+    files = [f"{m_date}.mli.par", 'lookup_table_fine', f"{m_date}.hgt"]
+    return all(os.path.isfile(os.path.join(m_slc_dir, i)) for i in files)
+
+
+def find_reference(slc_dir, all_date):
+    """reference date of previous run (the one having height file)"""
+    dates = [i for i in all_date if reference_ok(slc_dir, i)]
+    if len(dates) == 1:
+        return dates[0]
+    return None
+
+
+def rslc_ok(rslc_dir, s_date):
+    """whether date is already co-registered"""
+    rslc = os.path.join(rslc_dir, s_date, s_date + '.slc')
+    return os.path.isfile(rslc) and os.path.isfile(rslc + '.par')
+
+
+def prep_reference(slc_dir, m_date, dem, dem_par, rlks, alks):
+    """multi-look, lookup table and height in radar coordinate of reference"""
     m_slc_dir = os.path.join(slc_dir, m_date)
     m_slc = os.path.join(m_slc_dir, m_date + '.slc')
     m_slc_par = m_slc + '.par'
@@ -148,7 +200,7 @@ def main():
     m_mli_par = m_mli + '.par'
 
     call_str = f"multi_look {m_slc} {m_slc_par} {m_mli} {m_mli_par} {rlks} {alks}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     utm_dem = os.path.join(m_slc_dir, 'dem_seg')
     utm_dem_par = utm_dem + '.par'
@@ -162,63 +214,140 @@ def main():
     ls_map = os.path.join(m_slc_dir, 'ls_map')
 
     call_str = f"gc_map {m_mli_par} - {dem_par} {dem} {utm_dem_par} {utm_dem} {utm2rdc} 1 1 {sim_sar_utm} {u} {v} {inc} {psi} {pix} {ls_map} 8 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     pix_sigma0 = os.path.join(m_slc_dir, "pix_sigma0")
     pix_gamma0 = os.path.join(m_slc_dir, "pix_gamma0")
 
     call_str = f"pixel_area {m_mli_par} {utm_dem_par} {utm_dem} {utm2rdc} {ls_map} {inc} {pix_sigma0} {pix_gamma0}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     pix_gamma0_bmp = pix_gamma0 + '.bmp'
     width_mli = read_gamma_par(m_mli_par, 'range_samples')
 
     call_str = f"raspwr {pix_gamma0} {width_mli} - - - - - - - {pix_gamma0_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     diff_par = os.path.join(m_slc_dir, f"{m_date}.diff_par")
 
     call_str = f"create_diff_par {m_mli_par} - {diff_par} 1 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     offs = os.path.join(m_slc_dir, f"{m_date}.offs")
     snr = os.path.join(m_slc_dir, f"{m_date}.snr")
     offsets = os.path.join(m_slc_dir, ".offsets")
 
     call_str = f"offset_pwrm {pix_sigma0} {m_mli} {diff_par} {offs} {snr} 64 64 {offsets} 2 100 100 5.0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     coffs = os.path.join(m_slc_dir, "coffs")
     coffsets = os.path.join(m_slc_dir, "coffsets")
 
     call_str = f"offset_fitm {offs} {snr} {diff_par} {coffs} {coffsets} 5.0 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     width_utm_dem = read_gamma_par(utm_dem_par, 'width')
     utm_to_rdc = os.path.join(m_slc_dir, "lookup_table_fine")
 
     call_str = f"gc_map_fine {utm2rdc} {width_utm_dem} {diff_par} {utm_to_rdc} 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     geo_m_mli = os.path.join(m_slc_dir, f"geo_{m_date}.mli")
 
     call_str = f"geocode_back {m_mli} {width_mli} {utm_to_rdc} {geo_m_mli} {width_utm_dem} - 2 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     geo_m_mli_bmp = geo_m_mli + '.bmp'
 
     call_str = f"raspwr {geo_m_mli} {width_utm_dem} 1 0 1 1 1. .35 1 {geo_m_mli_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     rdc_dem = os.path.join(m_slc_dir, f"{m_date}.hgt")
 
     length_mli = read_gamma_par(m_mli_par, 'azimuth_lines')
     call_str = f"geocode {utm_to_rdc} {utm_dem} {width_utm_dem} {rdc_dem} {width_mli} {length_mli} 2 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     rdc_dem_bmp = rdc_dem + '.bmp'
     call_str = f"rashgt {rdc_dem} {m_mli} {width_mli} 1 1 0 1 1 160.0 1. .35 1 {rdc_dem_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
+
+
+def main():
+    inps = cmd_line_parser()
+    slc_dir = inps.slc_dir
+    rslc_dir = inps.rslc_dir
+    dem_dir = inps.dem_dir
+    iw_num = inps.iw_num
+    iw_num = iw_num.split()
+    rlks = inps.rlks
+    alks = inps.alks
+    ref_slc = inps.ref_slc
+    num_jobs = inps.jobs
+    max_mem, min_free = get_budgets(inps.max_mem, inps.min_free)
+    append = inps.append
+
+    # check slc_dir
+    slc_dir = os.path.abspath(slc_dir)
+    if not os.path.isdir(slc_dir):
+        print("{} not exists.".format(slc_dir))
+        sys.exit(1)
+
+    # check rslc_dir
+    rslc_dir = os.path.abspath(rslc_dir)
+    if not os.path.isdir(rslc_dir):
+        os.mkdir(rslc_dir)
+
+    # check dem
+    dem_dir = os.path.abspath(dem_dir)
+    if not os.path.isdir(dem_dir):
+        print("{} not exists.".format(dem_dir))
+    else:
+        dem = glob.glob(dem_dir + '/*.dem')
+        dem_par = glob.glob(dem_dir + '/*.dem.par')
+        if not (dem and dem_par):
+            print('dem or dem.par not exist.')
+        else:
+            dem = dem[0]
+            dem_par = dem_par[0]
+
+    # check iw_num
+    for i in iw_num:
+        if i not in ['1', '2', '3']:
+            print('Error IW.')
+            sys.exit(1)
+
+    # get all date
+    tmp_files = os.listdir(slc_dir)
+    all_date = sorted([i for i in tmp_files if re.findall(r'^\d{8}$', i)])
+    if len(all_date) < 2:
+        print('not enough SLCs.')
+        sys.exit(1)
+
+    # check ref_slc
+    if ref_slc == '0' and append:
+        ref_slc = find_reference(slc_dir, all_date) or all_date[0]
+    elif ref_slc == '0':
+        ref_slc = all_date[0]
+    else:
+        if re.findall(r'^\d{8}$', ref_slc):
+            if not ref_slc in all_date:
+                print('no slc for {}.'.format(ref_slc))
+                sys.exit(1)
+        else:
+            print('error date for ref_slc.')
+            sys.exit(1)
+
+    m_date = ref_slc
+    m_slc_dir = os.path.join(slc_dir, m_date)
+    m_slc = os.path.join(m_slc_dir, m_date + '.slc')
+    m_slc_par = m_slc + '.par'
+
+    # lookup table of reference is reused when appending
+    if append and reference_ok(slc_dir, m_date):
+        print('reuse lookup table and height of reference {}.'.format(m_date))
+    else:
+        prep_reference(slc_dir, m_date, dem, dem_par, rlks, alks)
 
     # get slave date
     s_dates = all_date
@@ -235,180 +364,29 @@ def main():
     if not os.path.isfile(m_rslc_par):
         shutil.copy(m_slc_par, m_rslc_dir)
 
-    for s_date in s_dates:
-        s_slc_dir = os.path.join(slc_dir, s_date)
-        s_slc = os.path.join(s_slc_dir, s_date + '.slc')
-        s_slc_par = s_slc + '.par'
-        s_rslc_dir = os.path.join(rslc_dir, s_date)
-
-        if not os.path.isdir(s_rslc_dir):
-            os.mkdir(s_rslc_dir)
-        s_mli = os.path.join(s_rslc_dir, f"{s_date}.mli")
-        s_mli_par = s_mli + '.par'
-
-        call_str = f"multi_look {s_slc} {s_slc_par} {s_mli} {s_mli_par} {rlks} {alks}"
-        os.system(call_str)
-
-        lt = os.path.join(s_rslc_dir, f"{s_date}.lt")
-
-        call_str = f"rdc_trans {m_mli_par} {rdc_dem} {s_mli_par} {lt}"
-        os.system(call_str)
-
-        if len(iw_num) == 1:
-            s_iw_slc = os.path.join(s_slc_dir,
-                                    f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_slc_par = s_iw_slc + '.par'
-            s_iw_slc_tops_par = s_iw_slc + '.tops_par'
-
-            m_iw_slc = os.path.join(m_slc_dir,
-                                    f"{m_date}.iw{iw_num[0] * 2}.slc")
-            m_iw_slc_par = m_iw_slc + '.par'
-            m_iw_slc_tops_par = m_iw_slc + '.tops_par'
-
-            s_iw_rslc = os.path.join(s_rslc_dir,
-                                     f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_rslc_par = s_iw_rslc + '.par'
-            s_iw_rslc_tops_par = s_iw_rslc + '.tops_par'
-
-            os.chdir(s_rslc_dir)
-
-            call_str = f"echo {s_iw_slc} {s_iw_slc_par} {s_iw_slc_tops_par} > SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc} {m_iw_slc_par} {m_iw_slc_tops_par} > SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc} {s_iw_rslc_par} {s_iw_rslc_tops_par} > RSLC2_tab"
-            os.system(call_str)
-
-        if len(iw_num) == 2:
-            s_iw_slc1 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_slc_par1 = s_iw_slc1 + '.par'
-            s_iw_slc_tops_par1 = s_iw_slc1 + '.tops_par'
-            s_iw_slc2 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_slc_par2 = s_iw_slc2 + '.par'
-            s_iw_slc_tops_par2 = s_iw_slc2 + '.tops_par'
-
-            m_iw_slc1 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[0] * 2}.slc")
-            m_iw_slc_par1 = m_iw_slc1 + '.par'
-            m_iw_slc_tops_par1 = m_iw_slc1 + '.tops_par'
-            m_iw_slc2 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[1] * 2}.slc")
-            m_iw_slc_par2 = m_iw_slc2 + '.par'
-            m_iw_slc_tops_par2 = m_iw_slc2 + '.tops_par'
-
-            s_iw_rslc1 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_rslc_par1 = s_iw_rslc1 + '.par'
-            s_iw_rslc_tops_par1 = s_iw_rslc1 + '.tops_par'
-            s_iw_rslc2 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_rslc_par2 = s_iw_rslc2 + '.par'
-            s_iw_rslc_tops_par2 = s_iw_rslc2 + '.tops_par'
-
-            os.chdir(s_rslc_dir)
-
-            call_str = f"echo {s_iw_slc1} {s_iw_slc_par1} {s_iw_slc_tops_par1} > SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_slc2} {s_iw_slc_par2} {s_iw_slc_tops_par2} >> SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc1} {m_iw_slc_par1} {m_iw_slc_tops_par1} > SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc2} {m_iw_slc_par2} {m_iw_slc_tops_par2} >> SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc1} {s_iw_rslc_par1} {s_iw_rslc_tops_par1} > RSLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc2} {s_iw_rslc_par2} {s_iw_rslc_tops_par2} >> RSLC2_tab"
-            os.system(call_str)
-
-        if len(iw_num) == 3:
-            s_iw_slc1 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_slc_par1 = s_iw_slc1 + '.par'
-            s_iw_slc_tops_par1 = s_iw_slc1 + '.tops_par'
-            s_iw_slc2 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_slc_par2 = s_iw_slc2 + '.par'
-            s_iw_slc_tops_par2 = s_iw_slc2 + '.tops_par'
-            s_iw_slc3 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[2] * 2}.slc")
-            s_iw_slc_par3 = s_iw_slc3 + '.par'
-            s_iw_slc_tops_par3 = s_iw_slc3 + '.tops_par'
-
-            m_iw_slc1 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[0] * 2}.slc")
-            m_iw_slc_par1 = m_iw_slc1 + '.par'
-            m_iw_slc_tops_par1 = m_iw_slc1 + '.tops_par'
-            m_iw_slc2 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[1] * 2}.slc")
-            m_iw_slc_par2 = m_iw_slc2 + '.par'
-            m_iw_slc_tops_par2 = m_iw_slc2 + '.tops_par'
-            m_iw_slc3 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[2] * 2}.slc")
-            m_iw_slc_par3 = m_iw_slc3 + '.par'
-            m_iw_slc_tops_par3 = m_iw_slc3 + '.tops_par'
-
-            s_iw_rslc1 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_rslc_par1 = s_iw_rslc1 + '.par'
-            s_iw_rslc_tops_par1 = s_iw_rslc1 + '.tops_par'
-            s_iw_rslc2 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_rslc_par2 = s_iw_rslc2 + '.par'
-            s_iw_rslc_tops_par2 = s_iw_rslc2 + '.tops_par'
-            s_iw_rslc3 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[2] * 2}.slc")
-            s_iw_rslc_par3 = s_iw_rslc3 + '.par'
-            s_iw_rslc_tops_par3 = s_iw_rslc3 + '.tops_par'
-
-            os.chdir(s_rslc_dir)
-
-            call_str = f"echo {s_iw_slc1} {s_iw_slc_par1} {s_iw_slc_tops_par1} > SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_slc2} {s_iw_slc_par2} {s_iw_slc_tops_par2} >> SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_slc3} {s_iw_slc_par3} {s_iw_slc_tops_par3} >> SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc1} {m_iw_slc_par1} {m_iw_slc_tops_par1} > SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc2} {m_iw_slc_par2} {m_iw_slc_tops_par2} >> SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc3} {m_iw_slc_par3} {m_iw_slc_tops_par3} >> SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc1} {s_iw_rslc_par1} {s_iw_rslc_tops_par1} > RSLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc2} {s_iw_rslc_par2} {s_iw_rslc_tops_par2} >> RSLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc3} {s_iw_rslc_par3} {s_iw_rslc_tops_par3} >> RSLC2_tab"
-            os.system(call_str)
-
-        # call_str = f"S1_coreg_TOPS SLC1_tab {m_date} SLC2_tab {s_date} RSLC2_tab {rdc_dem} {rlks} {alks} - - 0.8 0.1 0.8 1"
-        call_str = f"S1_coreg_TOPS SLC1_tab {m_date} SLC2_tab {s_date} RSLC2_tab {rdc_dem} {rlks} {alks} - - 0.7 0.001 0.7 1"
-        os.system(call_str)
-
-        # delete files
-        save_files = []
-        save_files.append(s_date + '.rslc')
-        save_files.append(s_date + '.rslc.par')
-        save_files.append(m_date + '_' + s_date + '.coreg_quality')
-        save_files.append(m_date + '_' + s_date + '.diff.bmp')
-
-        for f in os.listdir(s_rslc_dir):
-            if f not in save_files:
-                path = os.path.join(s_rslc_dir, f)
-                os.remove(path)
-
-        os.rename(s_date + '.rslc', s_date + '.slc')
-        os.rename(s_date + '.rslc.par', s_date + '.slc.par')
-
-    # generate bmp for rslc
-    rslc_files = glob.glob(rslc_dir + '/*/*.slc')
-    for f in rslc_files:
-        gen_bmp(f, f + '.par', rlks, alks)
+    # co-register all dates, each in its own directory
+    if append:
+        done = [i for i in s_dates if rslc_ok(rslc_dir, i)]
+        s_dates = [i for i in s_dates if i not in done]
+        print('{} dates already co-registered, {} new dates.'.format(
+            len(done), len(s_dates)))
+    jobs = [(s_date, slc_dir, rslc_dir, m_date, iw_num, rlks, alks)
+            for s_date in s_dates]
+    costs = {s_date: date_cost(slc_dir, s_date, rlks, alks) for s_date in s_dates}
+    print('\nco-registering {} dates to {}:'.format(len(jobs), m_date))
+    results = run_jobs(coreg_date, jobs, num_jobs, costs, max_mem, rslc_dir,
+                       min_free)
+    print_summary(results)
+
+    # generate bmp for reference
+    gen_bmp(m_rslc, m_rslc_par, rlks, alks, tag=m_date)
 
     # check coreg_quality
-    get_coreg_quality(rslc_dir)
+    get_coreg_quality(rslc_dir,
+                      thresholds={
+                          'reference': m_date,
+                          'cc_thresh fraction_thresh ph_stdev_thresh': ESD_THRESHOLDS
+                      })
 
     print('\nall done, enjoy it.\n')
 
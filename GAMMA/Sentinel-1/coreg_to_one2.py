@@ -10,10 +10,32 @@ import argparse
 import shutil
 import glob
 import sys
+import subprocess
+import datetime
+
+from cmd_runner import run_cmd
+from gamma_par import read_gamma_par
+from job_pool import run_jobs, print_summary, get_budgets, read_image_size
+from coreg_quality import get_coreg_quality
+
+# memory of SLC_interp_lt_S1_TOPS and SLC_diff_intf as part of SLC size
+COREG_MEM_FACTOR = 1.5
+# swath RSLCs, mosaic and RSLCs of refinement iterations as part of SLC size
+COREG_DISK_FACTOR = 3
+# size of mli, lookup table and offsets per multi-looked pixel
+MLI_DISK_BYTES = 32
 
 EXAMPLE = """Example:
   ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '2'
   ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '1 2' --rlks 8 --alks 2 --ref_slc 20201111
+  ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8
+  ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8 --max_mem 64 --min_free 50
+  # dates far from reference through dates at most 48 days apart
+  ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8 --tree 48
+  # at most 5 dates between reference and any date
+  ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8 --tree 48 --depth 5
+  # only new dates
+  ./coreg_to_one2.py /ly/slc /ly/rslc /ly/dem '1 2 3' --rlks 8 --alks 2 --jobs 8 --append
 """
 
 
@@ -37,89 +59,365 @@ def cmd_line_parser():
     parser.add_argument('--ref_slc',
                         help='reference SLC (default: the first slc)',
                         default='0')
+    parser.add_argument('--jobs',
+                        help='number of dates co-registered at the same time (defaults: 1)',
+                        default=1,
+                        type=int)
+    parser.add_argument('--max_mem',
+                        help='memory used by running dates in GB (defaults: 80%% of available memory)',
+                        default=None,
+                        type=float)
+    parser.add_argument('--min_free',
+                        help='free space kept in rslc_dir in GB (defaults: 10)',
+                        default=10,
+                        type=float)
+    parser.add_argument('--tree',
+                        help='co-register along minimum spanning tree of temporal baselines,\n'
+                        'maximum days between linked dates, dates farther are linked to reference\n'
+                        '(defaults: 0, all dates to reference)',
+                        default=0,
+                        type=int)
+    parser.add_argument('--depth',
+                        help='maximum number of dates from reference in tree (defaults: 0, no limit)',
+                        default=0,
+                        type=int)
+    parser.add_argument('--append',
+                        help='only co-register dates without RSLC, reuse lookup table of reference',
+                        action='store_true')
     inps = parser.parse_args()
 
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
-def gen_bmp(slc, slc_par, rlks, alks):
+def gen_bmp(slc, slc_par, rlks, alks, **kwargs):
     width = read_gamma_par(slc_par, 'range_samples')
     bmp = slc + '.bmp'
     call_str = f"rasSLC {slc} {width} 1 0 {rlks} {alks} 1. .35 1 0 0 {bmp}"
-    os.system(call_str)
+    return run_cmd(call_str, **kwargs)
 
 
-def main():
-    inps = cmd_line_parser()
-    slc_dir = inps.slc_dir
-    rslc_dir = inps.rslc_dir
-    dem_dir = inps.dem_dir
-    iw_num = inps.iw_num
-    iw_num = iw_num.split()
-    rlks = inps.rlks
-    alks = inps.alks
-    ref_slc = inps.ref_slc
+def write_tab(tab_file, slcs):
+    """SLC_tab of swaths (slc slc_par tops_par in each line)"""
+    with open(tab_file, 'w') as f:
+        for slc in slcs:
+            f.write(f"{slc} {slc}.par {slc}.tops_par\n")
 
-    # check slc_dir
-    slc_dir = os.path.abspath(slc_dir)
-    if not os.path.isdir(slc_dir):
-        print("{} not exists.".format(slc_dir))
-        sys.exit(1)
 
-    # check rslc_dir
-    rslc_dir = os.path.abspath(rslc_dir)
-    if not os.path.isdir(rslc_dir):
-        os.mkdir(rslc_dir)
+def coreg_date(s_date, slc_dir, rslc_dir, m_date, iw_num, rlks, alks,
+               p_date=None, keep_swaths=False):
+    """co-register one date to reference in its own directory, return exit code
 
-    # check dem
-    dem_dir = os.path.abspath(dem_dir)
-    if not os.path.isdir(dem_dir):
-        print("{} not exists.".format(dem_dir))
-    else:
-        dem = glob.glob(dem_dir + '/*.dem')
-        dem_par = glob.glob(dem_dir + '/*.dem.par')
-        if not (dem and dem_par):
-            print('dem or dem.par not exist.')
-        else:
-            dem = dem[0]
-            dem_par = dem_par[0]
+    p_date is a date already co-registered to reference, its swath RSLCs are
+    used by spectral diversity (RSLC3_tab) instead of reference.
+    """
+    m_slc_dir = os.path.join(slc_dir, m_date)
+    m_slc = os.path.join(m_slc_dir, m_date + '.slc')
+    m_slc_par = m_slc + '.par'
+    m_mli = os.path.join(m_slc_dir, f"{m_date}.mli")
+    m_mli_par = m_mli + '.par'
+    rdc_dem = os.path.join(m_slc_dir, f"{m_date}.hgt")
+    width_mli = read_gamma_par(m_mli_par, 'range_samples')
 
-    # check iw_num
-    for i in iw_num:
-        if i not in ['1', '2', '3']:
-            print('Error IW.')
-            sys.exit(1)
+    s_slc_dir = os.path.join(slc_dir, s_date)
+    s_slc = os.path.join(s_slc_dir, s_date + '.slc')
+    s_slc_par = s_slc + '.par'
+    s_rslc_dir = os.path.join(rslc_dir, s_date)
+
+    if not os.path.isdir(s_rslc_dir):
+        os.mkdir(s_rslc_dir)
+    # commands of this date only, run in s_rslc_dir
+    log_file = os.path.join(s_rslc_dir, f"{s_date}.coreg.log")
+    log = open(log_file, 'w')
+    kwargs = {'cwd': s_rslc_dir, 'tag': s_date, 'stdout': log, 'stderr': subprocess.STDOUT}
+    s_mli = os.path.join(s_rslc_dir, f"{s_date}.mli")
+    s_mli_par = s_mli + '.par'
+
+    call_str = f"multi_look {s_slc} {s_slc_par} {s_mli} {s_mli_par} {rlks} {alks}"
+    run_cmd(call_str, **kwargs)
+
+    lt = os.path.join(s_rslc_dir, f"{s_date}.lt")
+
+    call_str = f"rdc_trans {m_mli_par} {rdc_dem} {s_mli_par} {lt}"
+    run_cmd(call_str, **kwargs)
+
+    s_iw_slcs = [os.path.join(s_slc_dir, f"{s_date}.iw{i * 2}.slc") for i in iw_num]
+    m_iw_slcs = [os.path.join(m_slc_dir, f"{m_date}.iw{i * 2}.slc") for i in iw_num]
+    s_iw_rslcs = [os.path.join(s_rslc_dir, f"{s_date}.iw{i * 2}.slc") for i in iw_num]
+    write_tab(os.path.join(s_rslc_dir, 'SLC2_tab'), s_iw_slcs)
+    write_tab(os.path.join(s_rslc_dir, 'SLC1_tab'), m_iw_slcs)
+    write_tab(os.path.join(s_rslc_dir, 'RSLC2_tab'), s_iw_rslcs)
+    rslc3_tab = ''
+    if p_date and p_date != m_date:
+        p_iw_rslcs = [os.path.join(rslc_dir, p_date, f"{p_date}.iw{i * 2}.slc") for i in iw_num]
+        write_tab(os.path.join(s_rslc_dir, 'RSLC3_tab'), p_iw_rslcs)
+        rslc3_tab = ' RSLC3_tab'
+
+    s_rslc = os.path.join(s_rslc_dir, f"{s_date}.rslc")
+    s_rslc_par = s_rslc + ".par"
+    call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} - RSLC2_tab {s_rslc} {s_rslc_par}"
+    run_cmd(call_str, **kwargs)
+
+    s_rmli = os.path.join(s_rslc_dir, f"{s_date}.rslc.mli")
+    s_rmli_par = s_rmli + ".par"
+    call_str = f"multi_look {s_rslc} {s_rslc_par} {s_rmli} {s_rmli_par} {rlks} {alks}"
+    run_cmd(call_str, **kwargs)
+
+    s_rmli_bmp = s_rmli + ".bmp"
+    call_str = f"raspwr {s_rmli} {width_mli} - - - - - - - {s_rmli_bmp}"
+    run_cmd(call_str, **kwargs)
+
+    off_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off")
+    call_str = f"create_offset {m_slc_par} {s_slc_par} {off_file} 1 {rlks} {alks} 0"
+    run_cmd(call_str, **kwargs)
+
+    offs_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.offs")
+    snr_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.snr")
+    call_str = f"offset_pwr {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off_file} {offs_file} {snr_file} 256 64 - 1 100 100 15.0 4 0 0"
+    run_cmd(call_str, **kwargs)
+
+    call_str = f"offset_fit {offs_file} {snr_file} {off_file}  - - 0.5 1 0"
+    run_cmd(call_str, **kwargs)
+
+    call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_file} RSLC2_tab {s_rslc} {s_rslc_par}"
+    run_cmd(call_str, **kwargs)
+
+    off1_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off1")
+    call_str = f"create_offset {m_slc_par} {s_slc_par} {off1_file} 1 {rlks} {alks} 0"
+    run_cmd(call_str, **kwargs)
+
+    offs1_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.offs1")
+    snr1_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.snr1")
+    coreg_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.coreg")
+    call_str = f"offset_pwr {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off1_file} {offs1_file} {snr1_file} 256 64 {coreg_file} 1 200 200 16.0 4 0 0"
+    run_cmd(call_str, **kwargs)
+
+    call_str = f"offset_fit {offs1_file} {snr1_file} {off1_file}  - - 0.5 1 0"
+    run_cmd(call_str, **kwargs)
+
+    off_total_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off.total")
+    call_str = f"offset_add {off_file} {off1_file} {off_total_file}"
+    run_cmd(call_str, **kwargs)
+
+    call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_total_file} RSLC2_tab {s_rslc} {s_rslc_par}"
+    run_cmd(call_str, **kwargs)
+
+    sim_unw0 = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.sim_unw0")
+    call_str = f"phase_sim_orb {m_slc_par} {s_slc_par} {off_total_file} {rdc_dem} {sim_unw0} {m_slc_par} - - 1 1"
+    run_cmd(call_str, **kwargs)
+
+    diff0 = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.diff0")
+    call_str = f"SLC_diff_intf {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off_total_file} {sim_unw0} {diff0} {rlks} {alks} 0 0 0.25 1 1"
+    run_cmd(call_str, **kwargs)
+
+    diff0_bmp = diff0 + '.bmp'
+    call_str = f"rasmph {diff0} {width_mli} 1 0 1 1 1. .35 1 {diff0_bmp}"
+    run_cmd(call_str, **kwargs)
+
+    off_corrected = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off.corrected")
+    call_str = f"S1_coreg_overlap SLC1_tab RSLC2_tab {m_date}-{s_date} {off_total_file} {off_corrected} 0.8 0.01 0.8 1{rslc3_tab}"
+    run_cmd(call_str, **kwargs)
+
+    call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_corrected} RSLC2_tab {s_rslc} {s_rslc_par}"
+    run_cmd(call_str, **kwargs)
+
+    off_corrected2 = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off.corrected2")
+    call_str = f"S1_coreg_overlap SLC1_tab RSLC2_tab {m_date}-{s_date} {off_corrected} {off_corrected2} 0.8 0.01 0.8 1{rslc3_tab}"
+    run_cmd(call_str, **kwargs)
+
+    call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_corrected2} RSLC2_tab {s_rslc} {s_rslc_par}"
+    run_cmd(call_str, **kwargs)
+
+    sim_unw = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.sim_unw")
+    call_str = f"phase_sim_orb {m_slc_par} {s_slc_par} {off_corrected2} {rdc_dem} {sim_unw} {m_slc_par} - - 1 1"
+    run_cmd(call_str, **kwargs)
+
+    diff = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.diff")
+    call_str = f"SLC_diff_intf {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off_corrected2} {sim_unw} {diff} {rlks} {alks} 0 0 0.25 1 1"
+    run_cmd(call_str, **kwargs)
+
+    diff_bmp = diff + '.bmp'
+    call_str = f"rasmph {diff} {width_mli} 1 0 1 1 1. .35 1 {diff_bmp}"
+    run_cmd(call_str, **kwargs)
+
+    diff_pwr_bmp = diff + '.pwr.bmp'
+    call_str = f"rasmph_pwr {diff} {m_mli} {width_mli} 1 1 0 1 1 1. .35 1 {diff_pwr_bmp}"
+    run_cmd(call_str, **kwargs)
+
+    # delete files
+    save_files = []
+    save_files.append(s_date + '.rslc')
+    save_files.append(s_date + '.rslc.par')
+    save_files.append(m_date + '-' + s_date + '.diff.bmp')
+    save_files.append(m_date + '-' + s_date + '.diff.pwr.bmp')
+    save_files.append(s_date + '.coreg.log')
+    # swath RSLCs are needed by dates co-registered through this date
+    if keep_swaths:
+        for i in s_iw_rslcs:
+            save_files += [os.path.basename(i) + j for j in ['', '.par', '.tops_par']]
+
+    for f in os.listdir(s_rslc_dir):
+        if f not in save_files:
+            path = os.path.join(s_rslc_dir, f)
+            os.remove(path)
+
+    if not (os.path.isfile(s_rslc) and os.path.isfile(s_rslc_par)):
+        log.close()
+        return 1
+    s_rslc_new = os.path.join(s_rslc_dir, s_date + '.slc')
+    os.rename(s_rslc, s_rslc_new)
+    os.rename(s_rslc_par, s_rslc_new + '.par')
 
-    # get all date
-    tmp_files = os.listdir(slc_dir)
-    all_date = sorted([i for i in tmp_files if re.findall(r'^\d{8}$', i)])
-    if len(all_date) < 2:
-        print('not enough SLCs.')
-        sys.exit(1)
+    # generate bmp for rslc
+    code = gen_bmp(s_rslc_new, s_rslc_new + '.par', rlks, alks, **kwargs)
+    log.close()
+    return code
+
+
+def date_diff(date1, date2):
+    """days between two dates"""
+    d1 = datetime.datetime.strptime(date1, '%Y%m%d')
+    d2 = datetime.datetime.strptime(date2, '%Y%m%d')
+    return abs((d1 - d2).days)
+
+
+def build_tree(s_dates, m_date, max_days, max_depth=0):
+    """{date: (parent, level)} of co-registration tree rooted at reference
+
+    minimum spanning tree of temporal baselines grown from reference (Prim),
+    parents are limited to levels below max_depth (0: no limit) and a date
+    whose nearest link is longer than max_days is linked to reference.
+    """
+    tree = {m_date: (None, 0)}
+    # nearest date in tree (days, parent) of every date not in tree
+    best = {date: (date_diff(m_date, date), m_date) for date in s_dates}
+    while best:
+        date = min(best, key=lambda d: (best[d][0], d))
+        days, parent = best.pop(date)
+        if days > max_days:
+            parent = m_date
+        tree[date] = (parent, tree[parent][1] + 1)
+        if max_depth and tree[date][1] >= max_depth:
+            continue
+        for other in best:
+            days = date_diff(date, other)
+            if days < best[other][0]:
+                best[other] = (days, date)
+    return tree
+
+
+def write_tree(tree, tree_file):
+    """date, parent and level of every date"""
+    with open(tree_file, 'w') as f:
+        f.write('date parent level\n')
+        for date in sorted(tree):
+            parent, level = tree[date]
+            f.write('{} {} {}\n'.format(date, parent or '-', level))
+
+
+def get_chain(tree, date):
+    """dates from reference to date"""
+    chain = [date]
+    while tree[chain[-1]][0]:
+        chain.append(tree[chain[-1]][0])
+    return chain[::-1]
+
+
+def has_swaths(rslc_dir, date, iw_num):
+    """whether swath RSLCs of date are kept"""
+    return all(
+        os.path.isfile(os.path.join(rslc_dir, date, f"{date}.iw{i * 2}.slc.tops_par"))
+        for i in iw_num)
+
+
+def coreg_tree(s_dates, done, slc_dir, rslc_dir, m_date, iw_num, rlks, alks,
+               max_days, max_depth, num_jobs, costs=None, max_mem=None,
+               min_free=0):
+    """co-register dates level by level through tree, return {date: exit code}
+
+    swath RSLCs are kept only for the first and last dates, which new dates of
+    later runs (--append) are usually linked to. A new date linked to another
+    date without swath RSLCs is co-registered to reference.
+    """
+    if not s_dates:
+        return {}
+    tree = build_tree(s_dates + done, m_date, max_days, max_depth)
+    for date in s_dates:
+        parent = tree[date][0]
+        if parent in done and not has_swaths(rslc_dir, parent, iw_num):
+            print('swath RSLCs of {} not found, co-register {} to {}.'.format(
+                parent, date, m_date))
+            tree[date] = (m_date, 1)
+    # levels of dates below relinked dates
+    for date in sorted(tree, key=lambda d: len(get_chain(tree, d))):
+        if tree[date][0]:
+            tree[date] = (tree[date][0], tree[tree[date][0]][1] + 1)
+    parents = set(i[0] for i in tree.values())
+    edges = set([min(s_dates + done), max(s_dates + done)])
+    tree_file = os.path.join(rslc_dir, 'coreg_tree.txt')
+    write_tree(tree, tree_file)
+    print('write {}'.format(tree_file))
+
+    results = {}
+    levels = sorted(set(tree[i][1] for i in s_dates))
+    for level in levels:
+        jobs = []
+        for date in sorted(i for i in s_dates if tree[i][1] == level):
+            parent = tree[date][0]
+            if results.get(parent, 0) != 0:
+                print('skip {}, {} failed.'.format(date, parent))
+                results[date] = -1
+                continue
+            print('{}: {}'.format(date, ' -> '.join(get_chain(tree, date))))
+            jobs.append((date, slc_dir, rslc_dir, m_date, iw_num, rlks, alks,
+                         parent, date in parents or date in edges))
+        print('\nlevel {}: co-registering {} dates:'.format(level, len(jobs)))
+        results.update(
+            run_jobs(coreg_date, jobs, num_jobs, costs, max_mem, rslc_dir,
+                     min_free))
+
+    # swath RSLCs are not needed any more, except first and last dates
+    for date in tree:
+        if date != m_date and date not in edges:
+            for f in glob.glob(os.path.join(rslc_dir, date, f"{date}.iw*.slc*")):
+                os.remove(f)
+    return results
+
+
+def date_cost(slc_dir, s_date, rlks, alks):
+    """estimated peak memory and disk (bytes) of co-registering one date"""
+    s_slc_par = os.path.join(slc_dir, s_date, s_date + '.slc.par')
+    try:
+        slc_bytes, pixels = read_image_size(s_slc_par)
+    except (OSError, KeyError, TypeError, ValueError):
+        return 0, 0
+    mem = COREG_MEM_FACTOR * slc_bytes
+    disk = COREG_DISK_FACTOR * slc_bytes + MLI_DISK_BYTES * pixels / (rlks * alks)
+    return mem, disk
+
+
+def reference_ok(slc_dir, m_date):
+    """whether multi-looked image, lookup table and height of reference exist"""
+    m_slc_dir = os.path.join(slc_dir, m_date)
+    files = [f"{m_date}.mli.par", 'lookup_table_fine', f"{m_date}.hgt"]
+    return all(os.path.isfile(os.path.join(m_slc_dir, i)) for i in files)
 
-    # check ref_slc
-    if ref_slc == '0':
-        ref_slc = all_date[0]
-    else:
-        if re.findall(r'^\d{8}$', ref_slc):
-            if not ref_slc in all_date:
-                print('no slc for {}.'.format(ref_slc))
-                sys.exit(1)
-        else:
-            print('error date for ref_slc.')
-            sys.exit(1)
 
-    m_date = ref_slc
+def find_reference(slc_dir, all_date):
+    """reference date of previous run (the one having height file)"""
+    dates = [i for i in all_date if reference_ok(slc_dir, i)]
+    if len(dates) == 1:
+        return dates[0]
+    return None
+
+
+def rslc_ok(rslc_dir, s_date):
+    """whether date is already co-registered"""
+    rslc = os.path.join(rslc_dir, s_date, s_date + '.slc')
+    return os.path.isfile(rslc) and os.path.isfile(rslc + '.par')
+
+
+def prep_reference(slc_dir, m_date, dem, dem_par, rlks, alks):
+    """multi-look, lookup table and height in radar coordinate of reference"""
     m_slc_dir = os.path.join(slc_dir, m_date)
     m_slc = os.path.join(m_slc_dir, m_date + '.slc')
     m_slc_par = m_slc + '.par'
@@ -127,7 +425,7 @@ def main():
     m_mli_par = m_mli + '.par'
 
     call_str = f"multi_look {m_slc} {m_slc_par} {m_mli} {m_mli_par} {rlks} {alks}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     utm_dem = os.path.join(m_slc_dir, 'dem_seg')
     utm_dem_par = utm_dem + '.par'
@@ -141,63 +439,142 @@ def main():
     ls_map = os.path.join(m_slc_dir, 'ls_map')
 
     call_str = f"gc_map {m_mli_par} - {dem_par} {dem} {utm_dem_par} {utm_dem} {utm2rdc} 1 1 {sim_sar_utm} {u} {v} {inc} {psi} {pix} {ls_map} 8 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     pix_sigma0 = os.path.join(m_slc_dir, "pix_sigma0")
     pix_gamma0 = os.path.join(m_slc_dir, "pix_gamma0")
 
     call_str = f"pixel_area {m_mli_par} {utm_dem_par} {utm_dem} {utm2rdc} {ls_map} {inc} {pix_sigma0} {pix_gamma0}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     pix_gamma0_bmp = pix_gamma0 + '.bmp'
     width_mli = read_gamma_par(m_mli_par, 'range_samples')
 
     call_str = f"raspwr {pix_gamma0} {width_mli} - - - - - - - {pix_gamma0_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     diff_par = os.path.join(m_slc_dir, f"{m_date}.diff_par")
 
     call_str = f"create_diff_par {m_mli_par} - {diff_par} 1 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     offs = os.path.join(m_slc_dir, f"{m_date}.offs")
     snr = os.path.join(m_slc_dir, f"{m_date}.snr")
     offsets = os.path.join(m_slc_dir, ".offsets")
 
     call_str = f"offset_pwrm {pix_sigma0} {m_mli} {diff_par} {offs} {snr} 64 64 {offsets} 2 100 100 5.0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     coffs = os.path.join(m_slc_dir, "coffs")
     coffsets = os.path.join(m_slc_dir, "coffsets")
 
     call_str = f"offset_fitm {offs} {snr} {diff_par} {coffs} {coffsets} 5.0 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     width_utm_dem = read_gamma_par(utm_dem_par, 'width')
     utm_to_rdc = os.path.join(m_slc_dir, "lookup_table_fine")
 
     call_str = f"gc_map_fine {utm2rdc} {width_utm_dem} {diff_par} {utm_to_rdc} 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     geo_m_mli = os.path.join(m_slc_dir, f"geo_{m_date}.mli")
 
     call_str = f"geocode_back {m_mli} {width_mli} {utm_to_rdc} {geo_m_mli} {width_utm_dem} - 2 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     geo_m_mli_bmp = geo_m_mli + '.bmp'
 
     call_str = f"raspwr {geo_m_mli} {width_utm_dem} 1 0 1 1 1. .35 1 {geo_m_mli_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     rdc_dem = os.path.join(m_slc_dir, f"{m_date}.hgt")
 
     length_mli = read_gamma_par(m_mli_par, 'azimuth_lines')
     call_str = f"geocode {utm_to_rdc} {utm_dem} {width_utm_dem} {rdc_dem} {width_mli} {length_mli} 2 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
 
     rdc_dem_bmp = rdc_dem + '.bmp'
     call_str = f"rashgt {rdc_dem} {m_mli} {width_mli} 1 1 0 1 1 160.0 1. .35 1 {rdc_dem_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=m_date)
+
+
+def main():
+    inps = cmd_line_parser()
+    slc_dir = inps.slc_dir
+    rslc_dir = inps.rslc_dir
+    dem_dir = inps.dem_dir
+    iw_num = inps.iw_num
+    iw_num = iw_num.split()
+    rlks = inps.rlks
+    alks = inps.alks
+    ref_slc = inps.ref_slc
+    num_jobs = inps.jobs
+    max_mem, min_free = get_budgets(inps.max_mem, inps.min_free)
+    append = inps.append
+    max_days = inps.tree
+    max_depth = inps.depth
+
+    # check slc_dir
+    slc_dir = os.path.abspath(slc_dir)
+    if not os.path.isdir(slc_dir):
+        print("{} not exists.".format(slc_dir))
+        sys.exit(1)
+
+    # check rslc_dir
+    rslc_dir = os.path.abspath(rslc_dir)
+    if not os.path.isdir(rslc_dir):
+        os.mkdir(rslc_dir)
+
+    # check dem
+    dem_dir = os.path.abspath(dem_dir)
+    if not os.path.isdir(dem_dir):
+        print("{} not exists.".format(dem_dir))
+    else:
+        dem = glob.glob(dem_dir + '/*.dem')
+        dem_par = glob.glob(dem_dir + '/*.dem.par')
+        if not (dem and dem_par):
+            print('dem or dem.par not exist.')
+        else:
+            dem = dem[0]
+            dem_par = dem_par[0]
+
+    # check iw_num
+    for i in iw_num:
+        if i not in ['1', '2', '3']:
+            print('Error IW.')
+            sys.exit(1)
+
+    # get all date
+    tmp_files = os.listdir(slc_dir)
+    all_date = sorted([i for i in tmp_files if re.findall(r'^\d{8}$', i)])
+    if len(all_date) < 2:
+        print('not enough SLCs.')
+        sys.exit(1)
+
+    # check ref_slc
+    if ref_slc == '0' and append:
+        ref_slc = find_reference(slc_dir, all_date) or all_date[0]
+    elif ref_slc == '0':
+        ref_slc = all_date[0]
+    else:
+        if re.findall(r'^\d{8}$', ref_slc):
+            if not ref_slc in all_date:
+                print('no slc for {}.'.format(ref_slc))
+                sys.exit(1)
+        else:
+            print('error date for ref_slc.')
+            sys.exit(1)
+
+    m_date = ref_slc
+    m_slc_dir = os.path.join(slc_dir, m_date)
+    m_slc = os.path.join(m_slc_dir, m_date + '.slc')
+    m_slc_par = m_slc + '.par'
+
+    # lookup table of reference is reused when appending
+    if append and reference_ok(slc_dir, m_date):
+        print('reuse lookup table and height of reference {}.'.format(m_date))
+    else:
+        prep_reference(slc_dir, m_date, dem, dem_par, rlks, alks)
 
     s_dates = all_date
     s_dates.remove(m_date)
@@ -213,264 +590,32 @@ def main():
     if not os.path.isfile(m_rslc_par):
         shutil.copy(m_slc_par, m_rslc_dir)
 
-    for s_date in s_dates:
-        s_slc_dir = os.path.join(slc_dir, s_date)
-        s_slc = os.path.join(s_slc_dir, s_date + '.slc')
-        s_slc_par = s_slc + '.par'
-        s_rslc_dir = os.path.join(rslc_dir, s_date)
-
-        if not os.path.isdir(s_rslc_dir):
-            os.mkdir(s_rslc_dir)
-        s_mli = os.path.join(s_rslc_dir, f"{s_date}.mli")
-        s_mli_par = s_mli + '.par'
-
-        call_str = f"multi_look {s_slc} {s_slc_par} {s_mli} {s_mli_par} {rlks} {alks}"
-        os.system(call_str)
-
-        lt = os.path.join(s_rslc_dir, f"{s_date}.lt")
-
-        call_str = f"rdc_trans {m_mli_par} {rdc_dem} {s_mli_par} {lt}"
-        os.system(call_str)
-
-        if len(iw_num) == 1:
-            s_iw_slc = os.path.join(s_slc_dir,
-                                    f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_slc_par = s_iw_slc + '.par'
-            s_iw_slc_tops_par = s_iw_slc + '.tops_par'
-
-            m_iw_slc = os.path.join(m_slc_dir,
-                                    f"{m_date}.iw{iw_num[0] * 2}.slc")
-            m_iw_slc_par = m_iw_slc + '.par'
-            m_iw_slc_tops_par = m_iw_slc + '.tops_par'
-
-            s_iw_rslc = os.path.join(s_rslc_dir,
-                                     f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_rslc_par = s_iw_rslc + '.par'
-            s_iw_rslc_tops_par = s_iw_rslc + '.tops_par'
-
-            os.chdir(s_rslc_dir)
-
-            call_str = f"echo {s_iw_slc} {s_iw_slc_par} {s_iw_slc_tops_par} > SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc} {m_iw_slc_par} {m_iw_slc_tops_par} > SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc} {s_iw_rslc_par} {s_iw_rslc_tops_par} > RSLC2_tab"
-            os.system(call_str)
-
-        if len(iw_num) == 2:
-            s_iw_slc1 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_slc_par1 = s_iw_slc1 + '.par'
-            s_iw_slc_tops_par1 = s_iw_slc1 + '.tops_par'
-            s_iw_slc2 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_slc_par2 = s_iw_slc2 + '.par'
-            s_iw_slc_tops_par2 = s_iw_slc2 + '.tops_par'
-
-            m_iw_slc1 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[0] * 2}.slc")
-            m_iw_slc_par1 = m_iw_slc1 + '.par'
-            m_iw_slc_tops_par1 = m_iw_slc1 + '.tops_par'
-            m_iw_slc2 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[1] * 2}.slc")
-            m_iw_slc_par2 = m_iw_slc2 + '.par'
-            m_iw_slc_tops_par2 = m_iw_slc2 + '.tops_par'
-
-            s_iw_rslc1 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_rslc_par1 = s_iw_rslc1 + '.par'
-            s_iw_rslc_tops_par1 = s_iw_rslc1 + '.tops_par'
-            s_iw_rslc2 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_rslc_par2 = s_iw_rslc2 + '.par'
-            s_iw_rslc_tops_par2 = s_iw_rslc2 + '.tops_par'
-
-            os.chdir(s_rslc_dir)
-
-            call_str = f"echo {s_iw_slc1} {s_iw_slc_par1} {s_iw_slc_tops_par1} > SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_slc2} {s_iw_slc_par2} {s_iw_slc_tops_par2} >> SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc1} {m_iw_slc_par1} {m_iw_slc_tops_par1} > SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc2} {m_iw_slc_par2} {m_iw_slc_tops_par2} >> SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc1} {s_iw_rslc_par1} {s_iw_rslc_tops_par1} > RSLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc2} {s_iw_rslc_par2} {s_iw_rslc_tops_par2} >> RSLC2_tab"
-            os.system(call_str)
-
-        if len(iw_num) == 3:
-            s_iw_slc1 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_slc_par1 = s_iw_slc1 + '.par'
-            s_iw_slc_tops_par1 = s_iw_slc1 + '.tops_par'
-            s_iw_slc2 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_slc_par2 = s_iw_slc2 + '.par'
-            s_iw_slc_tops_par2 = s_iw_slc2 + '.tops_par'
-            s_iw_slc3 = os.path.join(s_slc_dir,
-                                     f"{s_date}.iw{iw_num[2] * 2}.slc")
-            s_iw_slc_par3 = s_iw_slc3 + '.par'
-            s_iw_slc_tops_par3 = s_iw_slc3 + '.tops_par'
-
-            m_iw_slc1 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[0] * 2}.slc")
-            m_iw_slc_par1 = m_iw_slc1 + '.par'
-            m_iw_slc_tops_par1 = m_iw_slc1 + '.tops_par'
-            m_iw_slc2 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[1] * 2}.slc")
-            m_iw_slc_par2 = m_iw_slc2 + '.par'
-            m_iw_slc_tops_par2 = m_iw_slc2 + '.tops_par'
-            m_iw_slc3 = os.path.join(m_slc_dir,
-                                     f"{m_date}.iw{iw_num[2] * 2}.slc")
-            m_iw_slc_par3 = m_iw_slc3 + '.par'
-            m_iw_slc_tops_par3 = m_iw_slc3 + '.tops_par'
-
-            s_iw_rslc1 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[0] * 2}.slc")
-            s_iw_rslc_par1 = s_iw_rslc1 + '.par'
-            s_iw_rslc_tops_par1 = s_iw_rslc1 + '.tops_par'
-            s_iw_rslc2 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[1] * 2}.slc")
-            s_iw_rslc_par2 = s_iw_rslc2 + '.par'
-            s_iw_rslc_tops_par2 = s_iw_rslc2 + '.tops_par'
-            s_iw_rslc3 = os.path.join(s_rslc_dir,
-                                      f"{s_date}.iw{iw_num[2] * 2}.slc")
-            s_iw_rslc_par3 = s_iw_rslc3 + '.par'
-            s_iw_rslc_tops_par3 = s_iw_rslc3 + '.tops_par'
-
-            os.chdir(s_rslc_dir)
-
-            call_str = f"echo {s_iw_slc1} {s_iw_slc_par1} {s_iw_slc_tops_par1} > SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_slc2} {s_iw_slc_par2} {s_iw_slc_tops_par2} >> SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_slc3} {s_iw_slc_par3} {s_iw_slc_tops_par3} >> SLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc1} {m_iw_slc_par1} {m_iw_slc_tops_par1} > SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc2} {m_iw_slc_par2} {m_iw_slc_tops_par2} >> SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {m_iw_slc3} {m_iw_slc_par3} {m_iw_slc_tops_par3} >> SLC1_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc1} {s_iw_rslc_par1} {s_iw_rslc_tops_par1} > RSLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc2} {s_iw_rslc_par2} {s_iw_rslc_tops_par2} >> RSLC2_tab"
-            os.system(call_str)
-            call_str = f"echo {s_iw_rslc3} {s_iw_rslc_par3} {s_iw_rslc_tops_par3} >> RSLC2_tab"
-            os.system(call_str)
-
-        s_rslc = os.path.join(s_rslc_dir, f"{s_date}.rslc")
-        s_rslc_par = s_rslc + ".par"
-        call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} - RSLC2_tab {s_rslc} {s_rslc_par}"
-        os.system(call_str)
-        
-        s_rmli = os.path.join(s_rslc_dir, f"{s_date}.rslc.mli")
-        s_rmli_par = s_rmli + ".par"
-        call_str = f"multi_look {s_rslc} {s_rslc_par} {s_rmli} {s_rmli_par} {rlks} {alks}"
-        os.system(call_str)
-
-        s_rmli_bmp = s_rmli + ".bmp"
-        call_str = f"raspwr {s_rmli} {width_mli} - - - - - - - {s_rmli_bmp}"
-        os.system(call_str)
-
-        off_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off")
-        call_str = f"create_offset {m_slc_par} {s_slc_par} {off_file} 1 {rlks} {alks} 0"
-        os.system(call_str)
-
-        offs_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.offs")
-        snr_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.snr")
-        call_str = f"offset_pwr {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off_file} {offs_file} {snr_file} 256 64 - 1 100 100 15.0 4 0 0"
-        os.system(call_str)
-
-        call_str = f"offset_fit {offs_file} {snr_file} {off_file}  - - 0.5 1 0"
-        os.system(call_str)
-
-        call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_file} RSLC2_tab {s_rslc} {s_rslc_par}"
-        os.system(call_str)
-
-        off1_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off1")
-        call_str = f"create_offset {m_slc_par} {s_slc_par} {off1_file} 1 {rlks} {alks} 0"
-        os.system(call_str)
-
-        offs1_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.offs1")
-        snr1_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.snr1")
-        coreg_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.coreg")
-        call_str = f"offset_pwr {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off1_file} {offs1_file} {snr1_file} 256 64 {coreg_file} 1 200 200 16.0 4 0 0"
-        os.system(call_str)
-
-        call_str = f"offset_fit {offs1_file} {snr1_file} {off1_file}  - - 0.5 1 0"
-        os.system(call_str)
-
-        off_total_file = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off.total")
-        call_str = f"offset_add {off_file} {off1_file} {off_total_file}"
-        os.system(call_str)
-
-        call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_total_file} RSLC2_tab {s_rslc} {s_rslc_par}"
-        os.system(call_str)
-
-        sim_unw0 = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.sim_unw0")
-        call_str = f"phase_sim_orb {m_slc_par} {s_slc_par} {off_total_file} {rdc_dem} {sim_unw0} {m_slc_par} - - 1 1"
-        os.system(call_str)
-
-        diff0 = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.diff0")
-        call_str = f"SLC_diff_intf {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off_total_file} {sim_unw0} {diff0} {rlks} {alks} 0 0 0.25 1 1"
-        os.system(call_str)
-
-        diff0_bmp = diff0 + '.bmp'
-        call_str = f"rasmph {diff0} {width_mli} 1 0 1 1 1. .35 1 {diff0_bmp}"
-        os.system(call_str)
-
-        off_corrected = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off.corrected")
-        call_str = f"S1_coreg_overlap SLC1_tab RSLC2_tab {m_date}-{s_date} {off_total_file} {off_corrected} 0.8 0.01 0.8 1"
-        os.system(call_str)
-
-        call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_corrected} RSLC2_tab {s_rslc} {s_rslc_par}"
-        os.system(call_str)
-
-        off_corrected2 = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.off.corrected2")
-        call_str = f"S1_coreg_overlap SLC1_tab RSLC2_tab {m_date}-{s_date} {off_corrected} {off_corrected2} 0.8 0.01 0.8 1"
-        os.system(call_str)
-
-        call_str = f"SLC_interp_lt_S1_TOPS SLC2_tab {s_slc_par} SLC1_tab {m_slc_par} {lt} {m_mli_par} {s_mli_par} {off_corrected2} RSLC2_tab {s_rslc} {s_rslc_par}"
-        os.system(call_str)
-
-        sim_unw = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.sim_unw")
-        call_str = f"phase_sim_orb {m_slc_par} {s_slc_par} {off_corrected2} {rdc_dem} {sim_unw} {m_slc_par} - - 1 1"
-        os.system(call_str)
-
-        diff = os.path.join(s_rslc_dir, f"{m_date}-{s_date}.diff")
-        call_str = f"SLC_diff_intf {m_slc} {s_rslc} {m_slc_par} {s_rslc_par} {off_corrected2} {sim_unw} {diff} {rlks} {alks} 0 0 0.25 1 1"
-        os.system(call_str)
-
-        diff_bmp = diff + '.bmp'
-        call_str = f"rasmph {diff} {width_mli} 1 0 1 1 1. .35 1 {diff_bmp}"
-        os.system(call_str)
-
-        diff_pwr_bmp = diff + '.pwr.bmp'
-        call_str = f"rasmph_pwr {diff} {m_mli} {width_mli} 1 1 0 1 1 1. .35 1 {diff_pwr_bmp}"
-        os.system(call_str)
-
-        # delete files
-        save_files = []
-        save_files.append(s_date + '.rslc')
-        save_files.append(s_date + '.rslc.par')
-        save_files.append(m_date + '-' + s_date + '.diff.bmp')
-        save_files.append(m_date + '-' + s_date + '.diff.pwr.bmp')
-
-        for f in os.listdir(s_rslc_dir):
-            if f not in save_files:
-                path = os.path.join(s_rslc_dir, f)
-                os.remove(path)
-
-        os.rename(s_date + '.rslc', s_date + '.slc')
-        os.rename(s_date + '.rslc.par', s_date + '.slc.par')
-
-    # generate bmp for rslc
-    rslc_files = glob.glob(rslc_dir + '/*/*.slc')
-    for f in rslc_files:
-        gen_bmp(f, f + '.par', rlks, alks)
+    # co-register all dates, each in its own directory
+    done = []
+    if append:
+        done = [i for i in s_dates if rslc_ok(rslc_dir, i)]
+        s_dates = [i for i in s_dates if i not in done]
+        print('{} dates already co-registered, {} new dates.'.format(
+            len(done), len(s_dates)))
+    costs = {s_date: date_cost(slc_dir, s_date, rlks, alks) for s_date in s_dates}
+    if max_days > 0:
+        # distant dates through intermediate dates
+        results = coreg_tree(s_dates, done, slc_dir, rslc_dir, m_date,
+                             iw_num, rlks, alks, max_days, max_depth, num_jobs,
+                             costs, max_mem, min_free)
+    else:
+        jobs = [(s_date, slc_dir, rslc_dir, m_date, iw_num, rlks, alks)
+                for s_date in s_dates]
+        print('\nco-registering {} dates to {}:'.format(len(jobs), m_date))
+        results = run_jobs(coreg_date, jobs, num_jobs, costs, max_mem,
+                           rslc_dir, min_free)
+    print_summary(results)
+
+    # generate bmp for reference
+    gen_bmp(m_rslc, m_rslc_par, rlks, alks, tag=m_date)
+
+    # check offsets of S1_coreg_overlap in coreg logs
+    get_coreg_quality(rslc_dir, thresholds={'reference': m_date})
 
     print('\nall done, enjoy it.\n')
 
@@ -10,6 +10,8 @@ import sys
 import argparse
 import re
 
+from gamma_par import read_gamma_par
+
 EXAMPLE = '''Example:
   # one swath
   python3 extract_s1_bursts.py /ly/slc /ly/slc_extract '1' '1 3'
@@ -51,16 +53,6 @@ def cmdLineParse():
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def slc_copy_s1_tops(slc_path, out_slc_path, date, iw, start_burst, end_burst,
                      rlks, alks):
     # write SLC_tab
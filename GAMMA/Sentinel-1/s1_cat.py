@@ -11,11 +11,18 @@ import re
 import sys
 import shutil
 
+import numpy as np
+
+from cmd_runner import run_cmd
+from gamma_par import load_par, read_gamma_par
+from job_pool import run_jobs, print_summary
+
 EXAMPLE = """
 [Note:This script only concatenates adjacent SLC processed by zip2slc.py]
 ./s1_cat.py slc slc_cat 1
 ./s1_cat.py slc slc_cat 1 2 --rlks 8 --alks 2
 ./s1_cat.py slc slc_cat 1 2 3 --rlks 8 --alks 2
+./s1_cat.py slc slc_cat 1 2 3 --rlks 8 --alks 2 --jobs 6
 """
 
 
@@ -42,6 +49,11 @@ def cmdline_parse():
         help='azimuth looks for generating amplitude image (default: 5)',
         type=int,
         default=5)
+    parser.add_argument(
+        '--jobs',
+        help='number of swaths (of all dates) concatenated at the same time (default: 1)',
+        type=int,
+        default=1)
     parser.add_argument(
         '--del_flag',
         help=
@@ -52,110 +64,67 @@ def cmdline_parse():
 
 
 def get_state_vector(file_path):
-    """get all state_vectors from .par file"""
-    state_vector = []
-    temp = []
-    with open(file_path) as f:
-        for line in f:
-            if line.startswith('state_vector_position_') or \
-                    line.startswith('state_vector_velocity_'):
-                temp.append(line)
-    for s in temp:
-        line = re.split(r'\s+', s)
-        state_vector.append(line[1:4])
-    return state_vector
+    """times, positions and velocities (n x 3) of state vectors in .par file"""
+    par = load_par(file_path)
+    num = int(par['number_of_state_vectors'])
+    t0 = float(par['time_of_first_state_vector'])
+    interval = float(par['state_vector_interval'])
+    pos = np.array([par[f'state_vector_position_{i + 1}'] for i in range(num)],
+                   dtype=np.float64).reshape(-1, 3)
+    vel = np.array([par[f'state_vector_velocity_{i + 1}'] for i in range(num)],
+                   dtype=np.float64).reshape(-1, 3)
+    return t0 + np.arange(num) * interval, pos, vel
 
 
 def get_nonrepeated_state_vector(state_vector_1, state_vector_2):
-    """compare two state_vectors, get nonrepeated state_vectors"""
-    nonrepeated_state_vector = []
-    index = 1
-    for sv in state_vector_2:
-        if sv not in state_vector_1:
-            nonrepeated_state_vector.append(sv)
-    for i in range(len(state_vector_2)):
-        if state_vector_2[i] == nonrepeated_state_vector[0]:
-            index = i
-    return nonrepeated_state_vector, index
-
-
-def get_time_of_first_state_vector(file_path):
-    """get time_of_first_state_vector from .par file"""
-    time_of_first_state_vector = ''
-    with open(file_path) as f:
-        for line in f:
-            if line.startswith('time_of_first_state_vector'):
-                time_of_first_state_vector = re.split(r'\s+', line)[1]
-    return time_of_first_state_vector
+    """state vectors of state_vector_2 at times not in state_vector_1"""
+    t1 = np.round(state_vector_1[0], 3)
+    t2, pos2, vel2 = state_vector_2
+    keep = ~np.isin(np.round(t2, 3), t1)
+    # state vectors in par file must be evenly spaced, keep the ones after t1
+    if np.unique(np.round(np.diff(t2[keep]), 3)).size > 1:
+        keep = np.round(t2, 3) > t1.max()
+    return t2[keep], pos2[keep], vel2[keep]
 
 
 def get_content(file_path):
     """get content before the line of 'number_of_state_vectors'"""
-    content = ''
-    with open(file_path) as f:
-        for line in f:
-            if not line.startswith('number_of_state_vectors'):
-                content += line
-            else:
-                break
-    return content
+    content = []
+    for line in load_par(file_path).lines:
+        if line.startswith('number_of_state_vectors'):
+            break
+        content.append(line + '\n')
+    return ''.join(content)
 
 
 def gen_new_par(par1, par2, new_par):
-    """compare two .par file, write non-repeated .par file"""
-    state_vector_1 = get_state_vector(par1)
-    state_vector_2 = get_state_vector(par2)
-    nonrepeated_state_vector, index = get_nonrepeated_state_vector(
-        state_vector_1, state_vector_2)
-    number_of_state_vectors = int(len(nonrepeated_state_vector) / 2)
-    # calculate the new time_of_first_state_vector
-    time_of_first_state_vector = get_time_of_first_state_vector(par2)
-    time_of_first_state_vector = float(
-        time_of_first_state_vector) + index / 2 * 10
-    time_of_first_state_vector = str(time_of_first_state_vector) + '00000'
-    # get content before 'number_of_state_vectors'
+    """compare two .par file, write par2 with state vectors not in par1"""
+    t, pos, vel = get_nonrepeated_state_vector(get_state_vector(par1),
+                                               get_state_vector(par2))
+    if t.size == 0:
+        print('all state vectors of {} are in {}.'.format(par2, par1))
+        return
+    interval = float(load_par(par2)['state_vector_interval'])
     content = get_content(par2)
-    # write .par file
-    with open(new_par, 'w+') as f:
-        f.write(content)
-        f.write('number_of_state_vectors:' +
-                str(int(len(nonrepeated_state_vector) / 2)).rjust(21, ' ') +
-                '\n')
-        f.write('time_of_first_state_vector:' +
-                time_of_first_state_vector.rjust(18, ' ') + '   s' + '\n')
-        f.write('state_vector_interval:              10.000000   s' + '\n')
-        nr = nonrepeated_state_vector
-        for i in range(number_of_state_vectors):
-            f.write('state_vector_position_' + str(i + 1) + ':' +
-                    nr[i * 2][0].rjust(15, ' ') + nr[i * 2][1].rjust(16, ' ') +
-                    nr[i * 2][2].rjust(16, ' ') + '   m   m   m' + '\n')
-            f.write('state_vector_velocity_' + str(i + 1) + ':' +
-                    nr[i * 2 + 1][0].rjust(15, ' ') +
-                    nr[i * 2 + 1][1].rjust(16, ' ') +
-                    nr[i * 2 + 1][2].rjust(16, ' ') + '   m/s m/s m/s' + '\n')
-
-
-def read_gamma_par(par_file, keyword):
-    """give a keyword, then get the value"""
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
+    lines = [
+        'number_of_state_vectors:{:>21}\n'.format(t.size),
+        'time_of_first_state_vector:{:>18.6f}   s\n'.format(t[0]),
+        'state_vector_interval:{:>23.6f}   s\n'.format(interval)
+    ]
+    for i in range(t.size):
+        lines.append('state_vector_position_{}:{:>15.4f}{:>16.4f}{:>16.4f}   m   m   m\n'.format(
+            i + 1, *pos[i]))
+        lines.append('state_vector_velocity_{}:{:>15.5f}{:>16.5f}{:>16.5f}   m/s m/s m/s\n'.format(
+            i + 1, *vel[i]))
+    with open(new_par, 'w') as f:
+        f.write(content + ''.join(lines))
 
 
 def get_time_and_direction(par_file):
     """get time and orbit direction form .par file"""
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if 'start_time' in l:
-                start_time = l.strip().split()[1]
-            if 'heading' in l:
-                heading = l.strip().split()[1]
-    heading = float(heading)
-    start_time = float(start_time)
+    par = load_par(par_file)
+    heading = float(par['heading'])
+    start_time = float(par['start_time'])
     if heading > -180 and heading < -90:
         direction = 'DES'
     else:
@@ -174,101 +143,103 @@ def get_date_for_cat(slc_dir, date_num):
     return sorted(list(dates))
 
 
-def cat_two_slc(slc1_dir, slc2_dir, cat_dir, iw_num, rlks, alks):
-    """concatenate two SLCs"""
-    # get slc date
-    date = os.path.basename(slc1_dir)[0:8]
-    for iw in iw_num:
-        iw = str(iw)
-        # get path of slc slc.par slc.tops_par
-        slc1 = os.path.join(slc1_dir, date + '.iw' + iw + '.slc')
-        slc_par1 = os.path.join(slc1_dir, date + '.iw' + iw + '.slc.par')
-        tops_par1 = os.path.join(slc1_dir, date + '.iw' + iw + '.slc.tops_par')
-
-        slc2 = os.path.join(slc2_dir, date + '.iw' + iw + '.slc')
-        slc_par2 = os.path.join(slc2_dir, date + '.iw' + iw + '.slc.par')
-        tops_par2 = os.path.join(slc2_dir, date + '.iw' + iw + '.slc.tops_par')
-
-        slc = os.path.join(cat_dir, date + '.iw' + iw + '.slc')
-        slc_par = os.path.join(cat_dir, date + '.iw' + iw + '.slc.par')
-        tops_par = os.path.join(cat_dir, date + '.iw' + iw + '.slc.tops_par')
-        # backup par file
-        call_str = f"cp {slc_par1} {slc_par1 + '-copy'}"
-        os.system(call_str)
-        call_str = f"cp {slc_par2} {slc_par2 + '-copy'}"
-        os.system(call_str)
-        # get image start_time and direction
-        start_time1, direction1 = get_time_and_direction(slc_par1)
-        start_time2, direction2 = get_time_and_direction(slc_par2)
-        # maybe directions are different
-        if direction1 != direction2:
-            continue
-        # exchange values for the following cases
-        des = (direction1 == 'DES') and (start_time1 > start_time2)
-        asc = (direction1 == 'ASC') and (start_time1 > start_time2)
-        if asc or des:
-            slc1, slc2 = slc2, slc1
-            slc_par1, slc_par2 = slc_par2, slc_par1
-            tops_par1, tops_par2 = tops_par2, tops_par1
-        # delete repeated vectors
-        gen_new_par(slc_par1, slc_par2, slc_par2)
-        # write catlist
-        os.chdir(cat_dir)
-        call_str = f"echo {slc1} {slc_par1} {tops_par1} > catlist1"
-        os.system(call_str)
-        call_str = f"echo {slc2} {slc_par2} {tops_par2} > catlist2"
-        os.system(call_str)
-        call_str = f"echo {slc} {slc_par} {tops_par} > catlist"
-        os.system(call_str)
-        # concatenate adjacent Sentinel-1 TOPS SLC images
-        call_str = "SLC_cat_S1_TOPS.TOPS catlist1 catlist2 catlist"
-        os.system(call_str)
-        # generate amplitude image
-        width = read_gamma_par(slc_par, 'range_samples:')
-        if width:
-            bmp = slc + '.bmp'
-            call_str = f"rasSLC {slc} {width} 1 0 {rlks} {alks} 1. .35 1 0 0 {bmp}"
-            os.system(call_str)
-        # delete catlist, catlist1, catlist2
-        for file in ['catlist', 'catlist1', 'catlist2']:
-            if os.path.isfile(file):
-                os.remove(file)
+def get_swath_files(slc_dir, date, iw):
+    """slc, slc.par and slc.tops_par of one swath"""
+    slc = os.path.join(slc_dir, date + '.iw' + str(iw) + '.slc')
+    return slc, slc + '.par', slc + '.tops_par'
 
 
-def cat_three_slc(slc1_dir, slc2_dir, slc3_dir, cat_dir, iw_num, rlks, alks):
-    """concatenate three SLCs"""
+def write_catlist(catlist, files):
+    with open(catlist, 'w') as f:
+        f.write(' '.join(files) + '\n')
+
+
+def cat_two_swath(slc1_dir, slc2_dir, cat_dir, iw, rlks, alks):
+    """concatenate one swath of two SLCs, return exit code"""
     # get slc date
     date = os.path.basename(slc1_dir)[0:8]
-    # get start time
-    slc_par1 = os.path.join(slc1_dir,
-                            date + '.iw' + str(iw_num[0]) + '.slc.par')
-    slc_par2 = os.path.join(slc2_dir,
-                            date + '.iw' + str(iw_num[0]) + '.slc.par')
-    slc_par3 = os.path.join(slc3_dir,
-                            date + '.iw' + str(iw_num[0]) + '.slc.par')
-    start_time1, _ = get_time_and_direction(slc_par1)
-    start_time2, _ = get_time_and_direction(slc_par2)
-    start_time3, _ = get_time_and_direction(slc_par3)
-    temp_list = sorted([start_time1, start_time2, start_time3])
-    # create cat2_dir
+    files1 = get_swath_files(slc1_dir, date, iw)
+    files2 = get_swath_files(slc2_dir, date, iw)
+    files = get_swath_files(cat_dir, date, iw)
+    # backup par file
+    shutil.copy(files1[1], files1[1] + '-copy')
+    shutil.copy(files2[1], files2[1] + '-copy')
+    # get image start_time and direction
+    start_time1, direction1 = get_time_and_direction(files1[1])
+    start_time2, direction2 = get_time_and_direction(files2[1])
+    # maybe directions are different
+    if direction1 != direction2:
+        print('{} iw{}: directions of SLCs are different.'.format(date, iw))
+        return 1
+    # earlier image first
+    if start_time1 > start_time2:
+        files1, files2 = files2, files1
+    # delete repeated vectors
+    gen_new_par(files1[1], files2[1], files2[1])
+    # write catlist of this swath
+    catlists = []
+    for i, f in enumerate([files1, files2, files]):
+        catlist = os.path.join(cat_dir, f"{date}.iw{iw}.catlist{i + 1}")
+        write_catlist(catlist, f)
+        catlists.append(catlist)
+    # concatenate adjacent Sentinel-1 TOPS SLC images
+    call_str = "SLC_cat_S1_TOPS.TOPS " + ' '.join(catlists)
+    code = run_cmd(call_str, cwd=cat_dir, tag=date)
+    # delete catlists
+    for catlist in catlists:
+        if os.path.isfile(catlist):
+            os.remove(catlist)
+    if code != 0 or not os.path.isfile(files[1]):
+        return code or 1
+    # generate amplitude image
+    slc, slc_par = files[0], files[1]
+    width = read_gamma_par(slc_par, 'range_samples:')
+    if width:
+        bmp = slc + '.bmp'
+        call_str = f"rasSLC {slc} {width} 1 0 {rlks} {alks} 1. .35 1 0 0 {bmp}"
+        run_cmd(call_str, cwd=cat_dir, tag=date)
+    return 0
+
+
+def cat_three_swath(slc1_dir, slc2_dir, slc3_dir, cat_dir, iw, rlks, alks):
+    """concatenate one swath of three SLCs, return exit code"""
+    # get slc date
+    date = os.path.basename(slc1_dir)[0:8]
+    # order images by start time
+    slc_dirs = sorted(
+        [slc1_dir, slc2_dir, slc3_dir],
+        key=lambda d: get_time_and_direction(get_swath_files(d, date, iw)[1])[0])
+    # create cat2_dir of this swath
     slc_dir = os.path.dirname(slc1_dir)
-    cat2_dir = os.path.join(slc_dir, date + '-cat2')
+    cat2_dir = os.path.join(slc_dir, date + '-cat2.iw' + str(iw))
     if not os.path.isdir(cat2_dir):
         os.mkdir(cat2_dir)
-    # first case: slc1 is middle slc
-    if temp_list[1] == start_time1:
-        cat_two_slc(slc1_dir, slc2_dir, cat2_dir, iw_num, rlks, alks)
-        cat_two_slc(slc3_dir, cat2_dir, cat_dir, iw_num, rlks, alks)
-    # second case: slc2 is middle slc
-    if temp_list[1] == start_time2:
-        cat_two_slc(slc1_dir, slc2_dir, cat2_dir, iw_num, rlks, alks)
-        cat_two_slc(slc3_dir, cat2_dir, cat_dir, iw_num, rlks, alks)
-    # third case: slc3 is middle slc
-    if temp_list[1] == start_time3:
-        cat_two_slc(slc1_dir, slc3_dir, cat2_dir, iw_num, rlks, alks)
-        cat_two_slc(slc2_dir, cat2_dir, cat_dir, iw_num, rlks, alks)
+    # first and middle, then last
+    code = cat_two_swath(slc_dirs[0], slc_dirs[1], cat2_dir, iw, rlks, alks)
+    if code == 0:
+        code = cat_two_swath(slc_dirs[2], cat2_dir, cat_dir, iw, rlks, alks)
     # delete cat2_dir
     shutil.rmtree(cat2_dir)
+    return code
+
+
+def cat_swath(name, slc_dirs, cat_dir, iw, rlks, alks):
+    """concatenate one swath of two or three SLCs of one date, return exit code"""
+    if len(slc_dirs) == 2:
+        return cat_two_swath(*slc_dirs, cat_dir, iw, rlks, alks)
+    return cat_three_swath(*slc_dirs, cat_dir, iw, rlks, alks)
+
+
+def cat_two_slc(slc1_dir, slc2_dir, cat_dir, iw_num, rlks, alks):
+    """concatenate two SLCs"""
+    return [cat_two_swath(slc1_dir, slc2_dir, cat_dir, iw, rlks, alks)
+            for iw in iw_num]
+
+
+def cat_three_slc(slc1_dir, slc2_dir, slc3_dir, cat_dir, iw_num, rlks, alks):
+    """concatenate three SLCs"""
+    return [cat_three_swath(slc1_dir, slc2_dir, slc3_dir, cat_dir, iw, rlks,
+                            alks) for iw in iw_num]
 
 
 def main():
@@ -282,6 +253,7 @@ def main():
     del_flag = inps.del_flag.lower()
     rlks = inps.rlks
     alks = inps.alks
+    num_jobs = inps.jobs
     # check iw_num
     for i in iw_num:
         if not i in [1, 2, 3]:
@@ -294,31 +266,31 @@ def main():
     if del_flag not in ['t', 'f']:
         print('Error del_flag, t for deleting, f for not (default: f)')
         sys.exit()
-    # cat two slc
-    date2 = get_date_for_cat(slc_dir, 2)
-    for date in date2:
-        slc_dir12 = glob.glob(os.path.join(slc_dir, date + '-[0-9]'))
-        cat_dir = os.path.join(save_dir, date)
-        if not os.path.isdir(cat_dir):
-            os.mkdir(cat_dir)
-        cat_two_slc(slc_dir12[0], slc_dir12[1], cat_dir, iw_num, rlks, alks)
-        # delete original slc
-        if del_flag == 't':
-            for i in slc_dir12:
-                shutil.rmtree(i)
-    # cat three slc
-    date3 = get_date_for_cat(slc_dir, 3)
-    for date in date3:
-        slc_dir123 = glob.glob(os.path.join(slc_dir, date + '-[0-9]'))
-        cat_dir = os.path.join(save_dir, date)
-        if not os.path.isdir(cat_dir):
-            os.mkdir(cat_dir)
-        cat_three_slc(slc_dir123[0], slc_dir123[1], slc_dir123[2], cat_dir,
-                      iw_num, rlks, alks)
-        # delete original slc
-        if del_flag == 't':
-            for i in slc_dir123:
-                shutil.rmtree(i)
+    # one job for each swath of dates with two or three images
+    jobs = []
+    date_jobs = {}
+    for date_num in [2, 3]:
+        for date in get_date_for_cat(slc_dir, date_num):
+            slc_dirs = sorted(glob.glob(os.path.join(slc_dir, date + '-[0-9]')))
+            cat_dir = os.path.join(save_dir, date)
+            if not os.path.isdir(cat_dir):
+                os.mkdir(cat_dir)
+            date_jobs[date] = (slc_dirs, [])
+            for iw in iw_num:
+                name = date + '.iw' + str(iw)
+                jobs.append((name, slc_dirs, cat_dir, iw, rlks, alks))
+                date_jobs[date][1].append(name)
+
+    print('concatenating {} swaths of {} dates:'.format(len(jobs), len(date_jobs)))
+    results = run_jobs(cat_swath, jobs, num_jobs)
+    failed = print_summary(results)
+
+    # delete original slc only if all of its swaths are done
+    if del_flag == 't':
+        for date, (slc_dirs, names) in date_jobs.items():
+            if not any(name in failed for name in names):
+                for i in slc_dirs:
+                    shutil.rmtree(i)
 
     print('\nall done, enjoy it.\n')
 
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+#####################################################################
+# Index Sentinel-1 zips into a SQLite catalog                       #
+# manifest and annotations of each zip are read once, then mission, #
+# track, dates, bursts, footprints and orbits are queried from db   #
+# Copyright (c) 2021, Lei Yuan                                      #
+#####################################################################
+
+import argparse
+import math
+import os
+import posixpath
+import sqlite3
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from orbit_catalog import load_catalog, parse_s1_name
+
+# timing of ESA burst ID (Sentinel-1 burst ID map)
+T_BEAM = 2.758273
+T_PRE = 2.299849
+T_ORB = 12 * 24 * 3600 / 175
+# seconds between start of bursts of IW1 -> IW2, IW2 -> IW3 and IW3 -> IW1
+T_SWATH = [0.832, 1.078, 0.848]
+# catalogs indexed with older burst IDs are read again
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    name TEXT PRIMARY KEY,
+    path TEXT,
+    size INTEGER,
+    mtime INTEGER,
+    mission TEXT,
+    date TEXT,
+    start TEXT,
+    stop TEXT,
+    abs_orbit INTEGER,
+    track INTEGER,
+    direction TEXT,
+    pols TEXT,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL,
+    footprint TEXT,
+    orbit TEXT
+);
+CREATE TABLE IF NOT EXISTS bursts (
+    scene TEXT,
+    swath TEXT,
+    num INTEGER,
+    burst_id TEXT,
+    azimuth_time TEXT,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL,
+    PRIMARY KEY (scene, swath, num)
+);
+CREATE INDEX IF NOT EXISTS scenes_track ON scenes (track, date);
+CREATE INDEX IF NOT EXISTS bursts_id ON bursts (burst_id);
+"""
+
+EXAMPLE = """Example:
+  # index (only new or changed zips are read again, deleted zips are removed)
+  ./s1_catalog.py /ly/s1.db --index /ly/zip_dir --orbit_dir /ly/orbits --jobs 8
+  # dates of track 142 covering AOI (lon_min lat_min lon_max lat_max)
+  ./s1_catalog.py /ly/s1.db --track 142 --aoi 100.1 30.2 100.5 30.6
+  # bursts of each date covering AOI
+  ./s1_catalog.py /ly/s1.db --track 142 --aoi 100.1 30.2 100.5 30.6 --bursts
+  # zips without precise orbit
+  ./s1_catalog.py /ly/s1.db --missing_orbit
+"""
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Index Sentinel-1 zips into SQLite and query them.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+    parser.add_argument('db', help='path of SQLite catalog')
+    parser.add_argument('--index', help='directory of Sentinel-1 zips to index', nargs='+')
+    parser.add_argument('--orbit_dir', help='directory of orbit files for matching orbits')
+    parser.add_argument('--jobs',
+                        help='number of zips read at the same time (default: 4)',
+                        default=4,
+                        type=int)
+    parser.add_argument('--track', help='relative orbit number', type=int)
+    parser.add_argument('--aoi',
+                        help='lon_min lat_min lon_max lat_max',
+                        type=float,
+                        nargs=4)
+    parser.add_argument('--bursts',
+                        help='print bursts covering AOI',
+                        action='store_true')
+    parser.add_argument('--missing_orbit',
+                        help='print zips without orbit',
+                        action='store_true')
+    inps = parser.parse_args()
+    return inps
+
+
+def local_name(tag):
+    """tag without namespace"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def find_text(root, name, attrs=None):
+    """text of first element named name (any namespace) with attributes attrs"""
+    for elem in root.iter():
+        if local_name(elem.tag) != name:
+            continue
+        if attrs and any(elem.get(k) != v for k, v in attrs.items()):
+            continue
+        return elem.text.strip() if elem.text else ''
+    return None
+
+
+def child_text(elem, name):
+    for child in elem:
+        if local_name(child.tag) == name:
+            return child.text.strip() if child.text else ''
+    return None
+
+
+def bbox(lons, lats):
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def read_manifest(zf, safe_name):
+    """scene information of manifest.safe"""
+    root = ElementTree.fromstring(zf.read(safe_name + '/manifest.safe'))
+    coords = find_text(root, 'coordinates') or ''
+    lats, lons = [], []
+    for point in coords.split():
+        lat, lon = point.split(',')
+        lats.append(float(lat))
+        lons.append(float(lon))
+    scene = {
+        'start': find_text(root, 'startTime'),
+        'stop': find_text(root, 'stopTime'),
+        'abs_orbit': int(find_text(root, 'orbitNumber', {'type': 'start'})),
+        'track': int(find_text(root, 'relativeOrbitNumber', {'type': 'start'})),
+        'direction': (find_text(root, 'pass') or '').upper(),
+        'footprint': coords
+    }
+    if lons:
+        scene.update(zip(['min_lon', 'min_lat', 'max_lon', 'max_lat'],
+                         bbox(lons, lats)))
+    return scene
+
+
+def get_burst_id(track, swath, anx_time):
+    """track and ESA burst ID of burst starting anx_time seconds after ascending node
+
+    all swaths of one burst cycle share the ID, which is computed from the
+    middle of IW2 of the cycle (as in ESA burst ID map and s1reader). Bursts
+    across the ascending node belong to the next (or previous) track.
+    """
+    iw = int(swath[-1])
+    # start of IW1 and middle of IW2 of the cycle
+    start_iw1 = anx_time - sum(T_SWATH[:iw - 1])
+    dt = start_iw1 + T_SWATH[0] + T_SWATH[1] / 2
+    # cycle starting after the next ascending node belongs to next track
+    if start_iw1 >= T_ORB:
+        dt -= T_ORB
+        track = track % 175 + 1
+    dt += (track - 1) * T_ORB
+    # first bursts of track 1 belong to the end of track 175
+    if dt < T_PRE:
+        dt += 175 * T_ORB
+        track = 175
+    return track, int(math.floor((dt - T_PRE) / T_BEAM)) + 1
+
+
+def read_annotation(xml, track):
+    """swath and bursts (time, ID, bounding box) of annotation"""
+    root = ElementTree.fromstring(xml)
+    swath = find_text(root, 'swath').lower()
+    lines = int(find_text(root, 'linesPerBurst'))
+
+    points = []
+    for elem in root.iter():
+        if local_name(elem.tag) == 'geolocationGridPoint':
+            points.append((int(child_text(elem, 'line')),
+                           float(child_text(elem, 'longitude')),
+                           float(child_text(elem, 'latitude'))))
+
+    bursts = []
+    num = 0
+    for elem in root.iter():
+        if local_name(elem.tag) != 'burst':
+            continue
+        num += 1
+        azimuth_time = child_text(elem, 'azimuthTime')
+        anx_time = float(child_text(elem, 'azimuthAnxTime'))
+        burst_track, burst_id = get_burst_id(track, swath, anx_time)
+        # grid points on first and last line of burst
+        first, last = (num - 1) * lines, num * lines
+        in_burst = [p for p in points if first <= p[0] <= last]
+        if in_burst:
+            box = bbox([p[1] for p in in_burst], [p[2] for p in in_burst])
+        else:
+            box = (None, None, None, None)
+        bursts.append((swath, num, '{:03d}_{:06d}_{}'.format(
+            burst_track, burst_id, swath), azimuth_time) + box)
+    return bursts
+
+
+def read_zip(zip_file):
+    """scene and bursts of zip, (zip_file, None, error message) if it cannot be read"""
+    try:
+        with zipfile.ZipFile(zip_file) as zf:
+            names = zf.namelist()
+            safe_name = names[0].split('/')[0]
+            scene = read_manifest(zf, safe_name)
+            annotations = sorted(
+                i for i in names
+                if posixpath.basename(posixpath.dirname(i)) == 'annotation' and
+                i.endswith('.xml'))
+            pols = sorted(set(posixpath.basename(i).split('-')[3] for i in annotations))
+            bursts = []
+            # bursts are the same for all polarizations
+            for xml in annotations:
+                if posixpath.basename(xml).split('-')[3] == pols[0]:
+                    bursts += read_annotation(zf.read(xml), scene['track'])
+    except (zipfile.BadZipFile, OSError, KeyError, ValueError, TypeError,
+            IndexError, AttributeError, ElementTree.ParseError) as e:
+        return zip_file, None, str(e)
+    scene['pols'] = ' '.join(pols)
+    return zip_file, scene, bursts
+
+
+def connect(db):
+    conn = sqlite3.connect(db)
+    conn.executescript(SCHEMA)
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version < SCHEMA_VERSION:
+        with conn:
+            conn.execute('DELETE FROM bursts')
+            conn.execute('DELETE FROM scenes')
+        conn.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+    return conn
+
+
+def prune_zips(conn, zip_dirs):
+    """delete zips under zip_dirs which were removed or moved, return number deleted"""
+    rows = conn.execute('SELECT name, path FROM scenes').fetchall()
+    gone = [
+        name for name, path in rows
+        if os.path.dirname(path) in zip_dirs and not os.path.isfile(path)
+    ]
+    with conn:
+        for name in gone:
+            conn.execute('DELETE FROM bursts WHERE scene=?', (name,))
+            conn.execute('DELETE FROM scenes WHERE name=?', (name,))
+    return len(gone)
+
+
+def index_zips(conn, zip_files, orbit_dir=None, num_jobs=1):
+    """read new or changed zips into catalog, return number of zips read"""
+    known = {
+        row[0]: (row[1], row[2])
+        for row in conn.execute('SELECT path, size, mtime FROM scenes')
+    }
+    todo = []
+    for zip_file in zip_files:
+        st = os.stat(zip_file)
+        if known.get(zip_file) != (st.st_size, st.st_mtime_ns):
+            todo.append(zip_file)
+
+    if num_jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            results = list(executor.map(read_zip, todo))
+    else:
+        results = [read_zip(i) for i in todo]
+
+    num = 0
+    with conn:
+        for zip_file, scene, bursts in results:
+            if scene is None:
+                print('cannot read {}: {}'.format(zip_file, bursts))
+                continue
+            name = os.path.basename(zip_file)[:-4]
+            mission, start, _ = parse_s1_name(name)
+            st = os.stat(zip_file)
+            scene.update({
+                'name': name,
+                'path': zip_file,
+                'size': st.st_size,
+                'mtime': st.st_mtime_ns,
+                'mission': mission,
+                'date': start.strftime('%Y%m%d'),
+                'orbit': None
+            })
+            conn.execute('DELETE FROM bursts WHERE scene=?', (name,))
+            keys = sorted(scene)
+            conn.execute(
+                'INSERT OR REPLACE INTO scenes ({}) VALUES ({})'.format(
+                    ', '.join(keys), ', '.join('?' * len(keys))),
+                [scene[k] for k in keys])
+            conn.executemany(
+                'INSERT INTO bursts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(name,) + b for b in bursts])
+            num += 1
+
+    if orbit_dir:
+        match_orbits(conn, orbit_dir)
+    return num
+
+
+def match_orbits(conn, orbit_dir):
+    """record orbit file of every scene (None if not found)"""
+    catalog = load_catalog(orbit_dir)
+    rows = conn.execute('SELECT name FROM scenes').fetchall()
+    with conn:
+        for (name,) in rows:
+            orbit = catalog.find_for_s1(name)
+            conn.execute('UPDATE scenes SET orbit=? WHERE name=?',
+                         (orbit.path if orbit else None, name))
+
+
+def query_scenes(conn, track=None, aoi=None):
+    """scenes (name, date, path) of track whose footprint intersects aoi"""
+    sql = 'SELECT name, date, path FROM scenes WHERE 1'
+    args = []
+    if track is not None:
+        sql += ' AND track=?'
+        args.append(track)
+    if aoi is not None:
+        sql += ' AND max_lon>=? AND max_lat>=? AND min_lon<=? AND min_lat<=?'
+        args += list(aoi)
+    return conn.execute(sql + ' ORDER BY date, start', args).fetchall()
+
+
+def query_bursts(conn, track=None, aoi=None):
+    """bursts (date, swath, num, burst_id, scene) of track intersecting aoi"""
+    sql = ('SELECT s.date, b.swath, b.num, b.burst_id, s.name FROM bursts b '
+           'JOIN scenes s ON b.scene=s.name WHERE 1')
+    args = []
+    if track is not None:
+        sql += ' AND s.track=?'
+        args.append(track)
+    if aoi is not None:
+        sql += ' AND b.max_lon>=? AND b.max_lat>=? AND b.min_lon<=? AND b.min_lat<=?'
+        args += list(aoi)
+    return conn.execute(sql + ' ORDER BY s.date, b.swath, b.num', args).fetchall()
+
+
+def query_missing_orbit(conn):
+    return conn.execute(
+        'SELECT name, date FROM scenes WHERE orbit IS NULL ORDER BY date').fetchall()
+
+
+def main():
+    inps = cmdline_parser()
+    db = os.path.abspath(inps.db)
+    conn = connect(db)
+
+    if inps.index:
+        zip_files = []
+        zip_dirs = []
+        for zip_dir in inps.index:
+            if not os.path.isdir(zip_dir):
+                print('{} not exists.'.format(zip_dir))
+                sys.exit(1)
+            zip_dir = os.path.abspath(zip_dir)
+            zip_dirs.append(zip_dir)
+            zip_files += sorted(
+                os.path.join(zip_dir, i) for i in os.listdir(zip_dir)
+                if i.startswith('S1') and i.endswith('.zip'))
+        if inps.orbit_dir and not os.path.isdir(inps.orbit_dir):
+            print('{} not exists.'.format(inps.orbit_dir))
+            sys.exit(1)
+        # rows of zips no longer in indexed directories
+        num = prune_zips(conn, zip_dirs)
+        if num:
+            print('{} zips removed from catalog'.format(num))
+        num = index_zips(conn, zip_files, inps.orbit_dir, inps.jobs)
+        print('{} zips read, {} zips in {}'.format(
+            num,
+            conn.execute('SELECT COUNT(*) FROM scenes').fetchone()[0], db))
+    elif inps.orbit_dir:
+        match_orbits(conn, inps.orbit_dir)
+
+    if inps.missing_orbit:
+        for name, date in query_missing_orbit(conn):
+            print(date, name)
+    elif inps.bursts:
+        for row in query_bursts(conn, inps.track, inps.aoi):
+            print('{} {} burst {:>2} {} {}'.format(*row))
+    elif inps.track is not None or inps.aoi is not None:
+        for name, date, path in query_scenes(conn, inps.track, inps.aoi):
+            print(date, path)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,17 @@ import os
 import re
 import sys
 import glob
-import datetime
 import argparse
 import shutil
+import tempfile
+import zipfile
+import posixpath
+from fnmatch import fnmatch
+
+from cmd_runner import run_cmd
+from gamma_par import read_gamma_par
+from job_pool import run_jobs, print_summary, get_budgets
+from orbit_catalog import load_catalog
 
 
 def cmdLineParse():
@@ -38,6 +46,29 @@ def cmdLineParse():
         help='azimuth looks for generating amplitude image (default: 5)',
         type=int,
         default=5)
+    parser.add_argument(
+        '--pol',
+        help='polarization for generating slc (default: vv)',
+        default='vv')
+    parser.add_argument(
+        '--scratch',
+        help='directory for temporary files extracted from zip (default: slc directory of date)',
+        default=None)
+    parser.add_argument(
+        '--jobs',
+        help='number of swaths (of all dates) processed at the same time (default: 1)',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--max_mem',
+        help='memory used by running swaths in GB (default: 80%% of available memory)',
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--min_free',
+        help='free space kept in slc directory and scratch in GB (default: 10)',
+        type=float,
+        default=10)
     parser.add_argument(
         '--del_flag',
         help=
@@ -53,8 +84,18 @@ EXAMPLE = """Example:
   ./zip2slc.py /ly/zip_dir /ly/orbits /ly/slc 1
   # for iw1 iw2 and iw3
   ./zip2slc.py /ly/zip_dir /ly/orbits /ly/slc 1 2 3 --rlks 8 --alks 2 --del_flag t
+  # extract files to local disk
+  ./zip2slc.py /ly/zip_dir /ly/orbits /ly/slc 1 2 3 --pol vv --scratch /tmp
+  # process 6 swaths at the same time
+  ./zip2slc.py /ly/zip_dir /ly/orbits /ly/slc 1 2 3 --jobs 6
+  ./zip2slc.py /ly/zip_dir /ly/orbits /ly/slc 1 2 3 --jobs 6 --max_mem 32 --min_free 50
 """
 
+# buffer size for copying files out of zip
+COPY_BUFFER = 16 * 1024 * 1024
+# memory of par_S1_SLC and rasSLC as part of swath size
+SWATH_MEM_FACTOR = 0.5
+
 
 def get_s1_date(zip_file):
     file = os.path.basename(zip_file)
@@ -71,43 +112,12 @@ def get_all_s1_date(zip_files):
     return sorted(dates)
 
 
-def get_satellite(zip_file):
-    if 'S1A_IW_SLC_' in os.path.basename(zip_file):
-        satellite = 'S1A'
-    else:
-        satellite = 'S1B'
-
-    return satellite
-
-
-def get_orbit_date(s1_date):
-    date = datetime.datetime(int(s1_date[0:4]), int(s1_date[4:6]),
-                             int(s1_date[6:8]))
-    delta = datetime.timedelta(days=-1)
-    tmp = date + delta
-    orbit_date = tmp.strftime('%Y%m%d')
-    return orbit_date
-
-
 def get_orbit_file_name(zip_file, orbit_dir):
-    satellite = get_satellite(zip_file)
-    s1_date = get_s1_date(zip_file)
-    orbit_date = get_orbit_date(s1_date)
-    orbit_file_name = None
-    for i in os.listdir(orbit_dir):
-        if orbit_date in i and i.endswith('.EOF') and i.startswith(satellite):
-            orbit_file_name = i
-    return orbit_file_name
-
-
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
+    """orbit file covering start~stop time of zip, found in cached orbit catalog"""
+    orbit = load_catalog(orbit_dir).find_for_s1(zip_file)
+    if orbit is None:
+        return None
+    return orbit.name
 
 
 def check_inputs(zip_dir, orbit_dir, slc_dir, iw_num, del_flag):
@@ -133,110 +143,118 @@ def check_inputs(zip_dir, orbit_dir, slc_dir, iw_num, del_flag):
         sys.exit()
 
 
-def unzip_file(zip_file, log_file):
-    safe_dir = zip_file.replace('.zip', '.SAFE')
-    zip_file_dir = os.path.dirname(zip_file)
-    if os.path.isdir(safe_dir):
-        shutil.rmtree(safe_dir)
-    call_str = 'unzip ' + zip_file + ' -d ' + zip_file_dir + ' > ' + log_file
-    print('\nunzip {}......'.format(os.path.basename(zip_file)))
-    os.system(call_str)
-    print('done.\n')
-
+def get_swath_file_type(member, iw, pol):
+    """type of zip member needed by par_S1_SLC for iw and pol, None if not needed"""
+    name = posixpath.basename(member)
+    parent = posixpath.basename(posixpath.dirname(member))
+    if parent == 'measurement' and fnmatch(name, f'*iw{iw}*{pol}*.tiff'):
+        return 'measurement'
+    if parent == 'annotation' and fnmatch(name, f'*iw{iw}*{pol}*.xml'):
+        return 'annotation'
+    if parent == 'calibration' and fnmatch(name, f'calibration*iw{iw}*{pol}*'):
+        return 'calibration'
+    if parent == 'calibration' and fnmatch(name, f'noise*iw{iw}*{pol}*'):
+        return 'noise'
+    return None
+
+
+def extract_swath(zip_file, iw, pol, out_dir):
+    """extract only measurement, annotation, calibration and noise of one swath"""
+    files = {}
+    with zipfile.ZipFile(zip_file) as zf:
+        for info in zf.infolist():
+            file_type = get_swath_file_type(info.filename, iw, pol)
+            if file_type is None or file_type in files:
+                continue
+            dst = os.path.join(out_dir, posixpath.basename(info.filename))
+            with zf.open(info) as src, open(dst, 'wb') as f:
+                shutil.copyfileobj(src, f, COPY_BUFFER)
+            files[file_type] = dst
+    return files
+
+
+def swath_size(zip_file, iw, pol):
+    """bytes of files extracted for one swath"""
+    size = 0
+    with zipfile.ZipFile(zip_file) as zf:
+        for info in zf.infolist():
+            if get_swath_file_type(info.filename, iw, pol):
+                size += info.file_size
+    return size
+
+
+def generate_slc(zip_file, slc_path, iw, pol, scratch_dir, log_file):
+    s1_date = get_s1_date(zip_file)
+    slc = slc_path + '/' + s1_date + '.iw' + iw + '.slc'
+    slc_par = slc_path + '/' + s1_date + '.iw' + iw + '.slc.par'
+    tops_par = slc_path + '/' + s1_date + '.iw' + iw + '.slc.tops_par'
+
+    tmp_dir = tempfile.mkdtemp(prefix=s1_date + '.iw' + iw + '_',
+                               dir=scratch_dir if scratch_dir else slc_path)
+    try:
+        try:
+            files = extract_swath(zip_file, iw, pol, tmp_dir)
+        except (zipfile.BadZipFile, OSError) as e:
+            print('cannot extract {}: {}'.format(zip_file, e))
+            return 1
+        if not all(k in files for k in ['measurement', 'annotation', 'calibration']):
+            print('cannot find iw{} {} in {}.'.format(iw, pol, zip_file))
+            return 1
+
+        noise = files.get('noise', '-')
+        call_str = 'par_S1_SLC ' + files['measurement'] + ' ' + files[
+            'annotation'] + ' ' + files['calibration'] + ' ' + noise + ' ' + \
+            slc_par + ' ' + slc + ' ' + tops_par + ' >> ' + log_file
+        code = run_cmd(call_str, tag=s1_date)
+    finally:
+        # delete extracted files at once
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if code == 0 and not os.path.isfile(slc_par):
+        code = 1
+    return code
+
+
+def orbit_correction(orbit_dir, slc_par, zip_file, log_file):
+    orbit_file_name = get_orbit_file_name(zip_file, orbit_dir)
+    s1_date = get_s1_date(zip_file)
+    if not orbit_file_name:
+        print('cannot find precisce orbit for {}.'.format(s1_date))
+        return 0
+    orbit_file_path = os.path.join(orbit_dir, orbit_file_name)
+    call_str = 'S1_OPOD_vec.vec' + ' ' + slc_par + ' ' + orbit_file_path + ' >> ' + log_file
+    return run_cmd(call_str, tag=s1_date)
 
-def generate_slc(safe_dir, slc_path, iw_num, log_file):
-    s1_date = get_s1_date(os.path.basename(safe_dir))
 
-    measurement_dir = safe_dir + '/measurement'
-    annotation_dir = safe_dir + '/annotation'
-    calibration_dir = safe_dir + '/annotation/calibration'
+def generate_amp(slc, rlks, alks, log_file):
+    slc_par = slc + '.par'
+    bmp = slc + '.bmp'
+    width = read_gamma_par(slc_par, 'range_samples:')
+    call_str = 'rasSLC ' + slc + ' ' + width + ' 1 0 ' + str(
+        rlks) + ' ' + str(alks) + ' 1. .35 1 0 0 ' + bmp + ' >> ' + log_file
+    return run_cmd(call_str, tag=os.path.basename(os.path.dirname(slc)))
 
-    slc_tab = slc_path + '/' + s1_date + '_slc_tab'
-    if os.path.isfile(slc_tab):
-        os.remove(slc_tab)
 
-    for i in iw_num:
-        i = str(i)
-        slc = slc_path + '/' + s1_date + '.iw' + i + '.slc'
-        slc_par = slc_path + '/' + s1_date + '.iw' + i + '.slc.par'
-        tops_par = slc_path + '/' + s1_date + '.iw' + i + '.slc.tops_par'
-
-        call_str = 'echo ' + slc + ' ' + slc_par + ' ' + tops_par + ' > ' + slc_tab
-        os.system(call_str)
-
-        MEASUREMENT = glob.glob(measurement_dir + '/*iw' + i + '*vv*tiff')
-        ANNOTATION = glob.glob(annotation_dir + '/*iw' + i + '*vv*xml')
-        CALIBRATION = glob.glob(calibration_dir + '/calibration*' + 'iw' + i +
-                                '*vv*')
-        NOISE = glob.glob(calibration_dir + '/noise*' + 'iw' + i + '*vv*')
-
-        if not NOISE:
-            call_str = 'par_S1_SLC ' + MEASUREMENT[0] + ' ' + ANNOTATION[
-                0] + ' ' + CALIBRATION[
-                    0] + ' - ' + slc_par + ' ' + slc + ' ' + tops_par + ' >> ' + log_file
-        else:
-            call_str = 'par_S1_SLC ' + MEASUREMENT[0] + ' ' + ANNOTATION[
-                0] + ' ' + CALIBRATION[0] + ' ' + NOISE[
-                    0] + ' ' + slc_par + ' ' + slc + ' ' + tops_par + ' >> ' + log_file
-        print(
-            'generate SLC image and parameter files for iw{}......'.format(i))
-        os.system(call_str)
-        print('done.\n')
-    # delete safe directory and slc_tab
-    shutil.rmtree(safe_dir)
-    os.remove(slc_tab)
-
-
-def orbit_correction(orbit_dir, slc_path, zip_file, log_file):
-    orbit_file_name = get_orbit_file_name(zip_file, orbit_dir)
+def run_swath(name, zip_file, slc_path, orbit_dir, iw, pol, scratch_dir,
+              rlks, alks):
+    """slc, orbit correction and amplitude of one swath, return exit code"""
     s1_date = get_s1_date(zip_file)
-    if orbit_file_name:
-        orbit_file_path = os.path.join(orbit_dir, orbit_file_name)
-    else:
-        print('cannot find precisce orbit for {}.'.format(s1_date))
-        orbit_file_path = None
-    # orbit correction
-    slc_pars = glob.glob(slc_path + '/*.iw*.slc.par')
-    for slc_par in slc_pars:
-        if orbit_file_path:
-            call_str = 'S1_OPOD_vec.vec' + ' ' + slc_par + ' ' + orbit_file_path + ' >> ' + log_file
-            iw = re.findall(r'iw\d{1}', os.path.basename(slc_par))[0]
-            print('orbit correction for {}......'.format(iw))
-            os.system(call_str)
-            print('done.\n')
-
-
-def generate_amp(slc_path, rlks, alks, log_file):
-    slcs = glob.glob(slc_path + '/*.iw*.slc')
-    for slc in slcs:
-        slc_par = slc + '.par'
-        bmp = slc + '.bmp'
-        width = read_gamma_par(slc_par, 'range_samples:')
-        call_str = 'rasSLC ' + slc + ' ' + width + ' 1 0 ' + str(
-            rlks) + ' ' + str(
-                alks) + ' 1. .35 1 0 0 ' + bmp + ' >> ' + log_file
-        iw = re.findall(r'iw\d{1}', os.path.basename(slc_par))[0]
-        print('generate amplitude file for {}......'.format(iw))
-        os.system(call_str)
-        print('done.\n')
-
-
-def run_all(zip_file, slc_path, orbit_dir, iw_num, rlks, alks, del_flag):
-    s1_date = get_s1_date(zip_file)
-    # log file
-    log_file = os.path.join(slc_path, s1_date + '.log')
-    # unzip
-    unzip_file(zip_file, log_file)
-    # generate slc
-    safe_dir = zip_file.replace('.zip', '.SAFE')
-    generate_slc(safe_dir, slc_path, iw_num, log_file)
-    # orbit correction
-    orbit_correction(orbit_dir, slc_path, zip_file, log_file)
-    # generate amplitude file for quickview
-    generate_amp(slc_path, rlks, alks, log_file)
-    # delete zip data
-    if del_flag == 't':
-        os.remove(zip_file)
+    iw = str(iw)
+    slc = os.path.join(slc_path, s1_date + '.iw' + iw + '.slc')
+    # log file of this swath only
+    log_file = os.path.join(slc_path, s1_date + '.iw' + iw + '.log')
+    if os.path.isfile(log_file):
+        os.remove(log_file)
+
+    print('{}: generate SLC image and parameter files......'.format(name))
+    code = generate_slc(zip_file, slc_path, iw, pol, scratch_dir, log_file)
+    if code != 0:
+        return code
+    print('{}: orbit correction......'.format(name))
+    code = orbit_correction(orbit_dir, slc + '.par', zip_file, log_file)
+    if code != 0:
+        return code
+    print('{}: generate amplitude file......'.format(name))
+    return generate_amp(slc, rlks, alks, log_file)
 
 
 def main():
@@ -249,38 +267,69 @@ def main():
     iw_num = inps.iw_num
     rlks = inps.rlks
     alks = inps.alks
+    pol = inps.pol.lower()
+    scratch_dir = inps.scratch
+    num_jobs = inps.jobs
+    max_mem, min_free = get_budgets(inps.max_mem, inps.min_free)
     del_flag = inps.del_flag.lower()
     # check inputs
     check_inputs(zip_dir, orbit_dir, slc_dir, iw_num, del_flag)
+    if scratch_dir:
+        scratch_dir = os.path.abspath(scratch_dir)
+        if not os.path.isdir(scratch_dir):
+            print('{} not exists.'.format(scratch_dir))
+            sys.exit()
+    # index orbit files once, inherited by all jobs
+    catalog = load_catalog(orbit_dir)
+    print('{} orbit files in {}'.format(len(catalog), orbit_dir))
     # get all zips
     zip_files = glob.glob(zip_dir + '/S1*_IW_SLC*.zip')
     # get all dates
     dates = get_all_s1_date(zip_files)
-    num = 1
+    # one job for each swath of each zip
+    jobs = []
+    costs = {}
+    swath_jobs = {}
     for date in dates:
         # get zipfiles
         same_date_zips = glob.glob(zip_dir + '/S1*' + date + '*.zip')
         same_date_zips = sorted(same_date_zips, key=lambda i: i[26:32])
-        if len(same_date_zips) == 1:
-            zip_file = same_date_zips[0]
-            slc_path = os.path.join(slc_dir, date)
+        for i, zip_file in enumerate(same_date_zips):
+            if len(same_date_zips) == 1:
+                slc_path = os.path.join(slc_dir, date)
+            else:
+                slc_path = os.path.join(slc_dir, date + '-' + str(i + 1))
             if not os.path.isdir(slc_path):
                 os.mkdir(slc_path)
-            run_all(zip_file, slc_path, orbit_dir, iw_num, rlks, alks,
-                    del_flag)
-            print("[{}] {} zip2slc for {} is done {}\n".format(num, '>' * 10, date, '<' * 10))
-            num += 1
-        else:
-            for i in range(len(same_date_zips)):
-                zip_file = same_date_zips[i]
-                slc_path = os.path.join(slc_dir, date + '-' + str(i + 1))
-                if not os.path.isdir(slc_path):
-                    os.mkdir(slc_path)
-                run_all(zip_file, slc_path, orbit_dir, iw_num, rlks, alks,
-                        del_flag)
-                print("[{}] {} zip2slc for {} is done {}\n".format(num, '>' * 10, date, '<' * 10))
-                num += 1
+            swath_jobs[zip_file] = []
+            for iw in iw_num:
+                name = os.path.basename(slc_path) + '.iw' + str(iw)
+                jobs.append((name, zip_file, slc_path, orbit_dir, iw, pol,
+                             scratch_dir, rlks, alks))
+                swath_jobs[zip_file].append(name)
+                try:
+                    size = swath_size(zip_file, str(iw), pol)
+                except (zipfile.BadZipFile, OSError):
+                    size = 0
+                # extracted files and SLC of about the same size
+                costs[name] = (SWATH_MEM_FACTOR * size, size, size)
+
+    print('processing {} swaths of {} zips:'.format(len(jobs), len(swath_jobs)))
+    # files are extracted into scratch_dir (or slc_dir), SLCs written into slc_dir
+    disk_dir = [scratch_dir if scratch_dir else slc_dir, slc_dir]
+    results = run_jobs(run_swath, jobs, num_jobs, costs, max_mem, disk_dir,
+                       min_free)
+    failed = print_summary(results)
+
+    # delete zip data only if all of its swaths are done
+    if del_flag == 't':
+        for zip_file, names in swath_jobs.items():
+            if not any(name in failed for name in names):
+                os.remove(zip_file)
 
+    if failed:
+        print('\nsee <slc_dir>/<date>/<date>.iw*.log of failed swaths.')
+    print('\nall done, enjoy it.\n')
 
 if __name__ == "__main__":
     main()
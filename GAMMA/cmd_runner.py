@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+#####################################################################
+# Run GAMMA commands and record their resource usage               #
+# set TINTPY_PROFILE to a file path, every command run by run_cmd  #
+# appends one JSON line (wall, cpu, peak rss, bytes read/written)  #
+# then summarize records using this script                         #
+# Copyright (c) 2021, Lei Yuan                                     #
+#####################################################################
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+
+# environment variable holding path of profile file (inherited by workers)
+PROFILE_ENV = 'TINTPY_PROFILE'
+
+# fields of one record, also columns of csv report
+FIELDS = [
+    'program', 'tag', 'start', 'wall', 'user', 'sys', 'cpu', 'max_rss',
+    'read_bytes', 'write_bytes', 'code', 'cwd', 'cmd'
+]
+
+EXAMPLE = """Example:
+  export TINTPY_PROFILE=/ly/profile.jsonl
+  diff_by_number.py /ly/slc /ly/stacking /ly/dem 2 --jobs 8
+  cmd_runner.py /ly/profile.jsonl /ly/profile
+  cmd_runner.py /ly/profile.jsonl /ly/profile --top 20
+"""
+
+
+def get_program(cmd):
+    """name of program called by command"""
+    tokens = cmd.split()
+    if not tokens:
+        return ''
+    return os.path.basename(tokens[0])
+
+
+def run_cmd(cmd, cwd=None, tag=None, stdin=None, stdout=None, stderr=None):
+    """run shell command like os.system, return exit code
+
+    stdin is a string sent to the command, tag is date or pair of the
+    command (defaults: name of working directory).
+    """
+    start = time.time()
+    p = subprocess.Popen(cmd,
+                         shell=True,
+                         cwd=cwd,
+                         stdin=None if stdin is None else subprocess.PIPE,
+                         stdout=stdout,
+                         stderr=stderr)
+    if stdin is not None:
+        try:
+            p.stdin.write(stdin.encode())
+            p.stdin.close()
+        except BrokenPipeError:
+            pass
+    # resource usage of the shell and all programs it waited for
+    _, status, ru = os.wait4(p.pid, 0)
+    wall = time.time() - start
+    if os.WIFSIGNALED(status):
+        code = -os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+    p.returncode = code
+
+    profile_file = os.environ.get(PROFILE_ENV)
+    if profile_file:
+        if cwd is None:
+            cwd = os.getcwd()
+        if tag is None:
+            tag = os.path.basename(os.path.abspath(cwd))
+        record = {
+            'program': get_program(cmd),
+            'tag': tag,
+            'start': round(start, 3),
+            'wall': round(wall, 3),
+            'user': round(ru.ru_utime, 3),
+            'sys': round(ru.ru_stime, 3),
+            'cpu': round(ru.ru_utime + ru.ru_stime, 3),
+            # kilobytes on linux
+            'max_rss': ru.ru_maxrss * 1024,
+            # blocks of 512 bytes really read from or written to disk
+            'read_bytes': ru.ru_inblock * 512,
+            'write_bytes': ru.ru_oublock * 512,
+            'code': code,
+            'cwd': cwd,
+            'cmd': cmd
+        }
+        write_record(profile_file, record)
+    return code
+
+
+def write_record(profile_file, record):
+    """append one line, single write with O_APPEND so workers don't mix lines"""
+    line = (json.dumps(record) + '\n').encode()
+    fd = os.open(profile_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def load_records(profile_files):
+    records = []
+    for profile_file in profile_files:
+        with open(profile_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # line of a killed run
+                        pass
+    return records
+
+
+def summarize(records, keys):
+    """total usage grouped by keys, sorted by wall time"""
+    groups = {}
+    for r in records:
+        k = tuple(r[i] for i in keys)
+        if k not in groups:
+            groups[k] = dict(zip(keys, k))
+            groups[k].update({
+                'count': 0,
+                'failed': 0,
+                'wall': 0.0,
+                'cpu': 0.0,
+                'max_rss': 0,
+                'read_bytes': 0,
+                'write_bytes': 0
+            })
+        g = groups[k]
+        g['count'] += 1
+        g['failed'] += int(r['code'] != 0)
+        g['wall'] += r['wall']
+        g['cpu'] += r['cpu']
+        g['max_rss'] = max(g['max_rss'], r['max_rss'])
+        g['read_bytes'] += r['read_bytes']
+        g['write_bytes'] += r['write_bytes']
+    rows = sorted(groups.values(), key=lambda g: g['wall'], reverse=True)
+    for g in rows:
+        g['wall'] = round(g['wall'], 3)
+        g['cpu'] = round(g['cpu'], 3)
+    return rows
+
+
+def write_csv(records, csv_file):
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for r in records:
+            writer.writerow(r)
+
+
+def write_json(records, json_file):
+    report = {
+        'total_wall': round(sum(r['wall'] for r in records), 3),
+        'total_cpu': round(sum(r['cpu'] for r in records), 3),
+        'programs': summarize(records, ['program']),
+        'tags': summarize(records, ['tag']),
+        'tag_programs': summarize(records, ['tag', 'program'])
+    }
+    with open(json_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def print_top(records, top):
+    """table of the top programs by total wall time"""
+    rows = summarize(records, ['program'])
+    total = sum(r['wall'] for r in records) or 1.0
+    print('{:<24}{:>7}{:>12}{:>7}{:>12}{:>11}{:>11}{:>11}'.format(
+        'program', 'count', 'wall(s)', 'wall%', 'cpu(s)', 'rss(MB)',
+        'read(MB)', 'write(MB)'))
+    for r in rows[:top]:
+        print('{:<24}{:>7}{:>12.1f}{:>7.1f}{:>12.1f}{:>11.1f}{:>11.1f}{:>11.1f}'.
+              format(r['program'][:23], r['count'], r['wall'],
+                     r['wall'] / total * 100, r['cpu'], r['max_rss'] / 2**20,
+                     r['read_bytes'] / 2**20, r['write_bytes'] / 2**20))
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Summarize resource usage of commands recorded in profile files.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+    parser.add_argument('profile_file', nargs='+', help='profile file(s) written by run_cmd')
+    parser.add_argument('out_prefix', help='prefix of output .json and .csv report')
+    parser.add_argument('--top',
+                        help='number of programs printed (defaults: 10)',
+                        default=10,
+                        type=int)
+    inps = parser.parse_args()
+    return inps
+
+
+def main():
+    inps = cmdline_parser()
+    out_prefix = os.path.abspath(inps.out_prefix)
+
+    for f in inps.profile_file:
+        if not os.path.isfile(f):
+            print('{} not exists.'.format(f))
+            sys.exit(1)
+
+    records = load_records(inps.profile_file)
+    if not records:
+        print('no record found.')
+        sys.exit(1)
+
+    write_json(records, out_prefix + '.json')
+    write_csv(records, out_prefix + '.csv')
+    print('{} commands, {} programs, {} dates/pairs\n'.format(
+        len(records), len(set(r['program'] for r in records)),
+        len(set(r['tag'] for r in records))))
+    print_top(records, inps.top)
+    print('\nwrite {} and {}'.format(out_prefix + '.json', out_prefix + '.csv'))
+
+
+if __name__ == "__main__":
+    main()
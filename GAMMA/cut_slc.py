@@ -9,6 +9,8 @@ import re
 import argparse
 import sys
 
+from gamma_par import read_gamma_par
+
 
 def cmd_line_parser():
     parser = argparse.ArgumentParser(
@@ -50,16 +52,6 @@ EXAMPLE = """Example:
 """
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def main():
     inps = cmd_line_parser()
     slc_dir = inps.slc_dir
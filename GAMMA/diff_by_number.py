@@ -11,200 +11,10 @@ import sys
 import glob
 import argparse
 
-dinsar_script = """m_slc=$slc_dir/$m_date/$m_date.slc
-s_slc=$slc_dir/$s_date/$s_date.slc
-m_par=$m_slc.par
-s_par=$s_slc.par
-MS_off=$m_date-$s_date.off
-
-##################################################################################################################
-### create the ISP processing/offset parameter file from MSP processing parameter and sensor files
-##################################################################################################################
-# par_MSP ../$m_date/palsar.par ../$m_date/p$m_par $m_par
-# par_MSP ../$s_date/palsar.par ../$s_date/p$s_par $s_par
-##################################################################################################################
-### Supports interactive creation of offset/processing parameter file for generation of interferograms
-### create_offset reads the SLC parameter files and queries the user for parameters(write into the .off file) required to calculate the offsets 
-### using either the cross correlation of intensity or fringe visibility algorithms
-### a. scence title: interferogram parameters
-### b. range,azimuth offsets of SLC-2 relative to SLC-1(SLC samples):0 0
-### c. enter number of offset measurements in range, azimuth: 32 32
-### e. search window sizes(range, azimuth, nominal: 64 64)
-### f. low correlation SNR threshold for intensity cross correlation 7.0
-### g. offset in range to first interfergram sample 0
-### h. width of SLCsection to processes (width of SLC-1)
-##################################################################################################################
-echo -ne "$m_date-$s_date\\n 0 0\\n 32 32\\n 64 64\\n 7.0\\n 0\\n\\n" > create_offset
-create_offset $m_par $s_par $MS_off 1 1 1 < create_offset
-rm -f create_offset
-
-##################################################################################################################
-### first guess of the offsets can be obtained based on orbital information
-### The position of the initial registration offset estimation can be indicated. As default the SLC-1 image center is used.
-##################################################################################################################
-init_offset_orbit $m_par $s_par $MS_off
-
-##################################################################################################################
-### improve the first guess, determines the initial offsets based on the cross-correlation function of the image intensities
-### In order to avoid ambiguity problems and achieve an accutare estimates init_offset first be run with multi-looking
-### followed by a second run at single look resolution
-##################################################################################################################
-init_offset $m_slc $s_slc $m_par $s_par $MS_off 9 10
-init_offset $m_slc $s_slc $m_par $s_par $MS_off 1 1
-
-##################################################################################################################
-### the first time offset_pwr and offset_fit, Estimation of offsets 
-### first time with larger windowsize
-### offset_pwr estimates the range and azimuth registration offset fields using correlation optimization of the detected SLC data
-### determine the bilinear registration offset polynomial using a least squares error method
-### offset_fit computes range and azimuth registration offset polynomials from offsets estimated by one of the programs offset_pwr
-##################################################################################################################
-offset_pwr $m_slc $s_slc $m_par $s_par $MS_off $m_date-$s_date.offs $m_date-$s_date.off.snr 256 256 $m_date-$s_date.offsets 1 100 100 7.0 2
-offset_fit $m_date-$s_date.offs $m_date-$s_date.off.snr $MS_off $m_date-$s_date.coffs $m_date-$s_date.coffsets 9 4 0
-cp $m_date-$s_date.offsets offsets_datewr_1
-cp $m_date-$s_date.coffsets coffsets_datewr_1
-
-##################################################################################################################
-### resample  slc
-##################################################################################################################
-SLC_interp $s_slc $m_par $s_par $MS_off $s_date.rslc $s_date.rslc.par
-
-##################################################################################################################
-### Generation of interferogram with multi-look factors rlks * alks
-##################################################################################################################
-SLC_intf $m_slc $s_date.rslc $m_par $s_date.rslc.par $MS_off $m_date-$s_date.int $rlks $alks - - 1 1
-
-##################################################################################################################
-### Generation of multi-look SARintensity image of reference SLC
-##################################################################################################################
-multi_look $m_slc $m_par  $m_date-$s_date.pwr1 $m_date.pwr1.par $rlks $alks
-multi_look $s_date.rslc $s_date.rslc.par $m_date-$s_date.pwr2 $s_date.pwr2.par $rlks $alks
-width=$(awk '$1 == "interferogram_width:" {print $2}' $MS_off)
-line=$(awk '$1 == "interferogram_azimuth_lines:" {print $2}' $MS_off)
-rasmph_pwr $m_date-$s_date.int $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.intandpwr.bmp
-raspwr $m_date-$s_date.pwr1 $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.pwr1.bmp
-raspwr $m_date-$s_date.pwr2 $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.pwr2.bmp
-base_init $m_par $s_par $MS_off $m_date-$s_date.int $m_date-$s_date.base 0 1024 1024
-base_perp $m_date-$s_date.base $m_par $MS_off > $m_date-$s_date.base.perp
-
-##################################################################################################################
-### Curved Earth phase trend removal("flattening")
-### ph_slop_base Subtract/add interferogram flat-Earth phase trend as estimated from initial baseline
-##################################################################################################################
-ph_slope_base $m_date-$s_date.int $m_par $MS_off $m_date-$s_date.base $m_date-$s_date.flt 1 0
-rasmph_pwr $m_date-$s_date.flt $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.fltandpwr.bmp
-cc_wave $m_date-$s_date.int $m_par $s_date.rslc.par $m_date-$s_date.corr $width - - 3
-
-##################################################################################################################
-### filter flattened interferogram
-##################################################################################################################
-adf $m_date-$s_date.flt $m_date-$s_date.flt.sm1 $m_date-$s_date.sm.cc1 $width 0.3 128
-adf $m_date-$s_date.flt.sm1 $m_date-$s_date.flt.sm2 $m_date-$s_date.sm.cc2 $width 0.3 64
-adf $m_date-$s_date.flt.sm2 $m_date-$s_date.flt.sm $m_date-$s_date.sm.cc $width 0.3
-rasmph_pwr $m_date-$s_date.flt.sm $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.fltsmpwr.bmp
-gc_map $m_par $MS_off $dem_par $dem dem_seg.par dem_seg lookup 1 1 sim_sar - - - - - - 8 1
-width_map=$(awk '$1 == "width:" {print $2}' dem_seg.par)
-nlines_map=$(awk '$1 == "nlines:" {print $2}' dem_seg.par)
-col_post=$(awk '$1 == "post_lat:" {print $2}' dem_seg.par)
-row_post=$(awk '$1 == "post_lon:" {print $2}' dem_seg.par)
-rasshd dem_seg $width_map $col_post $row_post 1 0 1 1 45. 135. 1 dem_seg.bmp
-
-##################################################################################################################
-### geocode the simulated SAR intensity image to radar coordinate
-### when gc_map computes the lookup table it can also compute a simulated SAR image in the map coordinate system
-### geocode:Forward transformation with a geocoding look-up table
-### For each image point defined in coordinate system A, the lookup table contains the corresponding coordinates in system B
-### The program geocode is used to resample the data in coordinate system A into the coordinates of system B
-##################################################################################################################
-geocode lookup sim_sar $width_map sim_sar_rdc $width $line 1 0
-raspwr sim_sar_rdc $width 1 0 1 1 1. .35 1 sim_sar_rdc.bmp
-
-##################################################################################################################
-### create a parameter file including the differential interferogram parameters
-### create_diff_par: reads two parameter files(.off,.slc.par,.mli.par,.dem_datear)and creates a DIFF parameter file used for 
-### image registration,geocoding, and 2- and 3-pass differential interferometry
-##################################################################################################################
-echo -ne "$m_date-$s_date\\n 0 0\\n 64 64\\n 256 256\\n 7.0\\n" > create_diff_parin
-create_diff_par $MS_off - $m_date-$s_date.diff.par 0 < create_diff_parin
-rm -f create_diff_parin
-
-##################################################################################################################
-### compute offset of simulated SAR image to slc(mli) image
-### init_offsetm: initial registration offset estimation for multilook intensity images
-### offset_pwrm: estimates the range and azimuth registration offset fields using cross correlation optimization of the input intensity images
-### offset_fitm: computes range and azimuth registration offset polynomials from offsets estimated by one of the program offset_pwrm or offset_pwr_tracking 
-##################################################################################################################
-init_offsetm $m_date-$s_date.pwr1 sim_sar_rdc $m_date-$s_date.diff.par 1 1 - - 0 0 7
-offset_pwrm $m_date-$s_date.pwr1 sim_sar_rdc $m_date-$s_date.diff.par offs snr 256 256 offsets 2 100 100 7.0 2
-offset_fitm offs snr $m_date-$s_date.diff.par coffs coffsets 8.0 6
-offset_pwrm $m_date-$s_date.pwr1 sim_sar_rdc $m_date-$s_date.diff.par offs snr 64 64 offsets 2 300 300 9.0 2
-offset_fitm offs snr $m_date-$s_date.diff.par coffs coffsets 10.0 6
-
-##################################################################################################################
-### gc_map_fine applies the fine registration function to the input lookup table to create the refined output lookup table 
-### This is done by addition of the fine registration offsets to the lookup vectors
-##################################################################################################################
-gc_map_fine lookup $width_map $m_date-$s_date.diff.par lookup_fine 0
-geocode lookup_fine dem_seg $width_map $m_date-$s_date.rdc_hgt $width $line 1 0
-rashgt $m_date-$s_date.rdc_hgt $m_date-$s_date.pwr1 $width 1 1 0 1 1 20.0 1. .35 1 $m_date-$s_date.rdc_hgt_pwr.bmp
-
-##################################################################################################################
-### Form Differential Interferogram (flag is important)
-##################################################################################################################
-# simulation of unwrapped topographic phase
-phase_sim $m_par $MS_off $m_date-$s_date.base $m_date-$s_date.rdc_hgt $m_date-$s_date.sim_unw 0 0 - -
-
-##################################################################################################################
-### Subtractiing the simulated unwrapped phase from the complex interferogram
-##################################################################################################################
-sub_phase $m_date-$s_date.int $m_date-$s_date.sim_unw $m_date-$s_date.diff.par $m_date-$s_date.diff.int 1 0
-rasmph $m_date-$s_date.diff.int $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.bmp
-rasmph_pwr $m_date-$s_date.diff.int $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.pwr.bmp
-
-##################################################################################################################
-### Filter Differential Interferogram
-##################################################################################################################
-adf $m_date-$s_date.diff.int $m_date-$s_date.diff.int.sm1 $m_date-$s_date.diff.sm.cc1 $width 0.3 128
-adf $m_date-$s_date.diff.int.sm1 $m_date-$s_date.diff.int.sm2 $m_date-$s_date.diff.sm.cc2 $width 0.3 64
-adf $m_date-$s_date.diff.int.sm2 $m_date-$s_date.diff.int.sm $m_date-$s_date.diff.sm.cc $width 0.3
-rasmph $m_date-$s_date.diff.int.sm $width 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.sm.bmp
-rasmph_pwr $m_date-$s_date.diff.int.sm $m_date-$s_date.pwr1 $width 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.int.sm.pwr.bmp
-
-##################################################################################################################
-### Unwrap Differential Flattened Interferogram
-##################################################################################################################
-# rascc_mask $m_date-$s_date.sm.cc $m_date-$s_date.pwr1 $width 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 $m_date-$s_date.sm.cc_mask.bmp
-rascc_mask $m_date-$s_date.corr $m_date-$s_date.pwr1 $width 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 $m_date-$s_date.sm.cc_mask.bmp
-mcf $m_date-$s_date.diff.int.sm $m_date-$s_date.corr $m_date-$s_date.sm.cc_mask.bmp $m_date-$s_date.diff.int.sm.unw $width 1 0 0 - - 1 1 - - - 0
-rasrmg $m_date-$s_date.diff.int.sm.unw $m_date-$s_date.pwr1 $width 1 1 0 1 1 .6 1. .35 .0 1 $m_date-$s_date.diff.int.sm.unw.pwr.bmp $m_date-$s_date.sm.cc 1 .2
-rasrmg $m_date-$s_date.diff.int.sm.unw - $width 1 1 0 1 1 .5 1. .35 .0 1 $m_date-$s_date.diff.int.sm.unw.bmp $m_date-$s_date.sm.cc 1 .2
-
-##################################################################################################################
-### Subtractiing linear phase trends if needed 
-##################################################################################################################
-quad_fit $m_date-$s_date.diff.int.sm.unw $m_date-$s_date.diff.par 32 32 $m_date-$s_date.sm.cc_mask.bmp $m_date-$s_date.plot 3
-quad_sub $m_date-$s_date.diff.int.sm.unw $m_date-$s_date.diff.par $m_date-$s_date.diff.int.sm.sub.unw 0 0
-rasrmg $m_date-$s_date.diff.int.sm.sub.unw $m_date-$s_date.pwr1 $width 1 1 0 1 1 .6 1. .35 .0 1 $m_date-$s_date.diff.int.sm.sub.unw.pwr.bmp $m_date-$s_date.sm.cc 1 .2
-rasrmg $m_date-$s_date.diff.int.sm.sub.unw -  $width 1 1 0 1 1 .5 1. .35 .0 1 $m_date-$s_date.diff.int.sm.sub.unw.bmp $m_date-$s_date.sm.cc 1 .2
-
-##################################################################################################################
-### geocode the radar coordinates to imulated SAR intensity image
-##################################################################################################################
-# geocode_back $m_date-$s_date.sm.cc $width lookup_fine $m_date-$s_date.utm.cc $width_map $nlines_map 1 0
-# geocode_back $m_date-$s_date.diff.int.sm $width lookup_fine $m_date-$s_date.diff.utm.sm $width_map $nlines_map 1 1
-# geocode_back $m_date-$s_date.diff.int.sm.unw $width lookup_fine $m_date-$s_date.diff.utm.unw $width_map $nlines_map 1 0
-# geocode_back $m_date-$s_date.pwr1 $width lookup_fine $m_date-$s_date.utm.pwr $width_map $nlines_map 1 0
-# rascc $m_date-$s_date.utm.cc - $width_map 1 1 0 1 1 .1 .9 1. .35 1 $m_date-$s_date.utm.cc.bmp
-# rascc $m_date-$s_date.utm.cc $m_date-$s_date.utm.pwr $width_map 1 1 0 1 1 .1 .9 1. .35 1 $m_date-$s_date.utm.ccandpwr.bmp
-# rasmph $m_date-$s_date.diff.utm.sm $width_map 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.utm.sm.bmp
-# rasmph_pwr $m_date-$s_date.diff.utm.sm $m_date-$s_date.utm.pwr $width_map 1 1 0 1 1 1. 0.35 1 $m_date-$s_date.diff.utm.smandpwr.bmp
-# rasrmg $m_date-$s_date.diff.int.sm.unw -  $width 1 1 0 1 1 .18 1. .35 .0 1 $m_date-$s_date.diff.int.unw.bmp $m_date-$s_date.sm.cc 1 .2
-
-##################################################################################################################
-### delete files to release storage
-##################################################################################################################
-rm -rf $s_date.rslc
-"""
+from job_pool import run_jobs, print_summary, get_budgets
+from pipeline import run_pipeline
+from dinsar_steps import dinsar_pipeline, pair_cost, expand_keep, pair_files
+from stack_geometry import get_geo_dir, prep_geometry
 
 
 def cmd_line_parser():
@@ -227,6 +37,29 @@ def cmd_line_parser():
                         help='azimuth looks (defaults: 5)',
                         default='5',
                         type=int)
+    parser.add_argument('--jobs',
+                        help='number of pairs processed at the same time (defaults: 1)',
+                        default=1,
+                        type=int)
+    parser.add_argument('--max_mem',
+                        help='memory used by running pairs in GB (defaults: 80%% of available memory)',
+                        default=None,
+                        type=float)
+    parser.add_argument('--min_free',
+                        help='free space kept in stacking_dir and scratch in GB (defaults: 10)',
+                        default=10,
+                        type=float)
+    parser.add_argument('--scratch',
+                        help='local directory for temporary files of pairs, only products and --keep files are copied back (defaults: None)',
+                        default=None)
+    parser.add_argument('--keep',
+                        help='patterns of extra files copied back from scratch, presets: stamps (StaMPS exporters),\n'
+                        'mintpy (gamma2mintpy.py) or file patterns, e.g. "*.diff.int" (defaults: mintpy)',
+                        nargs='*',
+                        default=['mintpy'])
+    parser.add_argument('--append',
+                        help='only process pairs without unwrapped interferogram (new dates and unfinished pairs)',
+                        action='store_true')
     inps = parser.parse_args()
 
     return inps
@@ -235,6 +68,11 @@ def cmd_line_parser():
 EXAMPLE = """Example:
   ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4
   ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4 --rlks 8 --alks 2
+  ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4 --rlks 8 --alks 2 --jobs 16
+  ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4 --rlks 8 --alks 2 --jobs 16 --max_mem 64 --min_free 50
+  ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4 --rlks 8 --alks 2 --jobs 16 --scratch /tmp
+  ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4 --rlks 8 --alks 2 --jobs 16 --scratch /tmp --keep stamps
+  ./diff_by_number.py /ly/slc /ly/stacking /ly/dem 4 --rlks 8 --alks 2 --jobs 16 --append
 """
 
 
@@ -252,6 +90,12 @@ def gen_ifg_pairs(slc_date, num_connections):
     return ifg_pairs
 
 
+def pair_done(stacking_dir, slc_dir, pair):
+    """whether unwrapped interferogram of pair exists"""
+    unw = pair_files(slc_dir, pair[0:8], pair[9:17])['unw']
+    return os.path.isfile(os.path.join(stacking_dir, pair, unw))
+
+
 def main():
     inps = cmd_line_parser()
     # get inputs
@@ -261,9 +105,22 @@ def main():
     dem_dir = inps.dem_dir
     rlks = inps.rlks
     alks = inps.alks
+    num_jobs = inps.jobs
+    max_mem, min_free = get_budgets(inps.max_mem, inps.min_free)
+    scratch_dir = inps.scratch
+    keep_extra = expand_keep(inps.keep)
+    append = inps.append
 
     slc_dir = os.path.abspath(slc_dir)
     stacking_dir = os.path.abspath(stacking_dir)
+    # pairs run in scratch_dir and write there
+    if scratch_dir:
+        scratch_dir = os.path.abspath(scratch_dir)
+        if not os.path.isdir(scratch_dir):
+            print('{} not exists.'.format(scratch_dir))
+            sys.exit(1)
+    # scratch_dir holds running pairs, stacking_dir the products copied back
+    disk_dir = [scratch_dir, stacking_dir] if scratch_dir else stacking_dir
     dem_dir = os.path.abspath(dem_dir)
 
     # check dem and dem.par
@@ -289,33 +146,47 @@ def main():
 
     # generate ifg_pair
     ifg_pairs = gen_ifg_pairs(slc_date, num_connections)
-
+    # pairs of new dates and unfinished pairs only, geometry of old references is reused
+    if append:
+        new_pairs = [
+            i for i in ifg_pairs if not pair_done(stacking_dir, slc_dir, i)
+        ]
+        print('{} pairs done, {} pairs to process.'.format(
+            len(ifg_pairs) - len(new_pairs), len(new_pairs)))
+        ifg_pairs = new_pairs
+
+    # compute geometry once for every reference date
+    m_dates = [i[0:8] for i in ifg_pairs]
+    failed_dates = prep_geometry(stacking_dir, slc_dir, m_dates, dem, dem_par,
+                                 rlks, alks, num_jobs, max_mem, min_free)
+
+    jobs = []
+    costs = {}
     for i in ifg_pairs:
+        if i[0:8] in failed_dates:
+            print('skip {}, geometry of {} failed.'.format(i, i[0:8]))
+            continue
+
         # make ifg_pair dir
         path = os.path.join(stacking_dir, i)
         if not os.path.isdir(path):
             os.mkdir(path)
 
-        # write dinsar script
         m_date = i[0:8]
         s_date = i[9:17]
-
-        str_m_date = f"m_date={m_date}\n"
-        str_s_date = f"s_date={s_date}\n"
-        str_slc_dir = f"slc_dir={slc_dir}\n"
-        str_dem = f"dem={dem}\n"
-        str_dem_par = f"dem_par={dem_par}\n"
-        str_rlks = f"rlks={rlks}\n"
-        str_alks = f"alks={alks}\n"
-
-        out_script = '#!/bin/sh\n\n' + str_m_date + str_s_date + str_slc_dir + str_dem + str_dem_par + str_rlks + str_alks + dinsar_script
-        out_script_path = os.path.join(path, i + '_DInSAR.sh')
-        with open(out_script_path, 'w+') as f:
-            f.write(out_script)
-        # run dinsar script
-        os.chdir(path)
-        call_str = 'sh ' + i + '_DInSAR.sh'
-        os.system(call_str)
+        geo_dir = get_geo_dir(stacking_dir, m_date)
+        pl = dinsar_pipeline(path, slc_dir, geo_dir, m_date, s_date, rlks,
+                             alks, keep_extra=keep_extra)
+        # write dinsar script for reference
+        pl.write_script(os.path.join(path, i + '_DInSAR.sh'))
+        jobs.append((i, pl, scratch_dir))
+        costs[i] = pair_cost(slc_dir, m_date, s_date, rlks, alks,
+                             keep_extra)
+
+    # run dinsar scripts
+    results = run_jobs(run_pipeline, jobs, num_jobs, costs, max_mem,
+                       disk_dir, min_free)
+    print_summary(results)
 
 
 if __name__ == "__main__":
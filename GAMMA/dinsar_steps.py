@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#####################################################################
+# GAMMA D-InSAR processing of one interferogram as pipeline steps  #
+# Copyright (c) 2021, Lei Yuan                                     #
+#####################################################################
+
+import fnmatch
+import os
+
+from job_pool import read_image_size
+from pipeline import Pipeline
+
+# memory of SLC_interp and SLC_intf as part of SLC size
+SLC_MEM_FACTOR = 0.5
+# memory of adf and mcf per multi-looked pixel
+MLI_MEM_BYTES = 64
+# size of files (int, flt, diff, unw, cc, bmp ...) per multi-looked pixel
+MLI_DISK_BYTES = 120
+# size of KEEP_FILES per multi-looked pixel, and of every extra pattern kept
+KEEP_DISK_BYTES = 32
+EXTRA_DISK_BYTES = 8
+
+# final products copied back when pairs run in scratch directory,
+# other files needed later are added by keep_extra (--keep)
+KEEP_FILES = [
+    '*.diff.int.sm', '*.unw', '*.cc', '*.base', '*.off', '*.diff.par'
+]
+# geometry of reference linked into pair directories
+GEO_KEEP_FILES = ['*.rdc_hgt', 'lookup_fine', 'dem_seg', 'dem_seg.par']
+# --keep presets, files read by the exporters besides KEEP_FILES
+# (StaMPS/GAMMA2StaMPS/*.py and MintPy/gamma2mintpy.py)
+KEEP_PRESETS = {
+    'stamps': ['*.diff.int', '*.pwr1', '*.pwr1.par', '*.pwr2', '*.pwr2.par',
+               '*.corr'] + GEO_KEEP_FILES,
+    'mintpy': ['*.pwr1.par', '*.pwr2.par'] + GEO_KEEP_FILES
+}
+
+
+def expand_keep(patterns):
+    """patterns of --keep with presets (stamps, mintpy) replaced by their files"""
+    keep = []
+    for p in patterns or []:
+        for i in KEEP_PRESETS.get(p.lower(), [p]):
+            if i not in keep:
+                keep.append(i)
+    return keep
+
+
+def awk_par(keyword, par_file):
+    """shell substitution reading value of keyword from GAMMA parameter file"""
+    return "$(awk '$1 == \"%s:\" {print $2}' %s)" % (keyword, par_file)
+
+
+def pair_files(slc_dir, m_date, s_date):
+    """names of files used by one interferogram"""
+    ifg = m_date + '-' + s_date
+    m_slc = os.path.join(slc_dir, m_date, m_date + '.slc')
+    s_slc = os.path.join(slc_dir, s_date, s_date + '.slc')
+    f = {
+        'ifg': ifg,
+        'm_slc': m_slc,
+        's_slc': s_slc,
+        'm_par': m_slc + '.par',
+        's_par': s_slc + '.par',
+        'off': ifg + '.off',
+        'rslc': s_date + '.rslc',
+        'rslc_par': s_date + '.rslc.par',
+        'pwr1': ifg + '.pwr1',
+        'pwr1_par': m_date + '.pwr1.par',
+        'pwr2': ifg + '.pwr2',
+        'pwr2_par': s_date + '.pwr2.par',
+        'int': ifg + '.int',
+        'base': ifg + '.base',
+        'flt': ifg + '.flt',
+        'corr': ifg + '.corr',
+        'diff_par': ifg + '.diff.par',
+        'rdc_hgt': ifg + '.rdc_hgt',
+        'sim_unw': ifg + '.sim_unw',
+        'diff': ifg + '.diff.int',
+        'diff_sm': ifg + '.diff.int.sm',
+        'diff_cc': ifg + '.diff.sm.cc',
+        'mask': ifg + '.sm.cc_mask.bmp',
+        'unw': ifg + '.diff.int.sm.unw',
+        'sub_unw': ifg + '.diff.int.sm.sub.unw',
+    }
+    f['width'] = awk_par('interferogram_width', f['off'])
+    f['line'] = awk_par('interferogram_azimuth_lines', f['off'])
+    return f
+
+
+def pair_cost(slc_dir, m_date, s_date, rlks, alks, keep_extra=None):
+    """estimated peak memory, disk and kept products (bytes) of one interferogram
+
+    kept products are what stays in stacking_dir when run in scratch directory.
+    """
+    f = pair_files(slc_dir, m_date, s_date)
+    try:
+        # resampled slave has the size of master
+        slc_bytes, pixels = read_image_size(f['m_par'])
+    except (OSError, KeyError, TypeError, ValueError):
+        return 0, 0, 0
+    mli_pixels = pixels / (rlks * alks)
+    mem = SLC_MEM_FACTOR * slc_bytes + MLI_MEM_BYTES * mli_pixels
+    disk = slc_bytes + MLI_DISK_BYTES * mli_pixels
+    kept = KEEP_DISK_BYTES * mli_pixels
+    for p in keep_extra or []:
+        if fnmatch.fnmatch(f['rslc'], p):
+            kept += slc_bytes
+        # geometry links and parameter files are small
+        elif p not in GEO_KEEP_FILES and not p.endswith('.par'):
+            kept += EXTRA_DISK_BYTES * mli_pixels
+    return mem, disk, kept
+
+
+def add_ifg_steps(pl, f, rlks, alks):
+    """coregistration, interferogram, flattening and coherence"""
+    ifg, off, width = f['ifg'], f['off'], f['width']
+    m_slc, s_slc, m_par, s_par = f['m_slc'], f['s_slc'], f['m_par'], f['s_par']
+    # create offset parameter file
+    # scene title, initial offsets, number of offset measurements, search window sizes, SNR threshold
+    pl.add('create_offset',
+           f"create_offset {m_par} {s_par} {off} 1 1 1",
+           [m_par, s_par], [off],
+           stdin=f"{ifg}\n 0 0\n 32 32\n 64 64\n 7.0\n 0\n\n")
+    # first guess of the offsets based on orbital information
+    pl.add('init_offset_orbit', f"init_offset_orbit {m_par} {s_par} {off}",
+           [m_par, s_par, off], [off])
+    # improve the first guess with multi-looking and then at single look resolution
+    pl.add('init_offset_ml',
+           f"init_offset {m_slc} {s_slc} {m_par} {s_par} {off} 9 10",
+           [m_slc, s_slc, m_par, s_par, off], [off])
+    pl.add('init_offset',
+           f"init_offset {m_slc} {s_slc} {m_par} {s_par} {off} 1 1",
+           [m_slc, s_slc, m_par, s_par, off], [off])
+    # estimation of offsets and the bilinear registration offset polynomial
+    offs, snr, offsets = ifg + '.offs', ifg + '.off.snr', ifg + '.offsets'
+    coffs, coffsets = ifg + '.coffs', ifg + '.coffsets'
+    pl.add('offset_pwr',
+           f"offset_pwr {m_slc} {s_slc} {m_par} {s_par} {off} {offs} {snr} 256 256 {offsets} 1 100 100 7.0 2",
+           [m_slc, s_slc, m_par, s_par, off], [offs, snr, offsets])
+    pl.add('offset_fit',
+           f"offset_fit {offs} {snr} {off} {coffs} {coffsets} 9 4 0",
+           [offs, snr, off], [off, coffs, coffsets])
+    pl.add('copy_offsets',
+           f"cp {offsets} offsets_datewr_1 && cp {coffsets} coffsets_datewr_1",
+           [offsets, coffsets], ['offsets_datewr_1', 'coffsets_datewr_1'])
+    # resample slc
+    rslc, rslc_par = f['rslc'], f['rslc_par']
+    pl.add('SLC_interp',
+           f"SLC_interp {s_slc} {m_par} {s_par} {off} {rslc} {rslc_par}",
+           [s_slc, m_par, s_par, off], [rslc, rslc_par])
+    # generation of interferogram with multi-look factors rlks * alks
+    pl.add('SLC_intf',
+           f"SLC_intf {m_slc} {rslc} {m_par} {rslc_par} {off} {f['int']} {rlks} {alks} - - 1 1",
+           [m_slc, rslc, m_par, rslc_par, off], [off, f['int']])
+    # generation of multi-look SAR intensity images
+    pl.add('multi_look_m',
+           f"multi_look {m_slc} {m_par} {f['pwr1']} {f['pwr1_par']} {rlks} {alks}",
+           [m_slc, m_par], [f['pwr1'], f['pwr1_par']])
+    pl.add('multi_look_s',
+           f"multi_look {rslc} {rslc_par} {f['pwr2']} {f['pwr2_par']} {rlks} {alks}",
+           [rslc, rslc_par], [f['pwr2'], f['pwr2_par']])
+    pl.add('rasmph_pwr_int',
+           f"rasmph_pwr {f['int']} {f['pwr1']} {width} 1 1 0 1 1 1. 0.35 1 {ifg}.intandpwr.bmp",
+           [f['int'], f['pwr1'], off], [ifg + '.intandpwr.bmp'])
+    pl.add('raspwr_pwr1',
+           f"raspwr {f['pwr1']} {width} 1 0 1 1 1. 0.35 1 {ifg}.pwr1.bmp",
+           [f['pwr1'], off], [ifg + '.pwr1.bmp'])
+    pl.add('raspwr_pwr2',
+           f"raspwr {f['pwr2']} {width} 1 0 1 1 1. 0.35 1 {ifg}.pwr2.bmp",
+           [f['pwr2'], off], [ifg + '.pwr2.bmp'])
+    # baseline
+    pl.add('base_init',
+           f"base_init {m_par} {s_par} {off} {f['int']} {f['base']} 0 1024 1024",
+           [m_par, s_par, off, f['int']], [f['base']])
+    pl.add('base_perp',
+           f"base_perp {f['base']} {m_par} {off} > {f['base']}.perp",
+           [f['base'], m_par, off], [f['base'] + '.perp'])
+    # curved earth phase trend removal ("flattening")
+    pl.add('ph_slope_base',
+           f"ph_slope_base {f['int']} {m_par} {off} {f['base']} {f['flt']} 1 0",
+           [f['int'], m_par, off, f['base']], [f['flt']])
+    pl.add('rasmph_pwr_flt',
+           f"rasmph_pwr {f['flt']} {f['pwr1']} {width} 1 1 0 1 1 1. 0.35 1 {ifg}.fltandpwr.bmp",
+           [f['flt'], f['pwr1'], off], [ifg + '.fltandpwr.bmp'])
+    pl.add('cc_wave',
+           f"cc_wave {f['int']} {m_par} {rslc_par} {f['corr']} {width} - - 3",
+           [f['int'], m_par, rslc_par, off], [f['corr']])
+
+
+def add_flt_filter_steps(pl, f):
+    """filter flattened interferogram"""
+    ifg, off, width = f['ifg'], f['off'], f['width']
+    flt = f['flt']
+    pl.add('adf_flt_1',
+           f"adf {flt} {flt}.sm1 {ifg}.sm.cc1 {width} 0.3 128",
+           [flt, off], [flt + '.sm1', ifg + '.sm.cc1'])
+    pl.add('adf_flt_2',
+           f"adf {flt}.sm1 {flt}.sm2 {ifg}.sm.cc2 {width} 0.3 64",
+           [flt + '.sm1', off], [flt + '.sm2', ifg + '.sm.cc2'])
+    pl.add('adf_flt_3',
+           f"adf {flt}.sm2 {flt}.sm {ifg}.sm.cc {width} 0.3",
+           [flt + '.sm2', off], [flt + '.sm', ifg + '.sm.cc'])
+    pl.add('rasmph_pwr_flt_sm',
+           f"rasmph_pwr {flt}.sm {f['pwr1']} {width} 1 1 0 1 1 1. 0.35 1 {ifg}.fltsmpwr.bmp",
+           [flt + '.sm', f['pwr1'], off], [ifg + '.fltsmpwr.bmp'])
+
+
+def add_diff_steps(pl, f, m_date, geo_dir):
+    """differential interferogram using geometry of reference date in geo_dir"""
+    ifg, off, width = f['ifg'], f['off'], f['width']
+    # link dem_seg, lookup_fine and rdc_hgt computed once for the stack
+    links = [('dem_seg', 'dem_seg'), ('dem_seg.par', 'dem_seg.par'),
+             ('lookup_fine', 'lookup_fine'),
+             (m_date + '.rdc_hgt', f['rdc_hgt'])]
+    for src, dst in links:
+        src = os.path.join(geo_dir, src)
+        pl.add('link_' + dst, f"ln -sf {src} {dst}", [src], [dst])
+    # create a parameter file including the differential interferogram parameters
+    pl.add('create_diff_par',
+           f"create_diff_par {off} - {f['diff_par']} 0",
+           [off], [f['diff_par']],
+           stdin=f"{ifg}\n 0 0\n 64 64\n 256 256\n 7.0\n")
+    # simulation of unwrapped topographic phase
+    pl.add('phase_sim',
+           f"phase_sim {f['m_par']} {off} {f['base']} {f['rdc_hgt']} {f['sim_unw']} 0 0 - -",
+           [f['m_par'], off, f['base'], f['rdc_hgt']], [f['sim_unw']])
+    # subtracting the simulated unwrapped phase from the complex interferogram
+    pl.add('sub_phase',
+           f"sub_phase {f['int']} {f['sim_unw']} {f['diff_par']} {f['diff']} 1 0",
+           [f['int'], f['sim_unw'], f['diff_par']], [f['diff']])
+    pl.add('rasmph_diff',
+           f"rasmph {f['diff']} {width} 1 0 1 1 1. 0.35 1 {f['diff']}.bmp",
+           [f['diff'], off], [f['diff'] + '.bmp'])
+    pl.add('rasmph_pwr_diff',
+           f"rasmph_pwr {f['diff']} {f['pwr1']} {width} 1 1 0 1 1 1. 0.35 1 {f['diff']}.pwr.bmp",
+           [f['diff'], f['pwr1'], off], [f['diff'] + '.pwr.bmp'])
+
+
+def add_unw_steps(pl, f):
+    """filter, unwrap and remove linear phase trends of differential interferogram"""
+    ifg, off, width = f['ifg'], f['off'], f['width']
+    diff, diff_sm, diff_cc = f['diff'], f['diff_sm'], f['diff_cc']
+    pwr1, sm_cc = f['pwr1'], ifg + '.sm.cc'
+    # filter differential interferogram
+    pl.add('adf_diff_1',
+           f"adf {diff} {diff}.sm1 {ifg}.diff.sm.cc1 {width} 0.3 128",
+           [diff, off], [diff + '.sm1', ifg + '.diff.sm.cc1'])
+    pl.add('adf_diff_2',
+           f"adf {diff}.sm1 {diff}.sm2 {ifg}.diff.sm.cc2 {width} 0.3 64",
+           [diff + '.sm1', off], [diff + '.sm2', ifg + '.diff.sm.cc2'])
+    pl.add('adf_diff_3',
+           f"adf {diff}.sm2 {diff_sm} {diff_cc} {width} 0.3",
+           [diff + '.sm2', off], [diff_sm, diff_cc])
+    pl.add('rasmph_diff_sm',
+           f"rasmph {diff_sm} {width} 1 0 1 1 1. 0.35 1 {diff_sm}.bmp",
+           [diff_sm, off], [diff_sm + '.bmp'])
+    pl.add('rasmph_pwr_diff_sm',
+           f"rasmph_pwr {diff_sm} {pwr1} {width} 1 1 0 1 1 1. 0.35 1 {diff_sm}.pwr.bmp",
+           [diff_sm, pwr1, off], [diff_sm + '.pwr.bmp'])
+    # unwrap differential flattened interferogram
+    pl.add('rascc_mask',
+           f"rascc_mask {f['corr']} {pwr1} {width} 1 1 0 1 1 0.0 0. .1 .9 1. .35 1 {f['mask']}",
+           [f['corr'], pwr1, off], [f['mask']])
+    pl.add('mcf',
+           f"mcf {diff_sm} {f['corr']} {f['mask']} {f['unw']} {width} 1 0 0 - - 1 1 - - - 0",
+           [diff_sm, f['corr'], f['mask'], off], [f['unw']])
+    pl.add('rasrmg_unw_pwr',
+           f"rasrmg {f['unw']} {pwr1} {width} 1 1 0 1 1 .6 1. .35 .0 1 {f['unw']}.pwr.bmp {sm_cc} 1 .2",
+           [f['unw'], pwr1, sm_cc, off], [f['unw'] + '.pwr.bmp'])
+    pl.add('rasrmg_unw',
+           f"rasrmg {f['unw']} - {width} 1 1 0 1 1 .5 1. .35 .0 1 {f['unw']}.bmp {sm_cc} 1 .2",
+           [f['unw'], sm_cc, off], [f['unw'] + '.bmp'])
+    # subtracting linear phase trends
+    pl.add('quad_fit',
+           f"quad_fit {f['unw']} {f['diff_par']} 32 32 {f['mask']} {ifg}.plot 3",
+           [f['unw'], f['diff_par'], f['mask']], [f['diff_par'], ifg + '.plot'])
+    pl.add('quad_sub',
+           f"quad_sub {f['unw']} {f['diff_par']} {f['sub_unw']} 0 0",
+           [f['unw'], f['diff_par']], [f['sub_unw']])
+    pl.add('rasrmg_sub_unw_pwr',
+           f"rasrmg {f['sub_unw']} {pwr1} {width} 1 1 0 1 1 .6 1. .35 .0 1 {f['sub_unw']}.pwr.bmp {sm_cc} 1 .2",
+           [f['sub_unw'], pwr1, sm_cc, off], [f['sub_unw'] + '.pwr.bmp'])
+    pl.add('rasrmg_sub_unw',
+           f"rasrmg {f['sub_unw']} - {width} 1 1 0 1 1 .5 1. .35 .0 1 {f['sub_unw']}.bmp {sm_cc} 1 .2",
+           [f['sub_unw'], sm_cc, off], [f['sub_unw'] + '.bmp'])
+
+
+def dinsar_pipeline(ifg_dir, slc_dir, geo_dir, m_date, s_date, rlks, alks,
+                    unwrap=True, keep_extra=None):
+    """D-InSAR processing of one interferogram (unwrap=False stops after sub_phase)
+
+    keep_extra: patterns of files copied back from scratch besides KEEP_FILES
+    """
+    f = pair_files(slc_dir, m_date, s_date)
+    keep_files = KEEP_FILES + list(keep_extra or [])
+    # resampled slave is deleted after unwrapping, in scratch directory it is
+    # deleted anyway unless kept by keep_extra
+    temp_files = [f['rslc']] if unwrap else []
+    pl = Pipeline(ifg_dir,
+                  os.path.basename(ifg_dir) + '_DInSAR',
+                  temp_files=temp_files,
+                  keep_files=keep_files,
+                  tag=f['ifg'])
+    add_ifg_steps(pl, f, rlks, alks)
+    if unwrap:
+        add_flt_filter_steps(pl, f)
+    add_diff_steps(pl, f, m_date, geo_dir)
+    if unwrap:
+        add_unw_steps(pl, f)
+    return pl
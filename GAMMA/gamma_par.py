@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#####################################################################
+# Parsed GAMMA parameter files (.par, .off, .diff.par, dem_seg.par) #
+# shared by all tools, parsed once and cached until file changes   #
+# Copyright (c) 2021, Lei Yuan                                     #
+#####################################################################
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# number of parsed files kept in memory
+PAR_CACHE_SIZE = 512
+
+INT_RE = re.compile(r'^[-+]?\d+$')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def to_number(token):
+    """int or float of token, None if not a number"""
+    if INT_RE.match(token):
+        return int(token)
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+class ParFile(object):
+    """keyword: value pairs of GAMMA parameter file
+
+    par['range_samples'] -> 4000, par['corner_lat'] -> 34.5 (units dropped),
+    par['state_vector_position_1'] -> [x, y, z], text fields stay str.
+    """
+
+    def __init__(self, par_file):
+        self.par_file = par_file
+        self.lines = []
+        self.raw_values = OrderedDict()
+        self.values = OrderedDict()
+        self.units = {}
+        with open(par_file, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                self.lines.append(line)
+                if ':' not in line:
+                    continue
+                key, value = line.split(':', 1)
+                key = key.strip()
+                if not key or ' ' in key:
+                    continue
+                value = value.strip()
+                self.raw_values[key] = value
+                self.values[key], self.units[key] = self.parse_value(value)
+
+    @staticmethod
+    def parse_value(value):
+        """numbers at the beginning of value and the rest as units"""
+        tokens = value.split()
+        numbers = []
+        for t in tokens:
+            num = to_number(t)
+            if num is None:
+                break
+            numbers.append(num)
+        if not numbers:
+            return value, ''
+        units = ' '.join(tokens[len(numbers):])
+        if len(numbers) == 1:
+            return numbers[0], units
+        return numbers, units
+
+    @staticmethod
+    def strip_key(key):
+        return key.strip().rstrip(':')
+
+    def __getitem__(self, key):
+        return self.values[self.strip_key(key)]
+
+    def __contains__(self, key):
+        return self.strip_key(key) in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(self.strip_key(key), default)
+
+    def raw(self, key, default=''):
+        """text after colon like written in file"""
+        return self.raw_values.get(self.strip_key(key), default)
+
+    def keys(self):
+        return self.values.keys()
+
+    def find(self, keyword):
+        """text after colon of the last line containing keyword exactly once"""
+        value = ''
+        for line in self.lines:
+            if line.count(keyword) == 1:
+                tmp = line.split(':')
+                if len(tmp) > 1:
+                    value = tmp[1].strip()
+        return value
+
+
+def load_par(par_file):
+    """parsed par file, reparsed only if its size or mtime changed"""
+    path = os.path.abspath(par_file)
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _lock:
+        item = _cache.get(path)
+        if item is not None and item[0] == stamp:
+            _cache.move_to_end(path)
+            return item[1]
+    par = ParFile(path)
+    with _lock:
+        _cache[path] = (stamp, par)
+        _cache.move_to_end(path)
+        while len(_cache) > PAR_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return par
+
+
+def load_pars(par_files, num_threads=8):
+    """load all par files of a stack in one pass, return {par_file: ParFile}
+
+    files not exist or unreadable are left out.
+    """
+    par_files = list(par_files)
+
+    def load(par_file):
+        try:
+            return load_par(par_file)
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pars = list(executor.map(load, par_files))
+    return {f: p for f, p in zip(par_files, pars) if p is not None}
+
+
+def read_gamma_par(par_file, keyword):
+    """give a keyword, then get the value (string, as the old helper)"""
+    return load_par(par_file).find(keyword)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
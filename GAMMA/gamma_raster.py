@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#####################################################################
+# Memory-mapped access to GAMMA rasters (big-endian float/fcomplex) #
+# size is read from the companion par, data are read block by      #
+# block so only the needed tiles are loaded                        #
+# Copyright (c) 2021, Lei Yuan                                     #
+#####################################################################
+
+import glob
+import os
+
+import numpy as np
+
+from gamma_par import load_par
+
+# bytes of one block read at a time
+BLOCK_BYTES = 64 * 1024 * 1024
+
+# big-endian data types by file name (longest suffix is checked first)
+SUFFIX_DTYPES = {
+    '.slc': '>c8',
+    '.rslc': '>c8',
+    '.int': '>c8',
+    '.flt': '>c8',
+    '.diff.int': '>c8',
+    '.diff.int.sm': '>c8',
+    '.diff.int.gacos': '>c8',
+    '.diff.int.gacos.sm': '>c8',
+    'lookup': '>c8',
+    'lookup_fine': '>c8',
+    '.unw': '>f4',
+    '.cc': '>f4',
+    '.corr': '>f4',
+    '.rdc_hgt': '>f4',
+    '.mli': '>f4',
+    '.pwr1': '>f4',
+    '.pwr2': '>f4',
+    '.sim_unw': '>f4',
+    'dem_seg': '>f4',
+    '.dem': '>f4',
+    'ph_rate': '>f4',
+}
+
+# GAMMA image_format in .slc.par
+FORMAT_DTYPES = {
+    'FCOMPLEX': '>c8',
+    'SCOMPLEX': np.dtype([('real', '>i2'), ('imag', '>i2')]),
+    'FLOAT': '>f4',
+    'SHORT': '>i2',
+    'BYTE': 'u1'
+}
+
+# keywords of width and length in different par files
+SIZE_KEYS = [('range_samples', 'azimuth_lines'), ('range_samp_1', 'az_samp_1'),
+             ('interferogram_width', 'interferogram_azimuth_lines'),
+             ('width', 'nlines')]
+
+
+def get_dtype(path, par=None):
+    """big-endian dtype of GAMMA raster, image_format of par is preferred"""
+    if par is not None and par.get('image_format') in FORMAT_DTYPES:
+        return np.dtype(FORMAT_DTYPES[par['image_format']])
+    name = os.path.basename(path)
+    for suffix in sorted(SUFFIX_DTYPES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return np.dtype(SUFFIX_DTYPES[suffix])
+    return None
+
+
+def find_par(path):
+    """companion par of raster: <file>.par, dem_seg.par, *.diff.par or *.off"""
+    name = os.path.basename(path)
+    dir_name = os.path.dirname(os.path.abspath(path))
+    if os.path.isfile(path + '.par'):
+        return path + '.par'
+    if name.startswith('lookup'):
+        pars = glob.glob(os.path.join(dir_name, 'dem_seg.par'))
+    else:
+        pars = glob.glob(os.path.join(dir_name, '*.diff.par'))
+        if not pars:
+            pars = glob.glob(os.path.join(dir_name, '*.off'))
+    if pars:
+        return pars[0]
+    return None
+
+
+def get_size(par_file):
+    """width and length of raster described by par file"""
+    par = load_par(par_file)
+    for width_key, length_key in SIZE_KEYS:
+        if width_key in par and length_key in par:
+            return int(par[width_key]), int(par[length_key])
+    raise ValueError('cannot find width and length in {}'.format(par_file))
+
+
+def open_raster(path, par_file=None, dtype=None, width=None, length=None,
+                mode='r'):
+    """np.memmap (length, width) of GAMMA raster, nothing is read until used"""
+    par = None
+    if width is None:
+        if par_file is None:
+            par_file = find_par(path)
+        if par_file is None:
+            raise ValueError('cannot find par file of {}'.format(path))
+        width, length = get_size(par_file)
+        par = load_par(par_file)
+    if dtype is None:
+        dtype = get_dtype(path, par)
+    if dtype is None:
+        raise ValueError('unknown data type of {}'.format(path))
+    dtype = np.dtype(dtype)
+    file_length = os.path.getsize(path) // (width * dtype.itemsize)
+    if length is None:
+        length = file_length
+    if file_length < length:
+        raise ValueError('{} is smaller than {}x{} {}'.format(
+            path, width, length, dtype))
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(length, width))
+
+
+def create_raster(path, width, length, dtype='>f4'):
+    """new raster opened for writing"""
+    return np.memmap(path, dtype=dtype, mode='w+', shape=(length, width))
+
+
+def block_lines(width, dtype, block_bytes=BLOCK_BYTES):
+    """number of lines in one block"""
+    return max(1, block_bytes // (width * np.dtype(dtype).itemsize))
+
+
+def iter_blocks(length, lines):
+    """(start, end) lines of blocks"""
+    for start in range(0, length, lines):
+        yield start, min(start + lines, length)
+
+
+def iter_windows(raster, lines=None, cols=None):
+    """(row, col, data) of windows of raster, data is read on iteration"""
+    length, width = raster.shape
+    if lines is None:
+        lines = block_lines(width if cols is None else cols, raster.dtype)
+    if cols is None:
+        cols = width
+    for r0, r1 in iter_blocks(length, lines):
+        for c0, c1 in iter_blocks(width, cols):
+            yield r0, c0, np.array(raster[r0:r1, c0:c1])
+
+
+def read_window(path, row, col, lines, cols, par_file=None):
+    """read only a window of raster"""
+    raster = open_raster(path, par_file)
+    return np.array(raster[row:row + lines, col:col + cols])
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+##############################################################
+# Run independent GAMMA jobs concurrently with per-job logs  #
+# jobs are admitted while estimated memory and disk (scratch #
+# and products) of running jobs stay under budgets           #
+# Copyright (c) 2021, Lei Yuan                               #
+##############################################################
+
+import os
+import shutil
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from gamma_par import load_par
+
+# bytes per pixel of GAMMA image formats
+PIXEL_BYTES = {'FCOMPLEX': 8, 'SCOMPLEX': 4, 'FLOAT': 4, 'SHORT': 2, 'BYTE': 1}
+
+
+def run_script(name, work_dir, script, log_file):
+    """run shell script in work_dir, write stdout and stderr into log_file"""
+    with open(log_file, 'w') as f:
+        p = subprocess.run(['sh', script],
+                           cwd=work_dir,
+                           stdout=f,
+                           stderr=subprocess.STDOUT)
+    return p.returncode
+
+
+def run_jobs(func, jobs, num_jobs=1, costs=None, max_mem=None,
+             disk_dir=None, min_free=0):
+    """call func(*job) for every job (job[0] is the name), return {name: exit code}
+
+    costs is {name: (memory, disk, ...)} in bytes, a job is started only if
+    memory of running jobs stays under max_mem and free space of disk_dir minus
+    disk still needed by running jobs stays above min_free. disk_dir may be a
+    list of directories (e.g. scratch and stacking), costs then have one disk
+    value for each of them.
+    """
+    results = {}
+    total = len(jobs)
+    if num_jobs <= 1:
+        for job in jobs:
+            try:
+                code = func(*job)
+            except Exception as e:
+                print(e)
+                code = -1
+            results[job[0]] = code
+            print_progress(len(results), total, job[0], code)
+        return results
+
+    costs = costs or {}
+    pending = list(jobs)
+    running = {}
+    with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+        while pending or running:
+            # start jobs in order while they fit into budgets
+            while pending and len(running) < num_jobs:
+                name = pending[0][0]
+                cost = costs.get(name, (0, 0))
+                mem, disk = cost[0], cost[1:]
+                if not fit_budgets(mem, disk, running.values(), max_mem,
+                                   disk_dir, min_free):
+                    if running:
+                        break
+                    # never wait for nothing
+                    print('{} exceeds memory or disk budget, run it alone.'.
+                          format(name))
+                job = pending.pop(0)
+                future = executor.submit(func, *job)
+                running[future] = (name, mem, disk)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)[0]
+                try:
+                    code = future.result()
+                except Exception as e:
+                    print(e)
+                    code = -1
+                results[name] = code
+                print_progress(len(results), total, name, code)
+    return results
+
+
+def fit_budgets(mem, disk, running, max_mem, disk_dir, min_free):
+    """whether job with cost (mem, disk) can start beside running jobs
+
+    disk is one value or a tuple of values for the directories in disk_dir,
+    costs of directories on the same file system are added.
+    """
+    if max_mem and sum(r[1] for r in running) + mem > max_mem:
+        return False
+    if not disk_dir:
+        return True
+    dirs = [disk_dir] if isinstance(disk_dir, str) else list(disk_dir)
+    devs = [os.stat(d).st_dev for d in dirs]
+    costs = [disk] + [r[2] for r in running]
+    costs = [c if isinstance(c, (tuple, list)) else (c, ) for c in costs]
+    for d, dev in zip(dirs, devs):
+        need = sum(c[i] for c in costs for i in range(min(len(c), len(dirs)))
+                   if devs[i] == dev)
+        if shutil.disk_usage(d).free - need < min_free:
+            return False
+    return True
+
+
+def read_image_size(par_file):
+    """bytes and pixels of image described by .slc.par or .mli.par"""
+    par = load_par(par_file)
+    pixels = par['range_samples'] * par['azimuth_lines']
+    pixel_bytes = PIXEL_BYTES.get(par.get('image_format'), 8)
+    return pixels * pixel_bytes, pixels
+
+
+def get_mem_available():
+    """available memory in bytes"""
+    if os.path.isfile('/proc/meminfo'):
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+
+
+def get_budgets(max_mem, min_free):
+    """memory budget (defaults: 80% of available) and free disk to keep in bytes from GB"""
+    if max_mem:
+        max_mem = max_mem * 2**30
+    else:
+        max_mem = get_mem_available() * 0.8
+    return max_mem, min_free * 2**30
+
+
+def print_progress(num, total, name, code):
+    status = 'done' if code == 0 else 'failed (exit code {})'.format(code)
+    print('[{}/{}] {} {}'.format(num, total, name, status))
+
+
+def print_summary(results):
+    """print number of succeeded jobs and names of failed jobs"""
+    failed = sorted(name for name, code in results.items() if code != 0)
+    print('\n{}/{} jobs succeeded.'.format(
+        len(results) - len(failed), len(results)))
+    if failed:
+        print('failed jobs:')
+        for name in failed:
+            print('  {} (exit code {})'.format(name, results[name]))
+    return failed
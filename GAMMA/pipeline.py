@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#####################################################################
+# Incremental step graph for GAMMA processing                      #
+# each step declares its inputs and outputs, steps whose outputs   #
+# are up to date (recorded in a manifest) are skipped when rerun   #
+# optionally run in a local scratch directory, copy back products  #
+# Copyright (c) 2021, Lei Yuan                                     #
+#####################################################################
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from cmd_runner import run_cmd
+
+# files smaller than this are fingerprinted by content, others by size and mtime
+HASH_SIZE_LIMIT = 1024 * 1024
+
+
+def fingerprint(path):
+    """content hash of small file, size and mtime of big file, None if not exists"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if st.st_size <= HASH_SIZE_LIMIT:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            md5.update(f.read())
+        return 'md5:' + md5.hexdigest()
+    return 'stat:{}:{}'.format(st.st_size, st.st_mtime_ns)
+
+
+class Step(object):
+    def __init__(self, name, cmd, inputs=None, outputs=None, stdin=None):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs or [])
+        self.stdin = stdin
+
+    def key(self, tokens):
+        """hash of command and versions of all inputs"""
+        sha1 = hashlib.sha1()
+        sha1.update(self.cmd.encode())
+        sha1.update((self.stdin or '').encode())
+        for path in self.inputs:
+            sha1.update('{}={}'.format(path, tokens.get(path)).encode())
+        return sha1.hexdigest()
+
+
+class Pipeline(object):
+    """ordered GAMMA steps run in work_dir with a manifest of finished steps"""
+
+    def __init__(self,
+                 work_dir,
+                 name,
+                 log_file=None,
+                 temp_files=None,
+                 keep_files=None,
+                 tag=None):
+        self.work_dir = work_dir
+        self.name = name
+        # tag of profile records, kept when running in scratch directory
+        self.tag = tag or os.path.basename(os.path.normpath(work_dir))
+        self.steps = []
+        self.temp_files = list(temp_files or [])
+        # patterns of products copied back from scratch directory (None: all)
+        self.keep_files = keep_files
+        self.manifest_file = os.path.join(work_dir, name + '.manifest.json')
+        if log_file is None:
+            log_file = os.path.join(work_dir, name + '.log')
+        self.log_file = log_file
+
+    def add(self, name, cmd, inputs=None, outputs=None, stdin=None):
+        if name in [s.name for s in self.steps]:
+            raise ValueError('step {} already exists.'.format(name))
+        self.steps.append(Step(name, cmd, inputs, outputs, stdin))
+
+    def abspath(self, path):
+        return os.path.join(self.work_dir, path)
+
+    def load_manifest(self):
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    return json.load(f)
+            except ValueError:
+                pass
+        return {'steps': {}, 'files': {}}
+
+    def save_manifest(self, manifest):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
+
+    def output_ok(self, path, manifest):
+        """output exists and wasn't changed since recorded"""
+        recorded = manifest['files'].get(path)
+        fp = fingerprint(self.abspath(path))
+        if fp is None:
+            # temporary files removed after a finished run are fine
+            return recorded is not None and path in self.temp_files
+        return fp == recorded
+
+    def check(self, manifest, forced):
+        """forward pass, return names of steps needing to run"""
+        tokens = {}
+        stale = []
+        for step in self.steps:
+            # files not produced by previous steps are versioned by fingerprint
+            for path in step.inputs:
+                if path not in tokens:
+                    tokens[path] = fingerprint(self.abspath(path))
+            key = step.key(tokens)
+            record = manifest['steps'].get(step.name)
+            current = step.name not in forced and record is not None and \
+                record['key'] == key and \
+                all(self.output_ok(p, manifest) for p in step.outputs)
+            if current:
+                token = record['token']
+            else:
+                stale.append(step.name)
+                token = '{}:{}'.format(key, time.time())
+            for path in step.outputs:
+                tokens[path] = token
+        return stale
+
+    def plan(self, manifest):
+        """steps to run, rerun producers of missing temporary inputs"""
+        forced = set()
+        while True:
+            stale = self.check(manifest, forced)
+            producer = {}
+            need = set()
+            for step in self.steps:
+                if step.name in stale:
+                    for path in step.inputs:
+                        missing = not os.path.exists(self.abspath(path))
+                        if missing and path in producer and \
+                                producer[path] not in stale:
+                            need.add(producer[path])
+                for path in step.outputs:
+                    producer.setdefault(path, step.name)
+            if not need - forced:
+                return stale
+            forced |= need
+
+    def is_kept(self, path):
+        if self.keep_files is None:
+            return True
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(name, p) for p in self.keep_files)
+
+    def run_scratch(self, scratch_dir):
+        """run in temporary directory under scratch_dir, copy back kept products"""
+        work_dir = self.work_dir
+        manifest_file = self.manifest_file
+        log_file = self.log_file
+        temp_files = self.temp_files
+        outputs = []
+        inputs = []
+        for step in self.steps:
+            for path in step.inputs:
+                if path not in outputs and path not in inputs and \
+                        not os.path.isabs(path):
+                    inputs.append(path)
+            for path in step.outputs:
+                if path not in outputs and not os.path.isabs(path):
+                    outputs.append(path)
+        kept = [p for p in outputs if self.is_kept(p)]
+        tmp_dir = tempfile.mkdtemp(prefix=self.name + '_', dir=scratch_dir)
+        try:
+            # products, manifest and log of previous runs
+            for path in kept + [manifest_file, log_file]:
+                copy_file(os.path.join(work_dir, path), tmp_dir)
+            # inputs found in work_dir are linked
+            for path in inputs:
+                src = os.path.join(work_dir, path)
+                if os.path.exists(src):
+                    os.symlink(src, os.path.join(tmp_dir, path))
+            self.work_dir = tmp_dir
+            self.manifest_file = os.path.join(
+                tmp_dir, os.path.basename(manifest_file))
+            self.log_file = os.path.join(tmp_dir, os.path.basename(log_file))
+            # files not copied back are temporary
+            self.temp_files = temp_files + [
+                p for p in outputs if p not in kept and p not in temp_files
+            ]
+            code = self.run()
+            for path in kept:
+                copy_file(os.path.join(tmp_dir, path), work_dir)
+            copy_file(self.manifest_file, os.path.dirname(manifest_file))
+            copy_file(self.log_file, os.path.dirname(log_file))
+        finally:
+            self.work_dir = work_dir
+            self.manifest_file = manifest_file
+            self.log_file = log_file
+            self.temp_files = temp_files
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return code
+
+    def run(self):
+        """run steps not up to date, return exit code of the first failed step"""
+        manifest = self.load_manifest()
+        stale = self.plan(manifest)
+        tokens = {}
+        with open(self.log_file, 'a') as log:
+            for step in self.steps:
+                for path in step.inputs:
+                    if path not in tokens:
+                        tokens[path] = fingerprint(self.abspath(path))
+                key = step.key(tokens)
+                if step.name not in stale:
+                    token = manifest['steps'][step.name]['token']
+                    for path in step.outputs:
+                        tokens[path] = token
+                    continue
+                log.write('\n### {}: {}\n'.format(step.name, step.cmd))
+                log.flush()
+                code = self.run_step(step, log)
+                if code != 0:
+                    log.write('### {} failed (exit code {})\n'.format(
+                        step.name, code))
+                    manifest['steps'].pop(step.name, None)
+                    self.save_manifest(manifest)
+                    return code
+                token = '{}:{}'.format(key, time.time())
+                manifest['steps'][step.name] = {'key': key, 'token': token}
+                for path in step.outputs:
+                    tokens[path] = token
+                    manifest['files'][path] = fingerprint(self.abspath(path))
+                self.save_manifest(manifest)
+            # delete temporary files to release storage
+            for path in self.temp_files:
+                if os.path.isfile(self.abspath(path)):
+                    os.remove(self.abspath(path))
+        return 0
+
+    def run_step(self, step, log):
+        # empty stdin so interactive programs never wait for input
+        return run_cmd(step.cmd,
+                       cwd=self.work_dir,
+                       tag=self.tag,
+                       stdin=step.stdin or '',
+                       stdout=log,
+                       stderr=subprocess.STDOUT)
+
+    def write_script(self, script_file):
+        """write all steps as shell script for reference"""
+        with open(script_file, 'w+') as f:
+            f.write('#!/bin/sh\nset -e\n\n')
+            f.write('cd {}\n'.format(self.work_dir))
+            for step in self.steps:
+                f.write('\n# {}\n'.format(step.name))
+                if step.stdin is None:
+                    f.write(step.cmd + '\n')
+                else:
+                    f.write("{} <<'EOF'\n{}EOF\n".format(step.cmd, step.stdin))
+            if self.temp_files:
+                f.write('\nrm -f {}\n'.format(' '.join(self.temp_files)))
+
+
+def copy_file(src, dst_dir):
+    """copy file keeping mtime (fingerprint of big files), links are copied as links"""
+    if os.path.islink(src):
+        dst = os.path.join(dst_dir, os.path.basename(src))
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.symlink(os.readlink(src), dst)
+    elif os.path.isfile(src):
+        shutil.copy2(src, dst_dir)
+
+
+def run_pipeline(name, pipeline, scratch_dir=None):
+    """job function for job_pool.run_jobs"""
+    if scratch_dir:
+        return pipeline.run_scratch(scratch_dir)
+    return pipeline.run()
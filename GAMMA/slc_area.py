@@ -10,6 +10,9 @@ import os
 import sys
 import zipfile
 
+from cmd_runner import run_cmd
+from gamma_par import read_gamma_par
+
 EXAMPLE = """Example:
 ./slc_area.py /ly/slc/20201229 /ly/slc/dem /ly/slc/area
 ./slc_area.py /ly/slc/20201229 /ly/slc/dem /ly/slc/area --rlks 28 --alks 7
@@ -43,16 +46,6 @@ def cmdline_parser():
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def main():
     # get inps
     inps = cmdline_parser()
@@ -104,7 +97,7 @@ def main():
     m_mli = os.path.join(out_dir, f"{slc_date}.mli")
     m_mli_par = m_mli + '.par'
     call_str = f"multi_look {slc} {slc_par} {m_mli} {m_mli_par} {rlks} {alks}"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     utm_dem = os.path.join(out_dir, 'dem_seg')
     utm_dem_par = utm_dem + '.par'
@@ -117,51 +110,51 @@ def main():
     pix = os.path.join(out_dir, 'pix')
     ls_map = os.path.join(out_dir, 'ls_map')
     call_str = f"gc_map {m_mli_par} - {dem_par} {dem} {utm_dem_par} {utm_dem} {utm2rdc} 1 1 {sim_sar_utm} {u} {v} {inc} {psi} {pix} {ls_map} 8 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     pix_sigma0 = os.path.join(out_dir, "pix_sigma0")
     pix_gamma0 = os.path.join(out_dir, "pix_gamma0")
     call_str = f"pixel_area {m_mli_par} {utm_dem_par} {utm_dem} {utm2rdc} {ls_map} {inc} {pix_sigma0} {pix_gamma0}"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     pix_gamma0_bmp = pix_gamma0 + '.bmp'
     width_mli = read_gamma_par(m_mli_par, 'range_samples')
     call_str = f"raspwr {pix_gamma0} {width_mli} - - - - - - - {pix_gamma0_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     diff_par = os.path.join(out_dir, f"{slc_date}.diff_par")
     call_str = f"create_diff_par {m_mli_par} - {diff_par} 1 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     offs = os.path.join(out_dir, f"{slc_date}.offs")
     snr = os.path.join(out_dir, f"{slc_date}.snr")
     offsets = os.path.join(out_dir, ".offsets")
     call_str = f"offset_pwrm {pix_sigma0} {m_mli} {diff_par} {offs} {snr} 64 64 {offsets} 2 100 100 5.0"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     coffs = os.path.join(out_dir, "coffs")
     coffsets = os.path.join(out_dir, "coffsets")
     call_str = f"offset_fitm {offs} {snr} {diff_par} {coffs} {coffsets} 5.0 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     width_utm_dem = read_gamma_par(utm_dem_par, 'width')
     utm_to_rdc = os.path.join(out_dir, "lookup_table_fine")
     call_str = f"gc_map_fine {utm2rdc} {width_utm_dem} {diff_par} {utm_to_rdc} 1"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     geo_m_mli = os.path.join(out_dir, f"geo_{slc_date}.mli")
     call_str = f"geocode_back {m_mli} {width_mli} {utm_to_rdc} {geo_m_mli} {width_utm_dem} - 2 0"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     geo_m_mli_bmp = geo_m_mli + '.bmp'
     call_str = f"raspwr {geo_m_mli} {width_utm_dem} 1 0 1 1 1. .35 1 {geo_m_mli_bmp}"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     mli_kml = os.path.basename(geo_m_mli + '.kml')
     geo_m_mli_bmp = os.path.basename(geo_m_mli_bmp)
     os.chdir(out_dir)
     call_str = f"kml_map {geo_m_mli_bmp} {utm_dem_par} {mli_kml}"
-    os.system(call_str)
+    run_cmd(call_str, tag=slc_date)
 
     # unzip bmp and kml
     kmz_name = os.path.basename(geo_m_mli) + '.kmz'
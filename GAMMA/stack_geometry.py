@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+###################################################################
+# Compute geometry (dem_seg, lookup_fine, rdc_hgt) once for each  #
+# reference date of a stack, shared by all of its interferograms  #
+# Copyright (c) 2021, Lei Yuan                                    #
+###################################################################
+
+import os
+
+from job_pool import run_jobs, print_summary, read_image_size
+from pipeline import Pipeline, run_pipeline
+from dinsar_steps import awk_par
+
+# memory of gc_map, offset_pwrm and geocode per multi-looked pixel
+GEO_MEM_BYTES = 32
+# size of pwr, dem_seg, lookup, lookup_fine, sim_sar, rdc_hgt, bmp ... per multi-looked pixel
+GEO_DISK_BYTES = 64
+
+
+def geometry_pipeline(geo_dir, slc_dir, m_date, dem, dem_par, rlks, alks):
+    """steps computing dem_seg, lookup_fine and rdc_hgt for reference date"""
+    m_slc = os.path.join(slc_dir, m_date, m_date + '.slc')
+    m_par = m_slc + '.par'
+    pwr, pwr_par = m_date + '.pwr', m_date + '.pwr.par'
+    diff_par = m_date + '.diff.par'
+    rdc_hgt = m_date + '.rdc_hgt'
+    width = awk_par('range_samples', pwr_par)
+    line = awk_par('azimuth_lines', pwr_par)
+    width_map = awk_par('width', 'dem_seg.par')
+
+    pl = Pipeline(geo_dir,
+                  m_date + '_geometry',
+                  temp_files=['lookup', 'sim_sar', 'offs', 'snr', 'coffs'],
+                  tag=m_date)
+    # multi-look SAR intensity image of reference SLC (same size as interferograms)
+    pl.add('multi_look',
+           f"multi_look {m_slc} {m_par} {pwr} {pwr_par} {rlks} {alks}",
+           [m_slc, m_par], [pwr, pwr_par])
+    pl.add('raspwr_pwr',
+           f"raspwr {pwr} {width} 1 0 1 1 1. 0.35 1 {pwr}.bmp",
+           [pwr, pwr_par], [pwr + '.bmp'])
+    pl.add('gc_map',
+           f"gc_map {pwr_par} - {dem_par} {dem} dem_seg.par dem_seg lookup 1 1 sim_sar - - - - - - 8 1",
+           [pwr_par, dem_par, dem], ['dem_seg.par', 'dem_seg', 'lookup', 'sim_sar'])
+    col_post = awk_par('post_lat', 'dem_seg.par')
+    row_post = awk_par('post_lon', 'dem_seg.par')
+    pl.add('rasshd_dem_seg',
+           f"rasshd dem_seg {width_map} {col_post} {row_post} 1 0 1 1 45. 135. 1 dem_seg.bmp",
+           ['dem_seg', 'dem_seg.par'], ['dem_seg.bmp'])
+    # geocode the simulated SAR intensity image to radar coordinate
+    pl.add('geocode_sim_sar',
+           f"geocode lookup sim_sar {width_map} sim_sar_rdc {width} {line} 1 0",
+           ['lookup', 'sim_sar', 'dem_seg.par', pwr_par], ['sim_sar_rdc'])
+    pl.add('raspwr_sim_sar',
+           f"raspwr sim_sar_rdc {width} 1 0 1 1 1. .35 1 sim_sar_rdc.bmp",
+           ['sim_sar_rdc', pwr_par], ['sim_sar_rdc.bmp'])
+    # compute offset of simulated SAR image to mli image
+    pl.add('create_diff_par', f"create_diff_par {pwr_par} - {diff_par} 1 0",
+           [pwr_par], [diff_par])
+    pl.add('init_offsetm',
+           f"init_offsetm {pwr} sim_sar_rdc {diff_par} 1 1 - - 0 0 7",
+           [pwr, 'sim_sar_rdc', diff_par], [diff_par])
+    pl.add('offset_pwrm_1',
+           f"offset_pwrm {pwr} sim_sar_rdc {diff_par} offs snr 256 256 offsets 2 100 100 7.0 2",
+           [pwr, 'sim_sar_rdc', diff_par], ['offs', 'snr', 'offsets'])
+    pl.add('offset_fitm_1',
+           f"offset_fitm offs snr {diff_par} coffs coffsets 8.0 6",
+           ['offs', 'snr', diff_par], [diff_par, 'coffs', 'coffsets'])
+    pl.add('offset_pwrm_2',
+           f"offset_pwrm {pwr} sim_sar_rdc {diff_par} offs snr 64 64 offsets 2 300 300 9.0 2",
+           [pwr, 'sim_sar_rdc', diff_par], ['offs', 'snr', 'offsets'])
+    pl.add('offset_fitm_2',
+           f"offset_fitm offs snr {diff_par} coffs coffsets 10.0 6",
+           ['offs', 'snr', diff_par], [diff_par, 'coffs', 'coffsets'])
+    # refine lookup table and geocode dem to radar coordinate
+    pl.add('gc_map_fine',
+           f"gc_map_fine lookup {width_map} {diff_par} lookup_fine 0",
+           ['lookup', 'dem_seg.par', diff_par], ['lookup_fine'])
+    pl.add('geocode_dem',
+           f"geocode lookup_fine dem_seg {width_map} {rdc_hgt} {width} {line} 1 0",
+           ['lookup_fine', 'dem_seg', 'dem_seg.par', pwr_par], [rdc_hgt])
+    pl.add('rashgt',
+           f"rashgt {rdc_hgt} {pwr} {width} 1 1 0 1 1 20.0 1. .35 1 {rdc_hgt}_pwr.bmp",
+           [rdc_hgt, pwr, pwr_par], [rdc_hgt + '_pwr.bmp'])
+    return pl
+
+
+def get_geo_dir(stacking_dir, m_date):
+    """directory of geometry files for reference date"""
+    return os.path.join(stacking_dir, 'geometry', m_date)
+
+
+def geometry_cost(slc_dir, m_date, rlks, alks):
+    """estimated peak memory and disk (bytes) of geometry of reference date"""
+    m_par = os.path.join(slc_dir, m_date, m_date + '.slc.par')
+    try:
+        _, pixels = read_image_size(m_par)
+    except (OSError, KeyError, TypeError, ValueError):
+        return 0, 0
+    mli_pixels = pixels / (rlks * alks)
+    return GEO_MEM_BYTES * mli_pixels, GEO_DISK_BYTES * mli_pixels
+
+
+def prep_geometry(stacking_dir, slc_dir, m_dates, dem, dem_par, rlks, alks,
+                  num_jobs=1, max_mem=None, min_free=0):
+    """compute geometry for every reference date, return dates failed"""
+    jobs = []
+    costs = {}
+    for m_date in sorted(set(m_dates)):
+        geo_dir = get_geo_dir(stacking_dir, m_date)
+        if not os.path.isdir(geo_dir):
+            os.makedirs(geo_dir)
+        pl = geometry_pipeline(geo_dir, slc_dir, m_date, dem, dem_par, rlks,
+                               alks)
+        pl.write_script(os.path.join(geo_dir, m_date + '_geometry.sh'))
+        jobs.append((m_date, pl))
+        costs[m_date] = geometry_cost(slc_dir, m_date, rlks, alks)
+
+    if not jobs:
+        return []
+    print('\ncomputing geometry for {} reference dates:'.format(len(jobs)))
+    results = run_jobs(run_pipeline, jobs, num_jobs, costs, max_mem,
+                       stacking_dir, min_free)
+    return print_summary(results)
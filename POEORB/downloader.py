@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#####################################################################
+# Resumable and verified downloads shared by orbit and DEM scripts  #
+# files are written to .part (resumed by HTTP Range) and renamed    #
+# when size and md5 are right, finished urls are kept in a cache of #
+# the download directory so only missing files are fetched again    #
+# Copyright (c) 2021, Lei Yuan                                      #
+#####################################################################
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# bytes read from response at a time
+CHUNK_SIZE = 1024 * 1024
+# attempts of one file and seconds waited before the first retry (doubled)
+RETRIES = 5
+BACKOFF = 2
+# seconds without data before giving up a connection
+TIMEOUT = 60
+# url cache of download directory
+CACHE_NAME = '.download_cache.json'
+
+EXAMPLE = """Example:
+  downloader.py /ly/dem https://a.b/srtm_59_05.zip https://a.b/srtm_60_05.zip
+  downloader.py /ly/dem -i urls.txt --threads 8
+"""
+
+
+def make_session(num_threads=4, auth=None):
+    """session sharing a pool of connections among threads"""
+    session = requests.Session()
+    session.auth = auth
+    adapter = requests.adapters.HTTPAdapter(pool_connections=num_threads,
+                                            pool_maxsize=num_threads)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def check_file(path, size=None, md5=None):
+    """whether file exists with expected size and md5 (None for not checked)"""
+    if not os.path.isfile(path):
+        return False
+    if size is not None and os.path.getsize(path) != size:
+        return False
+    if md5 is not None and file_md5(path) != md5.lower():
+        return False
+    return True
+
+
+class DownloadCache(object):
+    """finished downloads of a directory, {url: {'name', 'size', 'md5'}}
+
+    saved as CACHE_NAME in the directory after every finished file.
+    """
+
+    def __init__(self, directory):
+        self.cache_file = os.path.join(directory, CACHE_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, url, path, size=None, md5=None):
+        """whether url is downloaded to path and file is unchanged"""
+        entry = self.entries.get(url)
+        if entry is None or entry['name'] != os.path.basename(path):
+            return False
+        if size is not None and entry['size'] != size:
+            return False
+        if md5 is not None and entry.get('md5') not in [None, md5.lower()]:
+            return False
+        return check_file(path, entry['size'], md5)
+
+    def put(self, url, path, md5=None):
+        with self._lock:
+            self.entries[url] = {
+                'name': os.path.basename(path),
+                'size': os.path.getsize(path),
+                'md5': md5.lower() if md5 else None
+            }
+            tmp = self.cache_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.cache_file)
+
+
+def get_total_size(response, offset):
+    """size of whole file from response, None if unknown"""
+    content_range = response.headers.get('Content-Range', '')
+    m = re.search(r'/(\d+)$', content_range)
+    if m:
+        return int(m.group(1))
+    length = response.headers.get('Content-Length')
+    if length is None:
+        return None
+    if response.status_code == 206:
+        return offset + int(length)
+    return int(length)
+
+
+def fetch(session, url, part):
+    """write url to part, resume from bytes already in part, return total size"""
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+    with session.get(url, stream=True, headers=headers,
+                     timeout=TIMEOUT) as response:
+        if response.status_code == 416:
+            # nothing left, part is the whole file
+            return get_total_size(response, offset) or offset
+        response.raise_for_status()
+        if response.status_code != 206:
+            # range not supported, start again
+            offset = 0
+        total = get_total_size(response, offset)
+        with open(part, 'ab' if offset else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+    return total
+
+
+def download(url, path, session=None, size=None, md5=None, cache=None,
+             retries=RETRIES):
+    """download url to path with resume, check and retries, return True if done"""
+    if session is None:
+        session = make_session(1)
+    if cache is not None and cache.get(url, path, size, md5):
+        print('{} exists, skip it.'.format(os.path.basename(path)))
+        return True
+    part = path + '.part'
+    for attempt in range(retries):
+        if attempt:
+            wait = BACKOFF * 2**(attempt - 1)
+            print('retry {} in {} s ({}/{})'.format(os.path.basename(path), wait,
+                                                  attempt, retries - 1))
+            time.sleep(wait)
+        try:
+            total = fetch(session, url, part)
+        except requests.HTTPError as e:
+            print(e)
+            # not found or not allowed will not change
+            if e.response is not None and e.response.status_code in [401, 403, 404]:
+                break
+            continue
+        except (requests.RequestException, OSError) as e:
+            print(e)
+            continue
+        expected = size if size is not None else total
+        if expected is not None and os.path.getsize(part) < expected:
+            # connection closed early, resume next time
+            print('{} incomplete.'.format(os.path.basename(path)))
+            continue
+        if not check_file(part, expected, md5):
+            print('{} does not match size or md5, download again.'.format(
+                os.path.basename(path)))
+            os.remove(part)
+            continue
+        os.replace(part, path)
+        if cache is not None:
+            cache.put(url, path, md5)
+        print('{} downloaded.'.format(os.path.basename(path)))
+        return True
+    print('Failed to download {}'.format(url))
+    return False
+
+
+def download_all(tasks, out_dir, session=None, num_threads=4, retries=RETRIES):
+    """download tasks [(url, name, size, md5), ...] to out_dir concurrently
+
+    size and md5 may be None, return urls failed.
+    """
+    if session is None:
+        session = make_session(num_threads)
+    cache = DownloadCache(out_dir)
+
+    def run(task):
+        url, name, size, md5 = task
+        return download(url, os.path.join(out_dir, name), session, size, md5,
+                        cache, retries)
+
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        results = list(executor.map(run, tasks))
+    return [t[0] for t, ok in zip(tasks, results) if not ok]
+
+
+def url_name(url):
+    """file name of url"""
+    return url.split('?')[0].rstrip('/').split('/')[-1]
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Download files with resume, check and retries.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+    parser.add_argument('out_dir', help='directory for saving files')
+    parser.add_argument('urls', help='urls of files', nargs='*')
+    parser.add_argument('-i', dest='input', help='text file of urls (one per line)')
+    parser.add_argument('--threads',
+                        help='number of files downloaded at the same time (default: 4)',
+                        type=int,
+                        default=4)
+    inps = parser.parse_args()
+    return inps
+
+
+def main():
+    inps = cmdline_parser()
+    urls = list(inps.urls)
+    if inps.input:
+        with open(inps.input, 'r') as f:
+            urls += [i.strip() for i in f if i.strip()]
+    if not urls:
+        print('no url to download.')
+        sys.exit(1)
+    out_dir = os.path.abspath(inps.out_dir)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    tasks = [(url, url_name(url), None, None) for url in urls]
+    failed = download_all(tasks, out_dir, num_threads=inps.threads)
+    print('\n{}/{} files downloaded.'.format(len(urls) - len(failed), len(urls)))
+
+
+if __name__ == "__main__":
+    main()
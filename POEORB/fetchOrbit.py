@@ -4,7 +4,6 @@
 # Modified from https://github.com/isce-framework/isce2  #
 ##########################################################
 
-import numpy as np
 import requests
 import re
 import os
@@ -12,6 +11,9 @@ import argparse
 import datetime
 from html.parser import HTMLParser
 
+import downloader
+from orbit_catalog import OrbitCatalog, load_catalog
+
 server = 'https://scihub.copernicus.eu/gnss/'
 
 orbitMap = [('precise', 'AUX_POEORB'),
@@ -24,6 +26,9 @@ queryfmt2 = "%Y/%m/%d/"
 # Generic credentials to query and download orbit files
 credentials = ('gnssguest', 'gnssguest')
 
+# results per page of search query
+ROWS = 100
+
 
 def cmdLineParse():
     '''
@@ -36,6 +41,10 @@ def cmdLineParse():
                         help='Path of text or directory for getting images names')
     parser.add_argument('-o', '--output', dest='outdir', type=str, default='.',
                         help='Path to output directory')
+    parser.add_argument('-t', '--threads', dest='threads', type=int, default=4,
+                        help='Number of concurrent downloads (default: 4)')
+    parser.add_argument('-s', '--server', dest='server', type=str, default=server,
+                        help='Orbit hub url (default: {})'.format(server))
 
     return parser.parse_args()
 
@@ -63,20 +72,21 @@ def FileToTimeStamp(safename):
 
 class MyHTMLParser(HTMLParser):
 
-    def __init__(self, url):
+    def __init__(self, url, server=server):
         HTMLParser.__init__(self)
         self.fileList = []
         self._url = url
+        self._server = server
 
     def handle_starttag(self, tag, attrs):
         for name, val in attrs:
             if name == 'href':
-                if val.startswith("https://scihub.copernicus.eu/gnss/odata") and val.endswith(")/"):
+                if val.startswith(self._server + "odata") and val.endswith(")/"):
                     pass
                 else:
                     downloadLink = val.strip()
                     downloadLink = downloadLink.split("/Products('Quicklook')")
-                    downloadLink = downloadLink[0] + downloadLink[-1]
+                    downloadLink = ''.join(downloadLink)
                     self._url = downloadLink
 
     def handle_data(self, data):
@@ -84,45 +94,94 @@ class MyHTMLParser(HTMLParser):
             self.fileList.append((self._url, data.strip()))
 
 
+def make_session(num_threads=4):
+    '''
+    Session sharing a pool of connections among threads.
+    '''
+    return downloader.make_session(num_threads, credentials)
+
+
 def download_file(url, outdir='.', session=None):
     '''
-    Download file to specified directory.
+    Download file to specified path, resumed and checked by downloader.
     '''
 
     if session is None:
-        session = requests.session()
+        session = make_session()
 
-    path = outdir
     print('Downloading URL: ', url)
-    request = session.get(url, stream=True, verify=True, auth=credentials)
-
-    try:
-        val = request.raise_for_status()
-        success = True
-    except:
-        success = False
-
-    if success:
-        with open(path, 'wb') as f:
-            for chunk in request.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-                    f.flush()
-
-    return success
+    return downloader.download(url, outdir, session)
 
 
-def fileToRange(fname):
+def search_orbits(session, satName, orbitType, start, stop, server=server):
     '''
-    Derive datetime range from orbit file name.
+    Names and urls of all orbits of one mission and type valid within start~stop,
+    one query for the whole range (paged by ROWS).
     '''
+    delta = datetime.timedelta(days=1)
+    timebef = (start - delta).strftime(queryfmt)
+    timeaft = (stop + delta).strftime(queryfmt)
+    results = []
+    page = 0
+    while True:
+        url = server + 'search?q=( beginPosition:[{0}T00:00:00.000Z TO {1}T23:59:59.999Z] AND endPosition:[{0}T00:00:00.000Z TO {1}T23:59:59.999Z] ) AND ( (platformname:Sentinel-1 AND filename:{2}_* AND producttype:{3}))&start={4}&rows={5}'.format(
+            timebef, timeaft, satName, orbitType, page * ROWS, ROWS)
+        r = session.get(url, verify=True)
+        r.raise_for_status()
+        parser = MyHTMLParser(url, server)
+        parser.feed(r.text)
+        new = [i for i in parser.fileList if i not in results]
+        results += new
+        if len(parser.fileList) < ROWS or not new:
+            break
+        page += 1
+    return results
+
+
+def match_orbits(session, scenes, server=server):
+    '''
+    Best remote orbit of every scene, {name: Orbit (path is url)}, searched
+    once per mission and orbit type for all scenes not matched yet.
+    '''
+    matches = {}
+    missions = sorted(set(i[1] for i in scenes.values()))
+    for satName in missions:
+        for spec in orbitMap:
+            todo = {k: v for k, v in scenes.items()
+                    if v[1] == satName and k not in matches}
+            if not todo:
+                break
+            start = min(v[2] or v[0] for v in todo.values())
+            stop = max(v[0] for v in todo.values())
+            print('Searching {} {} orbits for {} scenes from {} to {}'.format(
+                satName, spec[0], len(todo), start.date(), stop.date()))
+            try:
+                results = search_orbits(session, satName, spec[1], start, stop, server)
+            except requests.RequestException as e:
+                print(e)
+                continue
+            catalog = OrbitCatalog()
+            for resulturl, result in results:
+                catalog.add(result, resulturl)
+            for name, (fileTS, _, fileTSStart) in todo.items():
+                if fileTSStart:
+                    orbit = catalog.find(satName, fileTSStart, fileTS, [spec[1]])
+                else:
+                    # only date in name, take the orbit covering the whole day
+                    orbit = catalog.find(satName, fileTS, fileTS + datetime.timedelta(days=1), [spec[1]])
+                if orbit is not None:
+                    matches[name] = orbit
+    return matches
 
-    fields = os.path.basename(fname).split('_')
-    start = datetime.datetime.strptime(fields[-2][1:16], datefmt)
-    stop = datetime.datetime.strptime(fields[-1][:15], datefmt)
-    mission = fields[0]
 
-    return (start, stop, mission)
+def download_orbits(orbits, outdir, session, num_threads=4):
+    '''
+    Download orbits concurrently (each orbit once), return names of failed orbits.
+    '''
+    orbits = {o.name: o for o in orbits}
+    tasks = [(orbits[name].path, name, None, None) for name in sorted(orbits)]
+    failed = downloader.download_all(tasks, outdir, session, num_threads)
+    return [name for name in sorted(orbits) if orbits[name].path in failed]
 
 
 def get_sentinel1_from_zip(images_path):
@@ -172,57 +231,44 @@ def get_sentinel1(path):
         return get_sentinel1_from_text(path)
 
 
-if __name__ == '__main__':
+def main():
     '''
     Main driver.
     '''
 
     inps = cmdLineParse()
 
-    sentinel_names = get_sentinel1(inps.input)
-    for name in sentinel_names:
-        fileTS, satName, fileTSStart = FileToTimeStamp(name)
-        print('Task: ' + str(sentinel_names.index(name) + 1) + '/' + str(len(sentinel_names)))
-        print('Reference time: ', fileTS)
-        print('Satellite name: ', satName)
-        match = None
-        session = requests.Session()
+    if not os.path.isdir(inps.outdir):
+        os.makedirs(inps.outdir)
+    # orbits already downloaded
+    local_catalog = load_catalog(inps.outdir)
 
-        for spec in orbitMap:
-            oType = spec[0]
-            delta = datetime.timedelta(days=1)
-            timebef = (fileTS - delta).strftime(queryfmt)
-            timeaft = (fileTS + delta).strftime(queryfmt)
-            url = server + 'search?q=( beginPosition:[{0}T00:00:00.000Z TO {1}T23:59:59.999Z] AND endPosition:[{0}T00:00:00.000Z TO {1}T23:59:59.999Z] ) AND ( (platformname:Sentinel-1 AND filename:{2}_* AND producttype:{3}))&start=0&rows=100'.format(
-                timebef, timeaft, satName, spec[1])
+    scenes = {}
+    for name in get_sentinel1(inps.input):
+        fileTS, satName, fileTSStart = FileToTimeStamp(name)
+        if fileTSStart:
+            orbit = local_catalog.find(satName, fileTSStart, fileTS)
+            if orbit is not None:
+                print('{} exists for {}, skip it.'.format(orbit.name, name))
+                continue
+        scenes[name] = (fileTS, satName, fileTSStart)
+    if not scenes:
+        print('All orbits exist.')
+        return
+
+    session = make_session(inps.threads)
+    matches = match_orbits(session, scenes, inps.server)
+    for name in sorted(scenes):
+        if name not in matches:
+            print('Failed to find {1} orbits for tref {0}'.format(
+                scenes[name][0], scenes[name][1]))
 
-            success = False
-            match = None
+    failed = download_orbits(matches.values(), inps.outdir, session, inps.threads)
+    for name in failed:
+        print('Failed to download: ', name)
+    print('{}/{} scenes matched, {} orbits downloaded.'.format(
+        len(matches), len(scenes), len(set(o.name for o in matches.values())) - len(failed)))
 
-            try:
-                r = session.get(url, verify=True, auth=credentials)
-                r.raise_for_status()
-                parser = MyHTMLParser(url)
-                parser.feed(r.text)
-                for resulturl, result in parser.fileList:
-                    tbef, taft, mission = fileToRange(os.path.basename(result))
-                    if (tbef <= fileTSStart) and (taft >= fileTS):
-                        matchFileName = result
-                        match = resulturl
-
-                if match is not None:
-                    success = True
-            except:
-                pass
-
-            if success:
-                break
 
-        if match is not None:
-            output = os.path.join(inps.outdir, matchFileName)
-            res = download_file(match, output, session)
-            if res is False:
-                print('Failed to download URL: ', match)
-        else:
-            print('Failed to find {1} orbits for tref {0}'.format(
-                fileTS, satName))
+if __name__ == '__main__':
+    main()
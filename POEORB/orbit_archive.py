@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#####################################################################
+# State vectors of Sentinel-1 orbit files (.EOF) as NumPy arrays    #
+# every EOF is parsed once by iterparse and cached as .npz next to  #
+# it, positions and velocities are interpolated at any times        #
+# Copyright (c) 2021, Lei Yuan                                      #
+#####################################################################
+
+import argparse
+import datetime
+import os
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from orbit_catalog import load_catalog, parse_s1_name
+
+EPOCH = np.datetime64('1970-01-01T00:00:00', 'us')
+
+EXAMPLE = """Example:
+  # parse all orbit files into .npz
+  orbit_archive.py /ly/orbits --jobs 4
+  # position and velocity at center of scenes
+  orbit_archive.py /ly/orbits --zip_dir /ly/zip_dir
+"""
+
+
+def to_seconds(times):
+    """seconds since 1970 (UTC) of datetimes, datetime64 or numbers"""
+    times = np.atleast_1d(np.asarray(times))
+    if times.dtype.kind in 'fiu':
+        return times.astype(np.float64)
+    times = times.astype('datetime64[us]')
+    return (times - EPOCH).astype(np.int64) / 1e6
+
+
+def to_datetime(seconds):
+    """naive datetime (UTC) of seconds since 1970"""
+    return (EPOCH + np.timedelta64(int(round(seconds * 1e6)), 'us')).item()
+
+
+def parse_eof(eof_file):
+    """{'time', 'pos', 'vel', 'abs_orbit'} of all state vectors in eof_file"""
+    times = []
+    values = []
+    orbits = []
+    for _, elem in ET.iterparse(eof_file, events=('end',)):
+        # tags may have namespace
+        if elem.tag.rsplit('}', 1)[-1] != 'OSV':
+            continue
+        osv = {i.tag.rsplit('}', 1)[-1]: i.text for i in elem}
+        times.append(osv['UTC'].split('=')[-1])
+        values.append([float(osv[k]) for k in ['X', 'Y', 'Z', 'VX', 'VY', 'VZ']])
+        orbits.append(int(osv['Absolute_Orbit']))
+        # free parsed vectors
+        elem.clear()
+    values = np.array(values, dtype=np.float64).reshape(-1, 6)
+    return {
+        'time': to_seconds(np.array(times, dtype='datetime64[us]')),
+        'pos': values[:, 0:3],
+        'vel': values[:, 3:6],
+        'abs_orbit': np.array(orbits, dtype=np.int32)
+    }
+
+
+def get_npz_file(eof_file):
+    return os.path.splitext(eof_file)[0] + '.npz'
+
+
+def load_state_vectors(eof_file):
+    """state vectors of eof_file, parsed and cached as .npz if cache is older"""
+    npz_file = get_npz_file(eof_file)
+    if os.path.isfile(npz_file) and \
+            os.path.getmtime(npz_file) >= os.path.getmtime(eof_file):
+        with np.load(npz_file) as data:
+            return {k: data[k] for k in data.files}
+    sv = parse_eof(eof_file)
+    tmp = npz_file + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, **sv)
+        os.replace(tmp, npz_file)
+    except OSError:
+        # read-only archive, only this run parses it
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+    return sv
+
+
+def interpolate(sv, times):
+    """positions and velocities (n x 3) at times (seconds), nan out of range
+
+    cubic Hermite spline of positions and velocities of the two neighbors.
+    """
+    t = sv['time']
+    times = to_seconds(times)
+    i = np.clip(np.searchsorted(t, times) - 1, 0, t.size - 2)
+    h = (t[i + 1] - t[i])[:, None]
+    s = ((times - t[i]) / h[:, 0])[:, None]
+    p0, p1 = sv['pos'][i], sv['pos'][i + 1]
+    v0, v1 = sv['vel'][i] * h, sv['vel'][i + 1] * h
+    s2, s3 = s * s, s * s * s
+    pos = (2 * s3 - 3 * s2 + 1) * p0 + (s3 - 2 * s2 + s) * v0 + \
+        (-2 * s3 + 3 * s2) * p1 + (s3 - s2) * v1
+    vel = ((6 * s2 - 6 * s) * p0 + (3 * s2 - 4 * s + 1) * v0 +
+           (-6 * s2 + 6 * s) * p1 + (3 * s2 - 2 * s) * v1) / h
+    out = (times < t[0]) | (times > t[-1])
+    pos[out] = np.nan
+    vel[out] = np.nan
+    return pos, vel
+
+
+class OrbitArchive(object):
+    """orbit files of a directory with state vectors loaded on demand
+
+    archive.interpolate('S1A', times) -> positions, velocities of times,
+    every time from the best orbit covering it.
+    """
+
+    def __init__(self, orbit_dir):
+        self.orbit_dir = os.path.abspath(orbit_dir)
+        self.catalog = load_catalog(self.orbit_dir)
+        self._vectors = {}
+
+    def state_vectors(self, orbit):
+        if orbit.path not in self._vectors:
+            self._vectors[orbit.path] = load_state_vectors(orbit.path)
+        return self._vectors[orbit.path]
+
+    def interpolate(self, mission, times):
+        """positions and velocities (n x 3) of mission at times, nan if no orbit"""
+        seconds = to_seconds(times)
+        pos = np.full((seconds.size, 3), np.nan)
+        vel = np.full((seconds.size, 3), np.nan)
+        # orbit is searched once for times within the same minute,
+        # times of one orbit are interpolated together
+        groups = {}
+        minutes = np.floor(seconds / 60)
+        for minute in np.unique(minutes):
+            index = np.flatnonzero(minutes == minute)
+            start = to_datetime(minute * 60)
+            orbit = self.catalog.find(mission, start,
+                                      start + datetime.timedelta(seconds=60))
+            if orbit is not None:
+                groups.setdefault(orbit, []).extend(index)
+                continue
+            for k in index:
+                orbit = self.catalog.find(
+                    mission, to_datetime(seconds[k]))
+                if orbit is not None:
+                    groups.setdefault(orbit, []).append(k)
+        for orbit, index in groups.items():
+            pos[index], vel[index] = interpolate(self.state_vectors(orbit),
+                                                 seconds[index])
+        return pos, vel
+
+    def interpolate_scenes(self, names):
+        """center times, positions and velocities of Sentinel-1 scenes
+
+        scenes without orbit get nan, names not of Sentinel-1 are left out.
+        """
+        scenes = {}
+        for name in names:
+            s1 = parse_s1_name(name)
+            if s1 is not None:
+                mission, start, stop = s1
+                scenes.setdefault(mission, []).append(
+                    (name, start + (stop - start) / 2))
+        results = {}
+        for mission, items in scenes.items():
+            times = [i[1] for i in items]
+            pos, vel = self.interpolate(mission, times)
+            for k, (name, time) in enumerate(items):
+                results[name] = (time, pos[k], vel[k])
+        return results
+
+
+def build_cache(orbit_dir, num_jobs=1):
+    """parse orbit files without .npz concurrently, return number parsed"""
+    catalog = load_catalog(orbit_dir)
+    eof_files = []
+    for orbits in catalog.orbits.values():
+        for orbit in orbits:
+            npz_file = get_npz_file(orbit.path)
+            if not os.path.isfile(npz_file) or \
+                    os.path.getmtime(npz_file) < os.path.getmtime(orbit.path):
+                eof_files.append(orbit.path)
+    if num_jobs <= 1:
+        for f in eof_files:
+            load_state_vectors(f)
+    else:
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            list(executor.map(load_state_vectors, eof_files, chunksize=8))
+    return len(eof_files)
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Cache state vectors of Sentinel-1 orbit files and interpolate them.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+    parser.add_argument('orbit_dir', help='directory of orbit files (.EOF)')
+    parser.add_argument('--zip_dir',
+                        help='directory of Sentinel-1 zips, print orbit at center of scenes',
+                        default=None)
+    parser.add_argument('--jobs',
+                        help='number of orbit files parsed at the same time (defaults: 1)',
+                        default=1,
+                        type=int)
+    inps = parser.parse_args()
+    return inps
+
+
+def main():
+    inps = cmdline_parser()
+    for d in [inps.orbit_dir, inps.zip_dir]:
+        if d and not os.path.isdir(d):
+            print('{} not exists.'.format(d))
+            sys.exit(1)
+
+    num = build_cache(inps.orbit_dir, inps.jobs)
+    print('{} orbit files parsed in {}'.format(num, inps.orbit_dir))
+    if not inps.zip_dir:
+        return
+
+    archive = OrbitArchive(inps.orbit_dir)
+    names = sorted(i for i in os.listdir(inps.zip_dir) if i.endswith('.zip'))
+    results = archive.interpolate_scenes(names)
+    print('\n{:<70}{:>16}{:>16}{:>16}'.format('scene', 'x', 'y', 'z'))
+    for name in names:
+        if name not in results:
+            continue
+        time, pos, vel = results[name]
+        if np.isnan(pos[0]):
+            print('{:<70}{:>48}'.format(name[:67], 'no orbit'))
+        else:
+            print('{:<70}{:>16.3f}{:>16.3f}{:>16.3f}'.format(name[:67], *pos))
+
+
+if __name__ == "__main__":
+    main()
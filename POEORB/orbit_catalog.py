@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#####################################################################
+# Catalog of Sentinel-1 orbit files (.EOF) indexed by validity time #
+# names are parsed once into sorted intervals of each mission, the  #
+# orbit covering an acquisition is found by binary search           #
+# Copyright (c) 2021, Lei Yuan                                      #
+#####################################################################
+
+import argparse
+import bisect
+import datetime
+import os
+import re
+import sys
+from collections import namedtuple
+
+DATE_FMT = '%Y%m%dT%H%M%S'
+
+# orbit types in order of preference
+ORBIT_TYPES = ['AUX_POEORB', 'AUX_RESORB']
+
+# S1A_OPER_AUX_POEORB_OPOD_20210301T121601_V20210208T225942_20210210T005942.EOF
+ORBIT_RE = re.compile(
+    r'(S1[A-D])_OPER_(AUX_\w{6})_OPOD_(\d{8}T\d{6})_V(\d{8}T\d{6})_(\d{8}T\d{6})')
+# S1A_IW_SLC__1SDV_20200101T102030_20200101T102057_030000_036F0F_ABCD
+S1_RE = re.compile(r'(S1[A-D])_\w{2}_\w{4}_\w{4}_(\d{8}T\d{6})_(\d{8}T\d{6})')
+
+Orbit = namedtuple('Orbit',
+                   ['mission', 'type', 'produced', 'start', 'stop', 'name',
+                    'path'])
+
+_catalogs = {}
+
+EXAMPLE = """Example:
+  orbit_catalog.py /ly/orbits /ly/zip_dir
+  orbit_catalog.py /ly/orbits /ly/zip_dir --missing
+"""
+
+
+def to_time(s):
+    return datetime.datetime.strptime(s, DATE_FMT)
+
+
+def parse_orbit_name(name):
+    """Orbit of orbit file name, None if it is not an orbit file"""
+    m = ORBIT_RE.search(os.path.basename(name))
+    if m is None:
+        return None
+    mission, orbit_type, produced, start, stop = m.groups()
+    return Orbit(mission, orbit_type, to_time(produced), to_time(start),
+                 to_time(stop), m.group(0) + '.EOF', name)
+
+
+def parse_s1_name(name):
+    """mission, start and stop time of Sentinel-1 zip/SAFE name, None if not matched"""
+    m = S1_RE.search(os.path.basename(name))
+    if m is None:
+        return None
+    return m.group(1), to_time(m.group(2)), to_time(m.group(3))
+
+
+class OrbitCatalog(object):
+    """orbits of each mission sorted by start of validity
+
+    catalog.find('S1A', start, stop) -> Orbit covering start~stop or None,
+    precise orbits are preferred over restituted, newer over older.
+    """
+
+    def __init__(self, names=None):
+        self.orbits = {}
+        self.starts = {}
+        # longest validity of each mission limits the backward scan
+        self.max_span = {}
+        for name in names or []:
+            self.add(name)
+
+    def add(self, name, path=None):
+        """add orbit file (path or name, path is kept as location), return Orbit"""
+        orbit = parse_orbit_name(name)
+        if orbit is None:
+            return None
+        if path is not None:
+            orbit = orbit._replace(path=path)
+        orbits = self.orbits.setdefault(orbit.mission, [])
+        starts = self.starts.setdefault(orbit.mission, [])
+        i = bisect.bisect_right(starts, orbit.start)
+        starts.insert(i, orbit.start)
+        orbits.insert(i, orbit)
+        span = orbit.stop - orbit.start
+        if span > self.max_span.get(orbit.mission, datetime.timedelta(0)):
+            self.max_span[orbit.mission] = span
+        return orbit
+
+    def __len__(self):
+        return sum(len(i) for i in self.orbits.values())
+
+    def covering(self, mission, start, stop=None):
+        """all orbits of mission whose validity covers start~stop"""
+        if stop is None:
+            stop = start
+        starts = self.starts.get(mission)
+        if not starts:
+            return []
+        orbits = self.orbits[mission]
+        # orbits starting after start cannot cover it
+        i = bisect.bisect_right(starts, start)
+        # orbits starting before stop - max_span cannot reach stop
+        j = bisect.bisect_left(starts, stop - self.max_span[mission])
+        return [o for o in orbits[j:i] if o.stop >= stop]
+
+    def find(self, mission, start, stop=None, orbit_types=ORBIT_TYPES):
+        """best orbit covering start~stop, None if not found"""
+        orbits = [
+            o for o in self.covering(mission, start, stop)
+            if o.type in orbit_types
+        ]
+        if not orbits:
+            return None
+        return min(orbits,
+                   key=lambda o: (orbit_types.index(o.type), -o.produced.timestamp()))
+
+    def find_for_s1(self, s1_name, orbit_types=ORBIT_TYPES):
+        """best orbit for Sentinel-1 zip/SAFE name"""
+        times = parse_s1_name(s1_name)
+        if times is None:
+            return None
+        return self.find(*times, orbit_types=orbit_types)
+
+
+def scan_orbit_dir(orbit_dir):
+    """catalog of .EOF files in orbit_dir"""
+    catalog = OrbitCatalog()
+    with os.scandir(orbit_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.EOF') and entry.is_file():
+                catalog.add(entry.name, entry.path)
+    return catalog
+
+
+def load_catalog(orbit_dir):
+    """catalog of orbit_dir, scanned again only if the directory changed"""
+    orbit_dir = os.path.abspath(orbit_dir)
+    stamp = os.stat(orbit_dir).st_mtime_ns
+    item = _catalogs.get(orbit_dir)
+    if item is None or item[0] != stamp:
+        item = (stamp, scan_orbit_dir(orbit_dir))
+        _catalogs[orbit_dir] = item
+    return item[1]
+
+
+def cmdline_parser():
+    parser = argparse.ArgumentParser(
+        description='Find orbit files of Sentinel-1 zips using orbit catalog.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=EXAMPLE)
+    parser.add_argument('orbit_dir', help='directory of orbit files (.EOF)')
+    parser.add_argument('zip_dir', help='directory of Sentinel-1 zips')
+    parser.add_argument('--missing',
+                        help='only print zips without orbit',
+                        action='store_true')
+    inps = parser.parse_args()
+    return inps
+
+
+def main():
+    inps = cmdline_parser()
+    for d in [inps.orbit_dir, inps.zip_dir]:
+        if not os.path.isdir(d):
+            print('{} not exists.'.format(d))
+            sys.exit(1)
+
+    catalog = load_catalog(inps.orbit_dir)
+    print('{} orbit files in {}\n'.format(len(catalog), inps.orbit_dir))
+    names = sorted(i for i in os.listdir(inps.zip_dir) if i.endswith('.zip'))
+    num_missing = 0
+    for name in names:
+        orbit = catalog.find_for_s1(name)
+        if orbit is None:
+            num_missing += 1
+            print('{} -> None'.format(name))
+        elif not inps.missing:
+            print('{} -> {}'.format(name, orbit.name))
+    print('\n{}/{} zips without orbit.'.format(num_missing, len(names)))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,9 @@ import glob
 import shutil
 import re
 
+from cmd_runner import run_cmd
+from gamma_par import load_par, read_gamma_par
+
 EXAMPLE = """Example:
   ./sbas_mli_ad.py ./stacking 20200202 ./
 """
@@ -45,16 +48,6 @@ def cmdline_parser():
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def gen_lon_lat(stacking_dir, supermaster, sm_dir, geo_dir):
     # get files
     dem_par = os.path.join(sm_dir, 'dem_seg.par')
@@ -65,12 +58,13 @@ def gen_lon_lat(stacking_dir, supermaster, sm_dir, geo_dir):
     # length of inerferogram
     length = read_gamma_par(diff_par, 'az_samp_1')
     # Extract geocoding information to generate the lon and lat matrices
-    lat = float(read_gamma_par(dem_par, 'corner_lat').split()[0])
-    lon = float(read_gamma_par(dem_par, 'corner_lon').split()[0])
-    lat_step = float(read_gamma_par(dem_par, 'post_lat').split()[0])
-    lon_step = float(read_gamma_par(dem_par, 'post_lon').split()[0])
-    length_dem = int(read_gamma_par(dem_par, 'nlines'))
-    width_dem = int(read_gamma_par(dem_par, 'width'))
+    dem_seg_par = load_par(dem_par)
+    lat = float(dem_seg_par['corner_lat'])
+    lon = float(dem_seg_par['corner_lon'])
+    lat_step = float(dem_seg_par['post_lat'])
+    lon_step = float(dem_seg_par['post_lon'])
+    length_dem = dem_seg_par['nlines']
+    width_dem = dem_seg_par['width']
     lat1 = lat + lat_step * (length_dem - 1)
     lat1 = round(float(lat1), 6)
     lon1 = lon + lon_step * (width_dem - 1)
@@ -79,33 +73,33 @@ def gen_lon_lat(stacking_dir, supermaster, sm_dir, geo_dir):
     os.chdir(geo_dir)
     # longitude file
     cmd = f"gmt grdmath -R{lon}/{lon1}/{lat1}/{lat} -I{width_dem}+/{length_dem}+ X = geo.grd"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # take lons
     cmd = "gmt grd2xyz geo.grd -ZTLf > geo.raw"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # set lons to 4-byte floats
     cmd = "swap_bytes geo.raw geolon.raw 4"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # geocode
     cmd = f"geocode {lt_fine} geolon.raw {width_dem} {supermaster + '.lon'} {width} {length} 2 0"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
 
     # latitude file
     cmd = f"gmt grdmath -R{lon}/{lon1}/{lat1}/{lat} -I{width_dem}+/{length_dem}+ Y = geo.grd"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # take lats
     cmd = "gmt grd2xyz geo.grd -ZTLf > geo.raw"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # set lats to 4-byte floats
     cmd = "swap_bytes geo.raw geolat.raw 4"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # geocode
     cmd = f"geocode {lt_fine} geolat.raw {width_dem} {supermaster + '.lat'} {width} {length} 2 0"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
 
     # cleaning
     cmd = "rm -rf geo.raw geolon.raw geolat.raw geo.grd gmt.history"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
 
 
 def prep_sb_dir(stacking_dir, supermaster, sm_dir, insar_dir):
@@ -147,11 +141,11 @@ def prep_sb_dir(stacking_dir, supermaster, sm_dir, insar_dir):
         mli1 = glob.glob(os.path.join(ifg_in_dir, '*.pwr1'))[0]
         mli1_dst = os.path.join(ifg_out_dir, ifg[0:8] + '.rslc')
         call_str = f"real_to_cpx {mli1} - {mli1_dst} {width} 0"
-        os.system(call_str)
+        run_cmd(call_str, tag=ifg)
         mli2 = glob.glob(os.path.join(ifg_in_dir, '*.pwr2'))[0]
         mli2_dst = os.path.join(ifg_out_dir, ifg[9:17] + '.rslc')
         call_str = f"real_to_cpx {mli2} - {mli2_dst} {width} 0"
-        os.system(call_str)
+        run_cmd(call_str, tag=ifg)
         # write .rslc.par
         mli_par_path = os.path.join(ifg_out_dir, supermaster + '.rslc.par')
         with open(mli_par_path, 'w+') as f:
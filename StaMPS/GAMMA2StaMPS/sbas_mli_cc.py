@@ -23,6 +23,9 @@ import glob
 import shutil
 import re
 
+from cmd_runner import run_cmd
+from gamma_par import load_par, read_gamma_par
+
 EXAMPLE = """Example:
   ./perp_sbas_mli.py ./stacking 20200202 ./
 """
@@ -44,16 +47,6 @@ def cmdline_parser():
     return inps
 
 
-def read_gamma_par(par_file, keyword):
-    value = ''
-    with open(par_file, 'r') as f:
-        for l in f.readlines():
-            if l.count(keyword) == 1:
-                tmp = l.split(':')
-                value = tmp[1].strip()
-    return value
-
-
 def gen_lon_lat(stacking_dir, supermaster, geo_dir):
     # get files
     sm_dir = glob.glob(os.path.join(stacking_dir, '*' + supermaster + '*'))[0]
@@ -66,12 +59,13 @@ def gen_lon_lat(stacking_dir, supermaster, geo_dir):
     # length of inerferogram
     length = read_gamma_par(diff_par, 'az_samp_1')
     # Extract geocoding information to generate the lon and lat matrices
-    lat = float(read_gamma_par(dem_par, 'corner_lat').split()[0])
-    lon = float(read_gamma_par(dem_par, 'corner_lon').split()[0])
-    lat_step = float(read_gamma_par(dem_par, 'post_lat').split()[0])
-    lon_step = float(read_gamma_par(dem_par, 'post_lon').split()[0])
-    length_dem = int(read_gamma_par(dem_par, 'nlines'))
-    width_dem = int(read_gamma_par(dem_par, 'width'))
+    dem_seg_par = load_par(dem_par)
+    lat = float(dem_seg_par['corner_lat'])
+    lon = float(dem_seg_par['corner_lon'])
+    lat_step = float(dem_seg_par['post_lat'])
+    lon_step = float(dem_seg_par['post_lon'])
+    length_dem = dem_seg_par['nlines']
+    width_dem = dem_seg_par['width']
     lat1 = lat + lat_step * (length_dem - 1)
     lat1 = round(float(lat1), 6)
     lon1 = lon + lon_step * (width_dem - 1)
@@ -80,33 +74,33 @@ def gen_lon_lat(stacking_dir, supermaster, geo_dir):
     os.chdir(geo_dir)
     # longitude file
     cmd = f"gmt grdmath -R{lon}/{lon1}/{lat1}/{lat} -I{width_dem}+/{length_dem}+ X = geo.grd"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # take lons
     cmd = "gmt grd2xyz geo.grd -ZTLf > geo.raw"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # set lons to 4-byte floats
     cmd = "swap_bytes geo.raw geolon.raw 4"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # geocode
     cmd = f"geocode {lt_fine} geolon.raw {width_dem} {supermaster + '.lon'} {width} {length} 2 0"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
 
     # latitude file
     cmd = f"gmt grdmath -R{lon}/{lon1}/{lat1}/{lat} -I{width_dem}+/{length_dem}+ Y = geo.grd"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # take lats
     cmd = "gmt grd2xyz geo.grd -ZTLf > geo.raw"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # set lats to 4-byte floats
     cmd = "swap_bytes geo.raw geolat.raw 4"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
     # geocode
     cmd = f"geocode {lt_fine} geolat.raw {width_dem} {supermaster + '.lat'} {width} {length} 2 0"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
 
     # cleaning
     cmd = "rm -rf geo.raw geolon.raw geolat.raw geo.grd gmt.history"
-    os.system(cmd)
+    run_cmd(cmd, tag=supermaster)
 
 
 def prep_files(stacking_dir, supermaster, output_dir):